@@ -1,14 +1,21 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from prometheus_fastapi_instrumentator import Instrumentator
 
+from rei_s.services.admission import ExecutorFullError
 from rei_s.utils import lifespan
-from rei_s.routes import files, health
+from rei_s.routes import files, health, jobs
 
 
 def create() -> FastAPI:
     app = FastAPI(lifespan=lifespan)
     app.include_router(files.router)
+    app.include_router(jobs.router)
     app.include_router(health.router)
     Instrumentator().instrument(app)
 
+    @app.exception_handler(ExecutorFullError)
+    async def executor_full_handler(_request: Request, e: ExecutorFullError) -> JSONResponse:
+        return JSONResponse(status_code=503, content={"detail": str(e)}, headers={"Retry-After": str(e.retry_after)})
+
     return app
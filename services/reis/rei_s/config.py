@@ -4,7 +4,7 @@ import re
 import tempfile
 from typing import Annotated, Literal, Mapping, Self
 
-from pydantic import Field, SecretStr, model_validator
+from pydantic import BaseModel, Field, SecretStr, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -54,23 +54,89 @@ def check_valid_s3_bucket_name(bucket_name: str | None) -> None:
         raise ValueError("Bucket name cannot be formatted like an IP address")
 
 
+class AzureOpenAIDeployment(BaseModel, frozen=True):
+    """A further deployment of the Azure OpenAI embedding model, e.g., in another region."""
+
+    endpoint: str
+    deployment_name: str
+    # default to the values of the main deployment
+    api_key: SecretStr | None = None
+    rate_limit_rpm: Annotated[int, Field(gt=0)] | None = None
+    rate_limit_tpm: Annotated[int, Field(gt=0)] | None = None
+
+
 # will be fixed in next mypy release
 # TODO: remove `type: ignore` when mypy was updated
 class Config(BaseSettings, frozen=True):  # type: ignore
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", extra="ignore", env_ignore_empty=True)
 
     workers: Annotated[int, Field(gt=0)] = 1
+    # number of files waiting for a worker, further uploads are rejected with 503
+    workers_queue_size: Annotated[int, Field(ge=0)] = 100
+    # seconds after which rejected clients should retry
+    workers_retry_after: Annotated[int, Field(gt=0)] = 10
     metrics_port: Annotated[int, Field(ge=0)] = 9200
     batch_size: Annotated[int, Field(gt=0)] | None = None
     filesize_threshold: Annotated[int, Field(gt=0)] = 10**5
+    # defaults to the number of workers, 0 disables the pool
+    process_pool_size: Annotated[int, Field(ge=0)] | None = None
+    process_pool_max_tasks: Annotated[int, Field(gt=0)] = 100
+    process_pool_max_rss_mb: Annotated[int, Field(gt=0)] = 2048
+    # large pdfs are split into ranges of this many pages, which are extracted in parallel by the process pool
+    pdf_pages_per_task: Annotated[int, Field(gt=0)] = 50
+    # number of long-running LibreOffice instances converting office documents, 0 starts LibreOffice for every file
+    office_pool_size: Annotated[int, Field(ge=0)] = 0
+    office_pool_timeout: Annotated[int, Field(gt=0)] = 120
+    office_pool_max_conversions: Annotated[int, Field(gt=0)] = 200
+    # maximum number of files of a format family processed at the same time, unlimited if not given
+    format_concurrency_office: Annotated[int, Field(gt=0)] | None = 2
+    format_concurrency_pdf: Annotated[int, Field(gt=0)] | None = None
+    format_concurrency_transcription: Annotated[int, Field(gt=0)] | None = None
+
+    # directory of the durable queue of asynchronous ingestion jobs, should be on a persistent volume.
+    # Asynchronous ingestion jobs are disabled if not given.
+    jobs_path: str | None = None
+    # defaults to the number of workers
+    jobs_concurrency: Annotated[int, Field(gt=0)] | None = None
+    jobs_retention_hours: Annotated[int, Field(gt=0)] = 24 * 7
+
+    # number of batches which are embedded concurrently while the previous batch is written to the vector store
+    embeddings_concurrency: Annotated[int, Field(gt=0)] = 2
+    # chunks of concurrent uploads are merged into embedding requests of up to this size, 0 disables merging
+    embeddings_batch_size: Annotated[int, Field(ge=0)] = 256
+    embeddings_batch_max_delay_ms: Annotated[int, Field(ge=0)] = 10
+    # quota of the embedding model shared by all workers, unlimited if not given
+    embeddings_rate_limit_rpm: Annotated[int, Field(gt=0)] | None = None
+    embeddings_rate_limit_tpm: Annotated[int, Field(gt=0)] | None = None
+    # SQLite file where the state of the rate limiter is shared between worker processes
+    embeddings_rate_limit_path: str | None = None
+    embeddings_max_retries: Annotated[int, Field(ge=0)] = 20
+    # connection pool of the clients for the embedding model, shared by all requests of a process
+    embeddings_http_max_connections: Annotated[int, Field(gt=0)] = 100
+    embeddings_http_keepalive_expiry: Annotated[float, Field(ge=0)] = 60
+    embeddings_http_timeout: Annotated[float, Field(gt=0)] = 60
+    # needs the optional package `h2`
+    embeddings_http2: bool = False
 
     embeddings_type: Literal["azure-openai", "openai", "random-test-embeddings", "ollama", "bedrock", "nvidia"]
+    # size of the embedding vectors, determined by a call to the embedding model if not given
+    embeddings_dimensions: Annotated[int, Field(gt=0)] | None = None
+    # json file where the determined sizes of the embedding vectors are remembered across restarts
+    embeddings_metadata_path: str | None = None
+    # SQLite file where the embeddings of chunks are cached, disabled if not given
+    embeddings_cache_path: str | None = None
+    embeddings_cache_max_size_mb: Annotated[int, Field(gt=0)] = 1024
+    # in-memory cache of the embeddings of search queries, 0 disables the cache
+    embeddings_query_cache_size: Annotated[int, Field(ge=0)] = 1024
+    embeddings_query_cache_ttl: Annotated[int, Field(gt=0)] = 3600
     # needed for Azure OpenAI
     embeddings_azure_openai_endpoint: str | None = None
     embeddings_azure_openai_api_key: SecretStr | None = None
     embeddings_azure_openai_api_version: str | None = None
     embeddings_azure_openai_model_name: str | None = None
     embeddings_azure_openai_deployment_name: str | None = None
+    # further deployments of the same model, given as JSON list, the requests are spread over all deployments
+    embeddings_azure_openai_pool: tuple[AzureOpenAIDeployment, ...] = ()
     # needed for Bedrock
     embeddings_bedrock_model_id: str | None = None
     embeddings_bedrock_aws_access_key_id: SecretStr | None = None
@@ -93,8 +159,12 @@ class Config(BaseSettings, frozen=True):  # type: ignore
     stt_azure_openai_whisper_api_key: SecretStr | None = None
     stt_azure_openai_whisper_api_version: str | None = None
     stt_azure_openai_whisper_deployment_name: str | None = None
+    # maximum number of segments of all files transcribed at the same time
+    stt_concurrency: Annotated[int, Field(gt=0)] = 4
 
     store_type: Literal["azure-ai-search", "pgvector", "dev-null"]
+    # number of vector store adapters (one per index) which are kept for reuse
+    store_adapter_cache_size: Annotated[int, Field(ge=0)] = 16
     # needed for Azure AI Search vectorstore
     store_azure_ai_search_service_endpoint: str | None = None
     store_azure_ai_search_service_api_key: SecretStr | None = None
@@ -102,6 +172,7 @@ class Config(BaseSettings, frozen=True):  # type: ignore
     # needed for pgvector vectorstore
     store_pgvector_url: str | None = None
     store_pgvector_index_name: str = "index"
+    store_pgvector_pool_size: Annotated[int, Field(gt=0)] = 5
 
     file_store_type: Literal["s3", "filesystem"] | None = None
     # needed for S3 filestore
@@ -112,6 +183,9 @@ class Config(BaseSettings, frozen=True):  # type: ignore
     file_store_s3_region_name: str | None = None
     # needed for filesystem filestore
     file_store_filesystem_basepath: str | None = None
+    # seconds for which the existence of a file is remembered, 0 disables the cache
+    file_store_exists_cache_ttl: Annotated[float, Field(ge=0)] = 60
+    file_store_exists_concurrency: Annotated[int, Field(gt=0)] = 16
 
     @model_validator(mode="after")
     def store_dependend_requirements(self) -> Self:
@@ -1,5 +1,75 @@
-from prometheus_client import Counter
+from prometheus_client import Counter, Gauge, Histogram
 
 files_processed_counter = Counter("files_processed_total", "Number of files that have been processed.")
 
 files_added_to_queue = Counter("files_added_to_queue_total", "Number of files that have been processed.")
+
+process_pool_size = Gauge("process_pool_size", "Number of worker processes in the process pool.")
+
+process_pool_busy_workers = Gauge("process_pool_busy_workers", "Number of busy worker processes.")
+
+process_pool_recycles = Counter(
+    "process_pool_recycles_total", "Number of worker processes which were recycled.", ["reason"]
+)
+
+office_pool_busy_instances = Gauge("office_pool_busy_instances", "Number of busy LibreOffice instances.")
+
+office_pool_restarts = Counter(
+    "office_pool_restarts_total", "Number of LibreOffice instances which were restarted.", ["reason"]
+)
+
+page_extraction_seconds = Histogram(
+    "page_extraction_seconds", "Time needed to extract the text of a single page.", ["format", "parser"]
+)
+
+embeddings_cache_hits = Counter("embeddings_cache_hits_total", "Number of chunks whose embedding was cached.")
+
+embeddings_cache_misses = Counter("embeddings_cache_misses_total", "Number of chunks which needed to be embedded.")
+
+embeddings_cache_hit_ratio = Gauge("embeddings_cache_hit_ratio", "Ratio of chunks whose embedding was cached.")
+
+query_embeddings_cache_lookups = Counter(
+    "query_embeddings_cache_lookups_total", "Number of lookups in the query embeddings cache.", ["result"]
+)
+
+executor_queue_depth = Gauge("executor_queue_depth", "Number of files waiting for a worker.")
+
+executor_wait_seconds = Histogram("executor_wait_seconds", "Time files waited for a worker.")
+
+executor_rejected = Counter("executor_rejected_total", "Number of files rejected since too many were waiting.")
+
+format_family_active = Gauge("format_family_active", "Number of files processed per format family.", ["family"])
+
+format_family_wait_seconds = Histogram(
+    "format_family_wait_seconds", "Time files waited for a free slot of their format family.", ["family"]
+)
+
+embeddings_request_texts = Histogram(
+    "embeddings_request_texts",
+    "Number of texts per request to the embedding model.",
+    buckets=[1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048],
+)
+
+embeddings_rate_limited = Counter(
+    "embeddings_rate_limited_total", "Number of requests to the embedding model rejected with 429."
+)
+
+embeddings_rate_limit_wait_seconds = Histogram(
+    "embeddings_rate_limit_wait_seconds", "Time requests to the embedding model waited for the rate limiter."
+)
+
+embeddings_rate_limit_tpm = Gauge(
+    "embeddings_rate_limit_tpm", "Current tokens per minute allowed by the adaptive rate limiter."
+)
+
+embeddings_endpoint_requests = Counter(
+    "embeddings_endpoint_requests_total",
+    "Number of requests per deployment of the embedding model.",
+    ["endpoint", "result"],
+)
+
+embeddings_endpoint_latency_seconds = Histogram(
+    "embeddings_endpoint_latency_seconds",
+    "Latency of successful requests per deployment of the embedding model.",
+    ["endpoint"],
+)
@@ -6,14 +6,16 @@ import aiofiles
 from urllib.parse import unquote
 
 from fastapi import APIRouter, Depends, Request, Header, Response, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.params import Query
 
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from pydantic import AfterValidator
-from rei_s.services import store_service
+from rei_s.services import job_queue, store_service
 from rei_s.config import Config, get_config
 from rei_s.types.dtos import (
     FileProcessResult,
+    JobResult,
     ResultDocument,
     FileResult,
     FileType,
@@ -64,7 +66,7 @@ async def get_file_types(config: Annotated[Config, Depends(get_config)]) -> File
         },
     },
 )
-def get_files(
+async def get_files(
     config: Annotated[Config, Depends(get_config)],
     query: Annotated[str, Query(description="The query from the internal tool")],
     take: Annotated[int, Query(description="The number of results to return")],
@@ -81,13 +83,14 @@ def get_files(
     Get the files matching the query.
     """
     file_ids = files.split(",") if files is not None else None
-    store_docs = store_service.search(config, query, bucket, take, file_ids, index_name)
+    store_docs = await store_service.asearch(config, query, bucket, take, file_ids, index_name)
 
     docs = [ResultDocument(content=doc.page_content, metadata=getattr(doc, "metadata", {})) for doc in store_docs]
 
     debug = store_service.get_file_sources_markdown(store_docs)
 
-    sources = store_service.get_file_sources(config, store_docs)
+    # the file store is only available with a sync client
+    sources = await run_in_threadpool(store_service.get_file_sources, config, store_docs)
     return FileResult(files=docs, debug=debug, sources=sources)
 
 
@@ -142,7 +145,12 @@ def get_document_pdf(
     "/files",
     tags=["files"],
     operation_id="uploadFile",
+    response_model=None,
     responses={
+        202: {
+            "description": "The file was queued for processing, the status can be polled at the `Location`",
+            "model": JobResult,
+        },
         400: {
             "description": "Processing failed",
         },
@@ -152,6 +160,9 @@ def get_document_pdf(
         415: {
             "description": "File format not supported",
         },
+        503: {
+            "description": "Too many files are processed at the moment, retry after `Retry-After` seconds",
+        },
         422: {
             "description": "Validation error",
         },
@@ -167,7 +178,11 @@ async def post_files(
     index_name: Annotated[
         str | None, Header(description="The name of the index", alias="indexName"), AfterValidator(check_index_name)
     ] = None,
-) -> None:
+    prefer: Annotated[
+        str | None,
+        Header(description="With `respond-async`, the file is processed in the background and 202 is returned"),
+    ] = None,
+) -> Response | None:
     """
     Processes the file into chunks and stores them in the vector store.
     """
@@ -182,6 +197,25 @@ async def post_files(
             await temp_file.write(chunk)
 
     q = SourceFile(id=file_id, path=dest_path, file_name=unquote(file_name), mime_type=file_mime_type)
+
+    if prefer is not None and "respond-async" in prefer:
+        try:
+            # moving the upload might copy it to another file system, so neither this nor the queue block the loop
+            job_id = await run_in_threadpool(job_queue.submit_job, q, bucket, index_name)
+        except Exception:
+            q.delete()
+            raise
+
+        # if the job queue is disabled, we ignore the preference and respond synchronously
+        if job_id is not None:
+            files_added_to_queue.inc()
+            job = await run_in_threadpool(job_queue.get_job, job_id)
+            return JSONResponse(
+                status_code=202,
+                content=job.model_dump(mode="json") if job else None,
+                headers={"Location": f"/jobs/{job_id}", "Preference-Applied": "respond-async"},
+            )
+
     try:
         files_added_to_queue.inc()
         await wrap_future(
@@ -195,6 +229,8 @@ async def post_files(
     finally:
         q.delete()
 
+    return None
+
 
 @router.post(
     "/files/process",
@@ -210,6 +246,9 @@ async def post_files(
         415: {
             "description": "File format not supported",
         },
+        503: {
+            "description": "Too many files are processed at the moment, retry after `Retry-After` seconds",
+        },
     },
 )
 async def post_files_only_processing(
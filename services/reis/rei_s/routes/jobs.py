@@ -0,0 +1,29 @@
+from fastapi import APIRouter, HTTPException
+
+from rei_s.services import job_queue
+from rei_s.types.dtos import JobResult
+
+
+router = APIRouter()
+
+
+@router.get(
+    "/jobs/{job_id}",
+    tags=["jobs"],
+    operation_id="getJob",
+    responses={
+        404: {
+            "description": "Job Not Found",
+        },
+    },
+)
+def get_job(job_id: str) -> JobResult:
+    """
+    Get the status and progress of an asynchronous ingestion job.
+    """
+    job = job_queue.get_job(job_id)
+
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return job
@@ -0,0 +1,112 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+import time
+from threading import BoundedSemaphore, Lock, Semaphore
+from typing import Any, Callable, Generator, TypeVar
+
+from rei_s import logger
+from rei_s.config import Config
+from rei_s.metrics.metrics import (
+    executor_queue_depth,
+    executor_rejected,
+    executor_wait_seconds,
+    format_family_active,
+    format_family_wait_seconds,
+)
+
+
+T = TypeVar("T")
+
+
+class ExecutorFullError(Exception):
+    def __init__(self, retry_after: int) -> None:
+        super().__init__("Too many files are processed at the moment")
+        self.retry_after = retry_after
+
+
+class BoundedExecutor(ThreadPoolExecutor):
+    """A thread pool, which rejects new tasks instead of queueing them without limit.
+
+    At most `max_workers` tasks run and at most `max_queue_size` further tasks wait.
+    """
+
+    def __init__(self, max_workers: int, max_queue_size: int, retry_after: int) -> None:
+        super().__init__(max_workers=max_workers)
+        self.retry_after = retry_after
+        self.slots = BoundedSemaphore(max_workers + max_queue_size)
+
+    def submit(self, fn: Callable[..., T], /, *args: Any, **kwargs: Any) -> Future[T]:
+        if not self.slots.acquire(blocking=False):
+            executor_rejected.inc()
+            raise ExecutorFullError(self.retry_after)
+
+        queued_at = time.monotonic()
+        started = False
+        executor_queue_depth.inc()
+
+        def run() -> T:
+            nonlocal started
+            started = True
+            executor_queue_depth.dec()
+            executor_wait_seconds.observe(time.monotonic() - queued_at)
+            return fn(*args, **kwargs)
+
+        def release(_: Future[T]) -> None:
+            if not started:
+                # the task was cancelled while waiting
+                executor_queue_depth.dec()
+            self.slots.release()
+
+        try:
+            future = super().submit(run)
+        except BaseException:
+            executor_queue_depth.dec()
+            self.slots.release()
+            raise
+
+        future.add_done_callback(release)
+        return future
+
+
+# limits of the number of files of a format family, which are processed at the same time,
+# by the family and the configured limit, such that a different config does not reuse a semaphore of another size
+family_semaphores: dict[tuple[str, int], Semaphore] = {}
+family_semaphores_lock = Lock()
+
+
+def get_family_limit(config: Config, family: str) -> int | None:
+    if family == "office":
+        return config.format_concurrency_office
+    if family == "pdf":
+        return config.format_concurrency_pdf
+    if family == "transcription":
+        return config.format_concurrency_transcription
+    return None
+
+
+@contextmanager
+def format_family_slot(config: Config, family: str) -> Generator[None, None, None]:
+    """Waits until another file of the format family may be processed."""
+    limit = get_family_limit(config, family)
+    if limit is None:
+        yield
+        return
+
+    with family_semaphores_lock:
+        semaphore = family_semaphores.get((family, limit))
+        if semaphore is None:
+            semaphore = Semaphore(limit)
+            family_semaphores[(family, limit)] = semaphore
+
+    waiting_since = time.monotonic()
+    if not semaphore.acquire(blocking=False):
+        logger.info(f"Waiting for a free slot for format family {family}")
+        semaphore.acquire()
+    format_family_wait_seconds.labels(family=family).observe(time.monotonic() - waiting_since)
+
+    format_family_active.labels(family=family).inc()
+    try:
+        yield
+    finally:
+        format_family_active.labels(family=family).dec()
+        semaphore.release()
@@ -0,0 +1,134 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import queue
+import time
+from threading import Lock, Thread
+from typing import Callable
+
+from langchain_core.embeddings import Embeddings
+
+from rei_s.metrics.metrics import embeddings_request_texts
+
+
+Request = tuple[list[str], Future[list[list[float]]]]
+
+
+class EmbeddingsBatcher:
+    """Merges the texts of concurrent callers into embedding requests of up to `max_batch_size` texts.
+
+    A request is sent as soon as it is full or `max_delay` seconds after its first text arrived.
+    At most `concurrency` requests are in flight at the same time.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_batch_size: int, max_delay: float, concurrency: int) -> None:
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        # None stops the dispatcher
+        self.requests: queue.Queue[Request | None] = queue.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embeddings-batch")
+        self.thread = Thread(target=self.dispatch, name="embeddings-batcher", daemon=True)
+        self.thread.start()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        futures = []
+        for start in range(0, len(texts), self.max_batch_size):
+            future: Future[list[list[float]]] = Future()
+            self.requests.put((texts[start : start + self.max_batch_size], future))
+            futures.append(future)
+
+        return [vector for future in futures for vector in future.result()]
+
+    def dispatch(self) -> None:
+        carry: Request | None = None
+        while True:
+            first = carry if carry is not None else self.requests.get()
+            carry = None
+            if first is None:
+                self.executor.shutdown(wait=False)
+                return
+            batch = [first]
+            size = len(first[0])
+
+            deadline = time.monotonic() + self.max_delay
+            while size < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    # send the pending batch before stopping
+                    self.requests.put(None)
+                    break
+                if size + len(request[0]) > self.max_batch_size:
+                    # starts the next batch
+                    carry = request
+                    break
+                batch.append(request)
+                size += len(request[0])
+
+            self.executor.submit(self.run, batch)
+
+    def close(self) -> None:
+        """Stops the dispatcher after the texts already queued were sent."""
+        self.requests.put(None)
+
+    def run(self, batch: list[Request]) -> None:
+        texts = [text for request_texts, _ in batch for text in request_texts]
+        embeddings_request_texts.observe(len(texts))
+        try:
+            vectors = self.embeddings.embed_documents(texts)
+        except BaseException as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # embed the requests separately, such that only the caller with the offending texts fails
+            for request in batch:
+                self.run([request])
+            return
+
+        offset = 0
+        for request_texts, future in batch:
+            future.set_result(vectors[offset : offset + len(request_texts)])
+            offset += len(request_texts)
+
+
+class BatchingEmbeddings(Embeddings):
+    """Embeddings, which send the documents through a batcher shared with concurrent callers."""
+
+    def __init__(self, embeddings: Embeddings, batcher: EmbeddingsBatcher) -> None:
+        self.embeddings = embeddings
+        self.batcher = batcher
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.batcher.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        # queries are latency sensitive, so they are not delayed to wait for other texts
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self.embeddings.aembed_query(text)
+
+
+# one batcher per embedding model, shared by all requests of this process
+batchers: dict[str, EmbeddingsBatcher] = {}
+batchers_lock = Lock()
+
+
+def get_batcher(model: str, create: Callable[[], EmbeddingsBatcher]) -> EmbeddingsBatcher:
+    with batchers_lock:
+        batcher = batchers.get(model)
+        if batcher is None:
+            batcher = create()
+            batchers[model] = batcher
+        return batcher
+
+
+def stop_batchers() -> None:
+    with batchers_lock:
+        for batcher in batchers.values():
+            batcher.close()
+        batchers.clear()
@@ -0,0 +1,309 @@
+from array import array
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import Future
+import hashlib
+import sqlite3
+import time
+from threading import Lock
+from typing import Awaitable, Callable
+
+from langchain_core.embeddings import Embeddings
+
+from rei_s import logger
+from rei_s.metrics.metrics import (
+    embeddings_cache_hit_ratio,
+    embeddings_cache_hits,
+    embeddings_cache_misses,
+    query_embeddings_cache_lookups,
+)
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class EmbeddingsCacheStore:
+    """A SQLite file mapping (model, sha256 of the text) to the embedding vector.
+
+    The total size of the stored vectors is kept below `max_size` bytes by evicting the least recently used
+    entries. The file can be shared by multiple processes.
+    """
+
+    def __init__(self, path: str, max_size: int) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL, "
+                "PRIMARY KEY (model, hash))"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            # the total size is tracked in the database, since other processes may add entries as well
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self.connection.execute(
+                "INSERT OR IGNORE INTO meta (key, value) "
+                "SELECT 'size', COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+            )
+
+    def get(self, model: str, hashes: list[str]) -> dict[str, list[float]]:
+        if not hashes:
+            return {}
+
+        found: dict[str, list[float]] = {}
+        with self.lock:
+            # stay below the limit of variables per statement of older SQLite versions
+            for start in range(0, len(hashes), 500):
+                part = hashes[start : start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self.connection.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                    [model, *part],
+                ).fetchall()
+                for hash_, vector in rows:
+                    found[hash_] = array("d", vector).tolist()
+
+            if found:
+                now = time.time()
+                self.connection.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND hash = ?",
+                    [(now, model, hash_) for hash_ in found],
+                )
+
+        return found
+
+    def put(self, model: str, entries: dict[str, list[float]]) -> None:
+        if not entries:
+            return
+
+        now = time.time()
+        rows = [(model, hash_, array("d", vector).tobytes(), now) for hash_, vector in entries.items()]
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                # entries which are added concurrently by another process are only counted once
+                added = 0
+                for row in rows:
+                    cursor = self.connection.execute(
+                        "INSERT OR IGNORE INTO embeddings (model, hash, vector, last_used) VALUES (?, ?, ?, ?)", row
+                    )
+                    if cursor.rowcount > 0:
+                        added += len(row[2])
+                self.connection.execute("UPDATE meta SET value = value + ? WHERE key = 'size'", (added,))
+                self.evict()
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def evict(self) -> None:
+        (size,) = self.connection.execute("SELECT value FROM meta WHERE key = 'size'").fetchone()
+        if size <= self.max_size:
+            return
+
+        # evict a bit more than needed, such that we do not need to evict on every insert
+        to_free = size - int(self.max_size * 0.9)
+        freed = 0
+        evicted = 0
+        cursor = self.connection.execute("SELECT rowid, LENGTH(vector) FROM embeddings ORDER BY last_used")
+        for rowid, length in cursor.fetchmany(10_000):
+            if freed >= to_free:
+                break
+            self.connection.execute("DELETE FROM embeddings WHERE rowid = ?", (rowid,))
+            freed += length
+            evicted += 1
+
+        self.connection.execute("UPDATE meta SET value = value - ? WHERE key = 'size'", (freed,))
+        logger.info(f"Evicted {evicted} entries from the embeddings cache")
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings, which only send texts upstream that were not embedded by the same model before."""
+
+    def __init__(self, embeddings: Embeddings, store: EmbeddingsCacheStore, model: str) -> None:
+        self.embeddings = embeddings
+        self.store = store
+        self.model = model
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        hashes = [text_hash(text) for text in texts]
+        try:
+            cached = self.store.get(self.model, hashes)
+        except sqlite3.Error as e:
+            # the cache is only an optimization, we do not want to fail because of it
+            logger.warning(f"Could not read from the embeddings cache: {e!r}")
+            cached = {}
+
+        # the same text may occur multiple times in one batch, but needs to be embedded only once
+        missing = {hash_: text for hash_, text in zip(hashes, texts, strict=True) if hash_ not in cached}
+        record_lookups(hits=len(texts) - len(missing), misses=len(missing))
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors, strict=True))
+            try:
+                self.store.put(self.model, computed)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not write to the embeddings cache: {e!r}")
+            cached.update(computed)
+
+        return [cached[hash_] for hash_ in hashes]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self.embeddings.aembed_query(text)
+
+
+lookups_lock = Lock()
+lookups = {"hits": 0, "misses": 0}
+
+
+def record_lookups(hits: int, misses: int) -> None:
+    embeddings_cache_hits.inc(hits)
+    embeddings_cache_misses.inc(misses)
+    with lookups_lock:
+        lookups["hits"] += hits
+        lookups["misses"] += misses
+        total = lookups["hits"] + lookups["misses"]
+        if total > 0:
+            embeddings_cache_hit_ratio.set(lookups["hits"] / total)
+
+
+# one store per file, shared by all embeddings of this process
+stores: dict[str, EmbeddingsCacheStore] = {}
+stores_lock = Lock()
+
+
+def get_cache_store(path: str, max_size: int) -> EmbeddingsCacheStore:
+    with stores_lock:
+        store = stores.get(path)
+        if store is None:
+            store = EmbeddingsCacheStore(path, max_size)
+            stores[path] = store
+        return store
+
+
+class QueryEmbeddingsCache:
+    """An in-memory LRU cache of query embeddings, whose entries expire after `ttl` seconds.
+
+    Concurrent lookups of the same missing key share a single computation.
+    """
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict[tuple[str, str], tuple[float, list[float]]] = OrderedDict()
+        self.in_flight: dict[tuple[str, str], Future[list[float]]] = {}
+        self.lock = Lock()
+
+    def lookup(self, key: tuple[str, str]) -> tuple[list[float] | None, "Future[list[float]]", bool]:
+        """Returns the cached vector, or the future of its computation and whether the caller has to compute it."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires, vector = entry
+                if expires > time.monotonic():
+                    self.entries.move_to_end(key)
+                    query_embeddings_cache_lookups.labels(result="hit").inc()
+                    return vector, Future(), False
+                del self.entries[key]
+
+            future = self.in_flight.get(key)
+            if future is not None:
+                query_embeddings_cache_lookups.labels(result="shared").inc()
+                return None, future, False
+
+            future = Future()
+            self.in_flight[key] = future
+            query_embeddings_cache_lookups.labels(result="miss").inc()
+            return None, future, True
+
+    def fail(self, key: tuple[str, str], future: "Future[list[float]]", e: BaseException) -> None:
+        with self.lock:
+            del self.in_flight[key]
+        # the cancellation of the computing caller must not look like a cancellation of the waiting ones
+        future.set_exception(e if isinstance(e, Exception) else RuntimeError("The query embedding was cancelled"))
+
+    def store(self, key: tuple[str, str], future: "Future[list[float]]", vector: list[float]) -> None:
+        with self.lock:
+            del self.in_flight[key]
+            self.entries[key] = (time.monotonic() + self.ttl, vector)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        future.set_result(vector)
+
+    def get(self, key: tuple[str, str], compute: Callable[[], list[float]]) -> list[float]:
+        vector, future, is_owner = self.lookup(key)
+        if vector is not None:
+            return vector
+        if not is_owner:
+            return future.result()
+
+        try:
+            vector = compute()
+        except BaseException as e:
+            self.fail(key, future, e)
+            raise
+        self.store(key, future, vector)
+        return vector
+
+    async def aget(self, key: tuple[str, str], compute: Callable[[], Awaitable[list[float]]]) -> list[float]:
+        """Like `get`, but waits for concurrent computations without blocking the event loop."""
+        vector, future, is_owner = self.lookup(key)
+        if vector is not None:
+            return vector
+        if not is_owner:
+            return await asyncio.wrap_future(future)
+
+        try:
+            vector = await compute()
+        except BaseException as e:
+            self.fail(key, future, e)
+            raise
+        self.store(key, future, vector)
+        return vector
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """Embeddings, which reuse the embeddings of recently seen queries."""
+
+    def __init__(self, embeddings: Embeddings, cache: QueryEmbeddingsCache, model: str) -> None:
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.cache.get(self.key(text), lambda: self.embeddings.embed_query(text))
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self.cache.aget(self.key(text), lambda: self.embeddings.aembed_query(text))
+
+    def key(self, text: str) -> tuple[str, str]:
+        # whitespace does not change the meaning of a query
+        return (self.model, " ".join(text.split()))
+
+
+query_caches: dict[tuple[int, float], QueryEmbeddingsCache] = {}
+
+
+def get_query_cache(max_size: int, ttl: float) -> QueryEmbeddingsCache:
+    with stores_lock:
+        cache = query_caches.get((max_size, ttl))
+        if cache is None:
+            cache = QueryEmbeddingsCache(max_size, ttl)
+            query_caches[(max_size, ttl)] = cache
+        return cache
@@ -0,0 +1,188 @@
+import asyncio
+import time
+from threading import Lock
+from typing import Awaitable, Callable, TypeVar
+
+from langchain_core.embeddings import Embeddings
+
+from rei_s import logger
+from rei_s.metrics.metrics import embeddings_endpoint_latency_seconds, embeddings_endpoint_requests
+from rei_s.services.rate_limiter import RateLimiter, get_retry_after, is_transient
+
+
+T = TypeVar("T")
+
+# weight of the latest request in the moving average of the latency
+LATENCY_ALPHA = 0.2
+# an endpoint failing repeatedly is drained for up to this many seconds
+MAX_DRAIN_SECONDS = 60.0
+
+
+class PoolMember:
+    """A deployment of the embedding model with its own quota and health."""
+
+    def __init__(self, name: str, embeddings: Embeddings, limiter: RateLimiter) -> None:
+        self.name = name
+        self.embeddings = embeddings
+        self.limiter = limiter
+        self.in_flight = 0
+        self.latency = 0.0
+        self.failures = 0
+        self.drained_until = 0.0
+
+    def recovery_delay(self) -> float:
+        """Returns the seconds until a drained member may be tried again."""
+        return max(0.0, self.drained_until - time.monotonic())
+
+    def part(self, texts: list[str]) -> list[str]:
+        # the batch size of a deployment shrinks while it is rate limited
+        return texts[: self.limiter.batch_size]
+
+    def score(self, wait_time: float) -> float:
+        """Returns the expected seconds until the next part of the texts would be embedded by this member."""
+        # requests already in flight are expected to delay this one
+        return wait_time + self.latency * (self.in_flight + 1)
+
+
+class PoolEmbeddings(Embeddings):
+    """Embeddings spreading the requests over several deployments of the same model.
+
+    Every request goes to the deployment, which is expected to answer first, given its remaining quota,
+    its latency and its requests in flight. A deployment which is rate limited or fails is skipped,
+    and after repeated failures it is drained for a while.
+    """
+
+    def __init__(self, members: list[PoolMember], max_retries: int) -> None:
+        self.members = members
+        self.max_retries = max_retries
+        self.lock = Lock()
+
+    def choose(self, texts: list[str]) -> PoolMember:
+        # the limiters are read outside the lock, so a slow SQLite file does not hold up the other callers
+        wait_times = {member: member.limiter.wait_time(member.part(texts)) for member in self.members}
+        now = time.monotonic()
+        with self.lock:
+            healthy = [member for member in self.members if member.drained_until <= now]
+            # if all deployments are drained, we try the one which recovers first
+            candidates = healthy or [min(self.members, key=lambda member: member.drained_until)]
+            member = min(candidates, key=lambda member: member.score(wait_times[member]))
+            member.in_flight += 1
+            return member
+
+    def call(self, texts: list[str], fn: Callable[[Embeddings, list[str]], T]) -> T:
+        """Embeds the next part of the texts, whose size depends on the chosen deployment."""
+        attempt = 0
+        while True:
+            member = self.choose(texts)
+            part = member.part(texts)
+            try:
+                # if all deployments are drained, e.g. the only one is down, we back off until it recovers
+                time.sleep(member.recovery_delay())
+                member.limiter.acquire(part)
+                started = time.monotonic()
+                result = fn(member.embeddings, part)
+            except Exception as e:
+                self.on_failure(member, e)
+                if not self.should_retry(e, attempt):
+                    raise
+                attempt += 1
+                continue
+            finally:
+                with self.lock:
+                    member.in_flight -= 1
+
+            self.on_success(member, time.monotonic() - started)
+            return result
+
+    async def acall(self, texts: list[str], fn: Callable[[Embeddings, list[str]], Awaitable[T]]) -> T:
+        """Like `call`, but without blocking the event loop.
+
+        The limiters of the members read and update their SQLite files, so all calls to them run in a thread.
+        """
+        attempt = 0
+        while True:
+            member = await asyncio.to_thread(self.choose, texts)
+            part = member.part(texts)
+            try:
+                await asyncio.sleep(member.recovery_delay())
+                await member.limiter.aacquire(part)
+                started = time.monotonic()
+                result = await fn(member.embeddings, part)
+            except Exception as e:
+                await asyncio.to_thread(self.on_failure, member, e)
+                if not self.should_retry(e, attempt):
+                    raise
+                attempt += 1
+                continue
+            finally:
+                with self.lock:
+                    member.in_flight -= 1
+
+            await asyncio.to_thread(self.on_success, member, time.monotonic() - started)
+            return result
+
+    def should_retry(self, e: Exception, attempt: int) -> bool:
+        # another deployment is tried immediately, the failed one is paused or drained.
+        # If no other deployment is healthy, the retry waits until the failed one recovers
+        return attempt < self.max_retries and (get_retry_after(e) is not None or is_transient(e))
+
+    def on_success(self, member: PoolMember, latency: float) -> None:
+        embeddings_endpoint_requests.labels(endpoint=member.name, result="success").inc()
+        embeddings_endpoint_latency_seconds.labels(endpoint=member.name).observe(latency)
+        member.limiter.on_success()
+        with self.lock:
+            if member.latency == 0:
+                member.latency = latency
+            else:
+                member.latency = (1 - LATENCY_ALPHA) * member.latency + LATENCY_ALPHA * latency
+            member.failures = 0
+
+    def on_failure(self, member: PoolMember, e: Exception) -> None:
+        retry_after = get_retry_after(e)
+        if retry_after is not None:
+            embeddings_endpoint_requests.labels(endpoint=member.name, result="rate_limited").inc()
+            logger.warning(f"Embedding endpoint {member.name} is rate limited for {retry_after}s")
+            # only this deployment is paused, the other ones take over
+            member.limiter.on_rate_limited(retry_after)
+            return
+
+        embeddings_endpoint_requests.labels(endpoint=member.name, result="error").inc()
+        if not is_transient(e):
+            return
+
+        with self.lock:
+            member.failures += 1
+            drain = min(MAX_DRAIN_SECONDS, 2 ** (member.failures - 1))
+            member.drained_until = time.monotonic() + drain
+        logger.warning(f"Embedding endpoint {member.name} failed, draining it for {drain}s: {e!r}")
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors: list[list[float]] = []
+        while len(vectors) < len(texts):
+            vectors.extend(self.call(texts[len(vectors) :], lambda embeddings, part: embeddings.embed_documents(part)))
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.call([text], lambda embeddings, _: embeddings.embed_query(text))
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self.acall([text], lambda embeddings, _: embeddings.aembed_query(text))
+
+
+# one pool per embedding model, shared by all requests of this process
+pools: dict[str, PoolEmbeddings] = {}
+pools_lock = Lock()
+
+
+def get_pool(model: str, create: Callable[[], PoolEmbeddings]) -> PoolEmbeddings:
+    with pools_lock:
+        pool = pools.get(model)
+        if pool is None:
+            pool = create()
+            pools[model] = pool
+        return pool
+
+
+def stop_pools() -> None:
+    with pools_lock:
+        pools.clear()
@@ -1,19 +1,140 @@
+import json
+import os
+from threading import Lock
+
+from pydantic import SecretStr
 from langchain_openai import OpenAIEmbeddings, AzureOpenAIEmbeddings
 from langchain_community.embeddings import FakeEmbeddings
 from langchain_ollama import OllamaEmbeddings
 from langchain_core.embeddings import Embeddings
 from langchain_aws.embeddings.bedrock import BedrockEmbeddings
 from langchain_nvidia_ai_endpoints import NVIDIAEmbeddings
-from rei_s.config import Config
+from rei_s import logger
+from rei_s.config import AzureOpenAIDeployment, Config
+from rei_s.services.embeddings_batcher import BatchingEmbeddings, EmbeddingsBatcher, get_batcher
+from rei_s.services.embeddings_cache import CachedEmbeddings, CachedQueryEmbeddings, get_cache_store, get_query_cache
+from rei_s.services.embeddings_pool import PoolEmbeddings, PoolMember, get_pool
+from rei_s.services.http_client import get_async_http_client, get_http_client
+from rei_s.services.rate_limiter import RateLimitedEmbeddings, RateLimiter, get_rate_limiter
+
+
+# maximum number of texts per request if they are not merged, the default of the OpenAI embeddings
+DEFAULT_MAX_BATCH_SIZE = 1000
+
+# sizes of the embedding vectors per model id, such that we need to determine them only once
+embeddings_dimensions: dict[str, int] = {}
+embeddings_dimensions_lock = Lock()
 
 
 def get_embeddings(config: Config) -> Embeddings:
-    # for low tier subscriptions, we will encounter rate limits when uploading larger files
-    # since we may have multiple workers using the same embedding endpoint, we will encounter
-    # multiple triggers of the rate limit error. However, we do not want to fail after
-    # the default 2 retries. Thus we use a ridiculous number of retries to insure slow but errorless
-    # uploads in instances with a too cheap subscription tier.
-    max_retries = 1337
+    embeddings: Embeddings
+    if use_pool(config):
+        embeddings = get_pool_embeddings(config)
+        pool_size = len(config.embeddings_azure_openai_pool) + 1
+    else:
+        limiter = get_limiter(
+            config, get_embeddings_model_id(config), config.embeddings_rate_limit_rpm, config.embeddings_rate_limit_tpm
+        )
+        embeddings = RateLimitedEmbeddings(get_model_embeddings(config), limiter, config.embeddings_max_retries)
+        pool_size = 1
+
+    if config.embeddings_batch_size > 0:
+        model_embeddings = embeddings
+
+        def create_batcher() -> EmbeddingsBatcher:
+            return EmbeddingsBatcher(
+                model_embeddings,
+                max_batch_size=config.embeddings_batch_size,
+                max_delay=config.embeddings_batch_max_delay_ms / 1000,
+                # every deployment of the pool adds its own quota
+                concurrency=config.workers * config.embeddings_concurrency * pool_size,
+            )
+
+        batcher = get_batcher(get_embeddings_model_id(config), create_batcher)
+        embeddings = BatchingEmbeddings(embeddings, batcher)
+
+    if config.embeddings_cache_path is not None:
+        store = get_cache_store(config.embeddings_cache_path, config.embeddings_cache_max_size_mb * 1024 * 1024)
+        embeddings = CachedEmbeddings(embeddings, store, get_embeddings_model_id(config))
+
+    if config.embeddings_query_cache_size > 0:
+        cache = get_query_cache(config.embeddings_query_cache_size, config.embeddings_query_cache_ttl)
+        embeddings = CachedQueryEmbeddings(embeddings, cache, get_embeddings_model_id(config))
+
+    return embeddings
+
+
+def get_limiter(config: Config, key: str, rpm: int | None, tpm: int | None) -> RateLimiter:
+    def create_limiter() -> RateLimiter:
+        return RateLimiter(
+            config.embeddings_rate_limit_path,
+            key,
+            rpm=rpm,
+            tpm=tpm,
+            max_batch_size=config.embeddings_batch_size or DEFAULT_MAX_BATCH_SIZE,
+        )
+
+    return get_rate_limiter(key, create_limiter)
+
+
+def use_pool(config: Config) -> bool:
+    return config.embeddings_type.lower() == "azure-openai" and len(config.embeddings_azure_openai_pool) > 0
+
+
+def get_pool_embeddings(config: Config) -> PoolEmbeddings:
+    """Returns embeddings spreading the requests over the main deployment and the further deployments of the pool."""
+    model_id = get_embeddings_model_id(config)
+
+    def create_pool() -> PoolEmbeddings:
+        if config.embeddings_azure_openai_endpoint is None or config.embeddings_azure_openai_deployment_name is None:
+            raise ValueError("The env variable `EMBEDDINGS_AZURE_OPENAI_ENDPOINT` is missing.")
+
+        main = AzureOpenAIDeployment(
+            endpoint=config.embeddings_azure_openai_endpoint,
+            deployment_name=config.embeddings_azure_openai_deployment_name,
+        )
+        members = []
+        for deployment in [main, *config.embeddings_azure_openai_pool]:
+            name = f"{deployment.endpoint}/{deployment.deployment_name}"
+            rpm = deployment.rate_limit_rpm or config.embeddings_rate_limit_rpm
+            tpm = deployment.rate_limit_tpm or config.embeddings_rate_limit_tpm
+            embeddings = get_azure_openai_embeddings(
+                config,
+                deployment.endpoint,
+                deployment.deployment_name,
+                deployment.api_key or config.embeddings_azure_openai_api_key,
+            )
+            members.append(PoolMember(name, embeddings, get_limiter(config, f"{model_id}:{name}", rpm, tpm)))
+
+        return PoolEmbeddings(members, config.embeddings_max_retries)
+
+    return get_pool(model_id, create_pool)
+
+
+def get_azure_openai_embeddings(
+    config: Config, endpoint: str | None, deployment_name: str | None, api_key: SecretStr | None
+) -> Embeddings:
+    # this is ensured by the config validation, the following lines are there to help the mypy typechecker
+    if config.embeddings_azure_openai_model_name is None:
+        raise ValueError("The env variable `EMBEDDINGS_AZURE_OPENAI_MODEL_NAME` is missing.")
+
+    return AzureOpenAIEmbeddings(
+        api_key=api_key,
+        model=config.embeddings_azure_openai_model_name,
+        azure_deployment=deployment_name,
+        azure_endpoint=endpoint,
+        api_version=config.embeddings_azure_openai_api_version,
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
+        # retries are handled by the `RateLimitedEmbeddings` or the `PoolEmbeddings`
+        max_retries=0,
+    )
+
+
+def get_model_embeddings(config: Config) -> Embeddings:
+    # rate limits and transient errors are retried by the `RateLimitedEmbeddings`, which share the
+    # rate limit with all workers instead of retrying blindly
+    max_retries = 0
 
     if config.embeddings_type.lower() == "openai":
         # this is ensured by the config validation, the following lines are there to help the mypy typechecker
@@ -25,6 +146,8 @@ def get_embeddings(config: Config) -> Embeddings:
             model=config.embeddings_openai_model_name,
             max_retries=max_retries,
             base_url=config.embeddings_openai_endpoint,
+            http_client=get_http_client(),
+            http_async_client=get_async_http_client(),
         )
     elif config.embeddings_type.lower() == "ollama":
         # this is ensured by the config validation, the following lines are there to help the mypy typechecker
@@ -38,17 +161,11 @@ def get_embeddings(config: Config) -> Embeddings:
             base_url=config.embeddings_ollama_endpoint,
         )
     elif config.embeddings_type.lower() == "azure-openai":
-        # this is ensured by the config validation, the following lines are there to help the mypy typechecker
-        if config.embeddings_azure_openai_model_name is None:
-            raise ValueError("The env variable `EMBEDDINGS_AZURE_OPENAI_MODEL_NAME` is missing.")
-
-        return AzureOpenAIEmbeddings(
-            api_key=config.embeddings_azure_openai_api_key,
-            model=config.embeddings_azure_openai_model_name,
-            azure_deployment=config.embeddings_azure_openai_deployment_name,
-            azure_endpoint=config.embeddings_azure_openai_endpoint,
-            api_version=config.embeddings_azure_openai_api_version,
-            max_retries=max_retries,
+        return get_azure_openai_embeddings(
+            config,
+            config.embeddings_azure_openai_endpoint,
+            config.embeddings_azure_openai_deployment_name,
+            config.embeddings_azure_openai_api_key,
         )
     elif config.embeddings_type.lower() == "bedrock":
         if config.embeddings_bedrock_region_name is None:
@@ -85,3 +202,80 @@ def get_embeddings(config: Config) -> Embeddings:
         return FakeEmbeddings(size=3072)
     else:
         raise ValueError(f"Unknown embedding type: {config.embeddings_type}")
+
+
+def get_embeddings_model_id(config: Config) -> str:
+    """Returns an identifier of the configured embedding model, which changes if the embedding vectors change."""
+    embeddings_type = config.embeddings_type.lower()
+    if embeddings_type == "openai":
+        parts = [config.embeddings_openai_endpoint, config.embeddings_openai_model_name]
+    elif embeddings_type == "ollama":
+        parts = [config.embeddings_ollama_endpoint, config.embeddings_ollama_model_name]
+    elif embeddings_type == "azure-openai":
+        parts = [
+            config.embeddings_azure_openai_endpoint,
+            config.embeddings_azure_openai_deployment_name,
+            config.embeddings_azure_openai_model_name,
+        ]
+    elif embeddings_type == "bedrock":
+        parts = [config.embeddings_bedrock_region_name, config.embeddings_bedrock_model_id]
+    elif embeddings_type == "nvidia":
+        parts = [config.embeddings_nvidia_base_url, config.embeddings_nvidia_model]
+    else:
+        parts = []
+
+    return ":".join([embeddings_type] + [part or "" for part in parts])
+
+
+def read_embeddings_metadata(path: str) -> dict[str, int]:
+    try:
+        with open(path) as f:
+            metadata: dict[str, int] = json.load(f)
+            return metadata
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read embeddings metadata from {path}: {e!r}")
+        return {}
+
+
+def write_embeddings_metadata(path: str, metadata: dict[str, int]) -> None:
+    # write to a temporary file first, such that concurrent readers never see a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(metadata, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not write embeddings metadata to {path}: {e!r}")
+
+
+def get_embeddings_dimensions(config: Config, embeddings: Embeddings) -> int:
+    """Returns the size of the embedding vectors of the configured model.
+
+    The size is taken from the config, or determined once per model by embedding a short text.
+    In the latter case, it is remembered in the metadata file, if configured.
+    """
+    if config.embeddings_dimensions is not None:
+        return config.embeddings_dimensions
+
+    model_id = get_embeddings_model_id(config)
+    with embeddings_dimensions_lock:
+        dimensions = embeddings_dimensions.get(model_id)
+        if dimensions is not None:
+            return dimensions
+
+        metadata = {}
+        if config.embeddings_metadata_path is not None:
+            metadata = read_embeddings_metadata(config.embeddings_metadata_path)
+            dimensions = metadata.get(model_id)
+
+        if dimensions is None:
+            dimensions = len(embeddings.embed_query("Text"))
+            logger.info(f"Determined embedding dimensions {dimensions} for {model_id}")
+            if config.embeddings_metadata_path is not None:
+                metadata[model_id] = dimensions
+                write_embeddings_metadata(config.embeddings_metadata_path, metadata)
+
+        embeddings_dimensions[model_id] = dimensions
+        return dimensions
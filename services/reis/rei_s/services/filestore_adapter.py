@@ -19,3 +19,6 @@ class FileStoreAdapter(ABC):
     @abstractmethod
     def exists(self, doc_id: str) -> bool:
         raise NotImplementedError
+
+    def exists_many(self, doc_ids: set[str]) -> dict[str, bool]:
+        return {doc_id: self.exists(doc_id) for doc_id in doc_ids}
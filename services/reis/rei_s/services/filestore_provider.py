@@ -1,12 +1,101 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import time
+
 from rei_s.config import Config
 from rei_s.services.filestore_adapter import FileStoreAdapter
 from rei_s.services.filestores.filesystem import FSFileStoreAdapter
 from rei_s.services.filestores.s3 import S3FileStoreAdapter
+from rei_s.types.source_file import SourceFile
 
 
-def get_filestore(
-    config: Config,
-) -> FileStoreAdapter | None:
+# maximum number of remembered existence checks
+EXISTS_CACHE_SIZE = 10_000
+
+
+class CachedFileStoreAdapter(FileStoreAdapter):
+    """A file store, which remembers the results of existence checks for `ttl` seconds.
+
+    Additions and deletions through this process update the cache immediately,
+    changes by other processes are noticed after at most `ttl` seconds.
+    Existence checks of multiple documents run concurrently.
+    """
+
+    def __init__(self, file_store: FileStoreAdapter, ttl: float, concurrency: int) -> None:
+        self.file_store = file_store
+        self.ttl = ttl
+        self.entries: OrderedDict[str, tuple[float, bool]] = OrderedDict()
+        self.lock = Lock()
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="file-store-exists")
+
+    def remember(self, doc_id: str, exists: bool) -> None:
+        if self.ttl <= 0:
+            return
+        with self.lock:
+            self.entries[doc_id] = (time.monotonic() + self.ttl, exists)
+            self.entries.move_to_end(doc_id)
+            while len(self.entries) > EXISTS_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def lookup(self, doc_id: str) -> bool | None:
+        with self.lock:
+            entry = self.entries.get(doc_id)
+            if entry is None:
+                return None
+            expires, exists = entry
+            if expires <= time.monotonic():
+                del self.entries[doc_id]
+                return None
+            return exists
+
+    def add_document(self, document: SourceFile) -> None:
+        self.file_store.add_document(document)
+        self.remember(document.id, True)
+
+    def delete(self, doc_id: str) -> None:
+        try:
+            self.file_store.delete(doc_id)
+        finally:
+            # if the deletion failed, we do not know whether the file still exists
+            with self.lock:
+                self.entries.pop(doc_id, None)
+        self.remember(doc_id, False)
+
+    def get_document(self, doc_id: str) -> SourceFile:
+        return self.file_store.get_document(doc_id)
+
+    def exists(self, doc_id: str) -> bool:
+        exists = self.lookup(doc_id)
+        if exists is None:
+            exists = self.file_store.exists(doc_id)
+            self.remember(doc_id, exists)
+        return exists
+
+    def exists_many(self, doc_ids: set[str]) -> dict[str, bool]:
+        result: dict[str, bool] = {}
+        missing = []
+        for doc_id in doc_ids:
+            exists = self.lookup(doc_id)
+            if exists is None:
+                missing.append(doc_id)
+            else:
+                result[doc_id] = exists
+
+        # e.g. for S3, every check is a round trip, so they are sent concurrently
+        for doc_id, exists in zip(missing, self.executor.map(self.file_store.exists, missing), strict=True):
+            self.remember(doc_id, exists)
+            result[doc_id] = exists
+
+        return result
+
+
+# one file store per config, such that clients and their connections are reused
+file_stores: dict[Config, CachedFileStoreAdapter] = {}
+file_stores_lock = Lock()
+
+
+def create_filestore(config: Config) -> FileStoreAdapter | None:
     if config.file_store_type is None:
         # this is an optional feature
         return None
@@ -16,3 +105,29 @@ def get_filestore(
         return S3FileStoreAdapter.create(config=config)
     else:
         raise ValueError(f"Store type {config.file_store_type} not supported")
+
+
+def get_filestore(
+    config: Config,
+) -> FileStoreAdapter | None:
+    if config.file_store_type is None:
+        return None
+
+    with file_stores_lock:
+        file_store = file_stores.get(config)
+        if file_store is None:
+            created = create_filestore(config)
+            if created is None:
+                return None
+            file_store = CachedFileStoreAdapter(
+                created, ttl=config.file_store_exists_cache_ttl, concurrency=config.file_store_exists_concurrency
+            )
+            file_stores[config] = file_store
+        return file_store
+
+
+def clear_filestores() -> None:
+    with file_stores_lock:
+        for file_store in file_stores.values():
+            file_store.executor.shutdown(wait=False)
+        file_stores.clear()
@@ -1,3 +1,4 @@
+import shutil
 from threading import Lock
 
 import boto3
@@ -34,7 +35,15 @@ class S3FileStoreAdapter(FileStoreAdapter):
             if e.response["Error"]["Code"] == "NoSuchKey":
                 raise HTTPException(status_code=404, detail="File not found") from e
             raise
-        return SourceFile.new_temporary_file(response["Body"].read())
+        # the object is streamed into the file, instead of keeping it in memory completely
+        file = SourceFile.new_temporary_file()
+        try:
+            with open(file.path, "wb") as f, response["Body"] as body:
+                shutil.copyfileobj(body, f)
+        except BaseException:
+            file.delete()
+            raise
+        return file
 
     def exists(self, doc_id: str) -> bool:
         try:
@@ -1,39 +1,118 @@
+from dataclasses import dataclass
 from functools import lru_cache
-from typing import Any
+from importlib import import_module
+from typing import Callable
 
 from rei_s.config import Config
 from rei_s.services.formats.abstract_format_provider import AbstractFormatProvider
+from rei_s.services.formats.utils import check_file_name_extensions
+from rei_s.types.source_file import SourceFile
 
-# here we need to import all format_providers
-from rei_s.services.formats import pdf_provider as pdf_provider
-from rei_s.services.formats import markdown_provider as markdown_provider
-from rei_s.services.formats import html_provider as html_provider
-from rei_s.services.formats import code_provider as code_provider
-from rei_s.services.formats import json_provider as json_provider
-from rei_s.services.formats import xml_provider as xml_provider
-from rei_s.services.formats import yaml_provider as yaml_provider
-from rei_s.services.formats import plain_provider as plain_provider
-from rei_s.services.formats import libre_office_provider as libre_office_provider
-from rei_s.services.formats import ms_excel_provider as ms_excel_provider
-from rei_s.services.formats import ms_word_provider as ms_word_provider
-from rei_s.services.formats import ms_ppt_provider as ms_ppt_provider
-from rei_s.services.formats import outlook_provider as outlook_provider
-from rei_s.services.formats import video_transcription_provider as video_transcription_provider
-from rei_s.services.formats import voice_transcription_provider as voice_transcription_provider
-
-
-def get_all_subclasses(cls: Any) -> set[type[Any]]:
-    subclasses = set(cls.__subclasses__())
-    for subclass in cls.__subclasses__():
-        subclasses.update(get_all_subclasses(subclass))
-    return subclasses
+
+def always_enabled(_config: Config) -> bool:
+    return True
+
+
+def transcription_enabled(config: Config) -> bool:
+    return config.stt_type == "azure-openai-whisper"
+
+
+@dataclass(frozen=True)
+class FormatProviderSpec:
+    """Everything needed to choose a format provider, without importing its (heavy) module.
+
+    The name and the file name extensions have to match the attributes of the provider class.
+    """
+
+    name: str
+    module: str
+    class_name: str
+    file_name_extensions: tuple[str, ...]
+    enabled: Callable[[Config], bool] = always_enabled
+    # whether the provider overrides `clean_up`, which is applied to search results
+    cleans_up: bool = False
+
+    def supports(self, file: SourceFile) -> bool:
+        return check_file_name_extensions(list(self.file_name_extensions), file)
+
+    def load(self) -> type[AbstractFormatProvider]:
+        module = import_module(f"{__name__}.{self.module}")
+        cls: type[AbstractFormatProvider] = getattr(module, self.class_name)
+        return cls
+
+
+# every format provider needs to be registered here, the providers are tried in this order
+format_provider_specs = [
+    FormatProviderSpec("pdf", "pdf_provider", "PdfProvider", (".pdf",)),
+    FormatProviderSpec("markdown", "markdown_provider", "MarkdownProvider", (".md",)),
+    FormatProviderSpec("html", "html_provider", "HtmlProvider", (".html", ".htm", ".xhtml")),
+    FormatProviderSpec(
+        "code",
+        "code_provider",
+        "CodeProvider",
+        (".cpp", ".go", ".java", ".js", ".php", ".proto", ".py", ".rb", ".rs", ".rst", ".scala", ".swift"),
+    ),
+    FormatProviderSpec("json", "json_provider", "JsonProvider", (".json",)),
+    FormatProviderSpec("xml", "xml_provider", "XmlProvider", (".xml",)),
+    FormatProviderSpec("yaml", "yaml_provider", "YamlProvider", (".yml", ".yaml")),
+    FormatProviderSpec("plain", "plain_provider", "PlainProvider", (".txt",)),
+    FormatProviderSpec("libreoffice", "libre_office_provider", "LibreOfficeProvider", (".odp", ".ods", ".odt")),
+    FormatProviderSpec("ms_excel", "ms_excel_provider", "MsExcelProvider", (".xlsx",)),
+    FormatProviderSpec("ms_word", "ms_word_provider", "MsWordProvider", (".docx",)),
+    FormatProviderSpec("ms_ppt", "ms_ppt_provider", "MsPptProvider", (".pptx",)),
+    FormatProviderSpec("outlook", "outlook_provider", "OutlookProvider", (".msg",)),
+    FormatProviderSpec(
+        "audio",
+        "voice_transcription_provider",
+        "VoiceTranscriptionProvider",
+        (".mp3", ".m4a", ".ogg", ".oga", ".ogx", ".flac", ".wav"),
+        enabled=transcription_enabled,
+    ),
+    FormatProviderSpec(
+        "video-transcription",
+        "video_transcription_provider",
+        "VideoTranscriptionProvider",
+        (".mp4", ".mpeg", ".mpg", ".mpe", ".ogv", ".mov", ".webm", ".avi", ".3gp", ".flv", ".mkv", ".wmv"),
+        enabled=transcription_enabled,
+    ),
+]
 
 
 @lru_cache
-def get_format_providers(config: Config) -> list[AbstractFormatProvider]:
-    return [cls(config=config) for cls in get_all_subclasses(AbstractFormatProvider) if cls(config=config).enabled]
+def get_format_provider_specs(config: Config) -> list[FormatProviderSpec]:
+    return [spec for spec in format_provider_specs if spec.enabled(config)]
+
+
+def get_format_provider_spec(config: Config, name: str) -> FormatProviderSpec | None:
+    for spec in get_format_provider_specs(config):
+        if spec.name == name:
+            return spec
+    return None
 
 
 @lru_cache
-def get_format_provider_mappings(config: Config) -> dict[str, AbstractFormatProvider]:
-    return {format_.name: format_ for format_ in get_format_providers(config)}
+def get_format_provider(config: Config, name: str) -> AbstractFormatProvider:
+    """Returns the enabled provider of the given name, its module is imported on the first call."""
+    spec = get_format_provider_spec(config, name)
+    if spec is None:
+        raise KeyError(f"Format provider {name} is not available")
+    # the providers accept the config as a keyword argument, but not all of them need it
+    return spec.load()(config=config)  # type: ignore[call-arg]
+
+
+def find_format_provider_spec(config: Config, file: SourceFile) -> FormatProviderSpec | None:
+    for spec in get_format_provider_specs(config):
+        if spec.supports(file):
+            return spec
+    return None
+
+
+def get_format_providers(config: Config) -> list[AbstractFormatProvider]:
+    """Returns all enabled providers, which imports all of their modules."""
+    return [get_format_provider(config, spec.name) for spec in get_format_provider_specs(config)]
+
+
+def import_format_providers() -> None:
+    """Imports the modules of all format providers, e.g., to pre-warm a worker process."""
+    for spec in format_provider_specs:
+        spec.load()
@@ -1,4 +1,6 @@
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Iterator
 
 from langchain_core.documents import Document
 
@@ -6,9 +8,22 @@ from rei_s.services.formats.utils import check_file_name_extensions
 from rei_s.types.source_file import SourceFile
 
 
+@dataclass
+class ProcessedPage:
+    chunks: list[Document]
+    # name of the parser, which extracted the page
+    parser: str
+    seconds: float
+
+
 class AbstractFormatProvider(ABC):
     name: str
     file_name_extensions: list[str]
+    # formats of the same family share a limit of concurrently processed files
+    family: str = "text"
+    # if the file is converted to pdf for the file store, the chunks are produced from the pdf instead of the file,
+    # e.g., since processing the file a second time would transcribe it again
+    chunks_from_pdf: bool = False
 
     def supports(self, file: SourceFile) -> bool:
         return check_file_name_extensions(self.file_name_extensions, file)
@@ -17,6 +32,27 @@ class AbstractFormatProvider(ABC):
     def process_file(self, file: SourceFile, chunk_size: int | None = None) -> list[Document]:
         raise NotImplementedError
 
+    def iter_chunks(self, file: SourceFile, chunk_size: int | None = None) -> Iterator[Document]:
+        """Generator mode of `process_file`.
+
+        Providers which can produce their chunks incrementally should override this,
+        such that the memory needed does not grow with the size of the document.
+        """
+        yield from self.process_file(file, chunk_size)
+
+    def count_pages(self, file: SourceFile) -> int | None:
+        """Returns the number of pages, if ranges of pages can be processed independently with `process_pages`."""
+        return None
+
+    def process_pages(
+        self, file: SourceFile, first_page: int, last_page: int, page_count: int, chunk_size: int | None = None
+    ) -> list[ProcessedPage]:
+        """Returns the pages from `first_page` up to `last_page` (exclusive, counted from 0).
+
+        `page_count` is the result of `count_pages`, such that the pages do not have to be counted again.
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def convert_file_to_pdf(self, file: SourceFile) -> SourceFile:
         raise NotImplementedError
@@ -1,16 +1,18 @@
-from typing import Any
+from typing import Any, Iterator
 
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 from rei_s.services.formats.abstract_format_provider import AbstractFormatProvider
 from rei_s.services.formats.pdf_provider import PdfProvider
+from rei_s.services.formats.spreadsheets import iter_ods_rows, iter_row_chunks
 from rei_s.services.formats.utils import convert_office_to_pdf, validate_chunk_overlap, validate_chunk_size
 from rei_s.types.source_file import SourceFile
 
 
 class LibreOfficeProvider(AbstractFormatProvider):
     name = "libreoffice"
+    family = "office"
 
     file_name_extensions = [
         ".odp",
@@ -33,8 +35,19 @@ class LibreOfficeProvider(AbstractFormatProvider):
     def process_file(
         self, file: SourceFile, chunk_size: int | None = None, chunk_overlap: int | None = None
     ) -> list[Document]:
+        return list(self.iter_chunks(file, chunk_size, chunk_overlap))
+
+    def iter_chunks(
+        self, file: SourceFile, chunk_size: int | None = None, chunk_overlap: int | None = None
+    ) -> Iterator[Document]:
+        if file.ext().lower() == "ods":
+            # spreadsheets are read row by row, instead of rendering them to pdf
+            splitter = self.splitter(chunk_size, chunk_overlap)
+            chunk_size = validate_chunk_size(chunk_size, self.default_chunk_size)
+            return iter_row_chunks(iter_ods_rows(file.path), splitter, chunk_size)
+
         pdf = self.convert_file_to_pdf(file)
-        return PdfProvider().process_file(pdf, chunk_size, chunk_overlap)
+        return PdfProvider().iter_chunks(pdf, chunk_size, chunk_overlap)
 
     def convert_file_to_pdf(self, file: SourceFile) -> SourceFile:
         return convert_office_to_pdf(file)
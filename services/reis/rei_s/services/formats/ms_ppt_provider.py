@@ -1,16 +1,17 @@
-from typing import Any
+from typing import Any, Iterator
 
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 from rei_s.services.formats.abstract_format_provider import AbstractFormatProvider
-from rei_s.services.formats.pdf_provider import PdfProvider
+from rei_s.services.formats.ooxml import iter_pptx_slides
 from rei_s.services.formats.utils import convert_office_to_pdf, validate_chunk_overlap, validate_chunk_size
 from rei_s.types.source_file import SourceFile
 
 
 class MsPptProvider(AbstractFormatProvider):
     name = "ms_ppt"
+    family = "office"
 
     file_name_extensions = [".pptx"]
 
@@ -29,8 +30,15 @@ class MsPptProvider(AbstractFormatProvider):
     def process_file(
         self, file: SourceFile, chunk_size: int | None = None, chunk_overlap: int | None = None
     ) -> list[Document]:
-        pdf = self.convert_file_to_pdf(file)
-        return PdfProvider().process_file(pdf, chunk_size, chunk_overlap)
+        return list(self.iter_chunks(file, chunk_size, chunk_overlap))
+
+    def iter_chunks(
+        self, file: SourceFile, chunk_size: int | None = None, chunk_overlap: int | None = None
+    ) -> Iterator[Document]:
+        # the text is read directly from the XML of the document, it is only converted to pdf for the file store
+        splitter = self.splitter(chunk_size, chunk_overlap)
+        for slide, text in iter_pptx_slides(file.path):
+            yield from splitter.split_documents([Document(page_content=text, metadata={"slide": slide})])
 
     def convert_file_to_pdf(self, file: SourceFile) -> SourceFile:
         return convert_office_to_pdf(file)
@@ -0,0 +1,111 @@
+import posixpath
+from pathlib import Path
+from typing import Iterable, Iterator
+from xml.etree import ElementTree
+from zipfile import ZipFile
+
+
+# Office Open XML documents (.docx, .pptx) are zip archives of XML files,
+# which are parsed incrementally, such that the memory needed does not grow with the size of the document.
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+A = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+P = "{http://schemas.openxmlformats.org/presentationml/2006/main}"
+R = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+RELATIONSHIPS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+
+def paragraph_text(paragraph: ElementTree.Element, namespace: str) -> str:
+    parts = []
+    for element in paragraph.iter():
+        if element.tag == f"{namespace}t":
+            parts.append(element.text or "")
+        elif element.tag == f"{namespace}tab":
+            parts.append("\t")
+        elif element.tag in {f"{namespace}br", f"{namespace}cr"}:
+            parts.append("\n")
+    return "".join(parts)
+
+
+def iter_docx_paragraphs(path: str | Path) -> Iterator[tuple[int, str]]:
+    """Yields the section number (starting at 1) and the text of every non-empty paragraph of a .docx file."""
+    section = 1
+    # paragraphs can be nested, e.g., in text boxes, those are part of the text of the outer paragraph
+    depth = 0
+    with ZipFile(path) as archive, archive.open("word/document.xml") as xml:
+        for event, element in ElementTree.iterparse(xml, events=("start", "end")):
+            if element.tag != f"{W}p":
+                continue
+            if event == "start":
+                depth += 1
+                continue
+
+            depth -= 1
+            if depth > 0:
+                continue
+
+            text = paragraph_text(element, W)
+            if text.strip():
+                yield section, text
+            # the last paragraph of a section holds its properties, the last section is defined by the body
+            if element.find(f"{W}pPr/{W}sectPr") is not None:
+                section += 1
+            element.clear()
+
+
+def get_slide_names(archive: ZipFile) -> list[str]:
+    """Returns the paths of the slides inside the archive in the order of the presentation."""
+    with archive.open("ppt/_rels/presentation.xml.rels") as xml:
+        targets = {
+            relationship.get("Id"): relationship.get("Target", "")
+            for relationship in ElementTree.parse(xml).getroot().iter(f"{RELATIONSHIPS}Relationship")
+        }
+    with archive.open("ppt/presentation.xml") as xml:
+        ids = [slide.get(f"{R}id") for slide in ElementTree.parse(xml).getroot().iter(f"{P}sldId")]
+
+    names = []
+    for id_ in ids:
+        target = targets[id_]
+        # targets are relative to the presentation, unless they are absolute
+        names.append(target[1:] if target.startswith("/") else posixpath.normpath(posixpath.join("ppt", target)))
+    return names
+
+
+def iter_pptx_slides(path: str | Path) -> Iterator[tuple[int, str]]:
+    """Yields the slide number (starting at 1) and the text of every slide with text of a .pptx file.
+
+    The paragraphs of a text box (or table cell) are separated by a line break, text boxes by an empty line.
+    """
+    with ZipFile(path) as archive:
+        for number, name in enumerate(get_slide_names(archive), start=1):
+            blocks = []
+            with archive.open(name) as xml:
+                for _, element in ElementTree.iterparse(xml):
+                    if element.tag not in {f"{P}txBody", f"{A}txBody"}:
+                        continue
+                    text = "\n".join(paragraph_text(paragraph, A) for paragraph in element.iter(f"{A}p")).strip()
+                    if text:
+                        blocks.append(text)
+                    element.clear()
+            if blocks:
+                yield number, "\n\n".join(blocks)
+
+
+def join_paragraphs(paragraphs: Iterable[tuple[int, str]], max_length: int) -> Iterator[tuple[int, str]]:
+    """Joins consecutive paragraphs of the same section to texts of about `max_length` characters.
+
+    This gives the splitter enough context, while only a bounded part of the document is kept in memory.
+    """
+    current_section = 0
+    current: list[str] = []
+    length = 0
+    for section, text in paragraphs:
+        if current and (section != current_section or length + len(text) > max_length):
+            yield current_section, "\n\n".join(current)
+            current = []
+            length = 0
+        current_section = section
+        current.append(text)
+        length += len(text) + 2
+    if current:
+        yield current_section, "\n\n".join(current)
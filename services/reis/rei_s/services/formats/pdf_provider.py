@@ -1,44 +1,184 @@
-from io import BytesIO
 import shutil
-from typing import Any, BinaryIO
+import time
+from typing import Any, BinaryIO, Iterator
 
 from langchain_core.documents import Document
-from langchain_community.document_loaders.parsers.pdf import PDFMinerParser, PyPDFParser
-from langchain_community.document_loaders.generic import GenericLoader
+from langchain_community.document_loaders.parsers.pdf import PDFMinerParser
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 import pdfminer
+from pdfminer.converter import PDFLayoutAnalyzer
+from pdfminer.layout import LAParams, LTContainer, LTItem, LTPage, LTText, LTTextBox
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfparser import PDFParser
 import pypdf
 
 from rei_s import logger
-from rei_s.services.formats.abstract_format_provider import AbstractFormatProvider
-from rei_s.services.formats.utils import BytesLoader, validate_chunk_overlap, validate_chunk_size
+from rei_s.metrics.metrics import page_extraction_seconds
+from rei_s.services.formats.abstract_format_provider import AbstractFormatProvider, ProcessedPage
+from rei_s.services.formats.utils import validate_chunk_overlap, validate_chunk_size
 from rei_s.types.source_file import SourceFile
 from rei_s.utils import get_new_file_path
 
 
-# langchain PDFMinerLoader will fail for pdfs without "creationdate" metadata
-# this one is a fixed version for our needs
-class TolerantPDFMinerParser(PDFMinerParser):
-    def _get_metadata(
-        self,
-        fp: BinaryIO,
-        password: str = "",
-        caching: bool = True,
-    ) -> dict[str, Any]:
-        metadata = super()._get_metadata(fp, password, caching)
+# pages which take longer to extract are logged, since they slow down the whole document
+SLOW_PAGE_SECONDS = 10
+
+PARSER_VERSIONS = {
+    "PDFMiner": f"PDFMiner {pdfminer.__version__}",
+    "PyPDF": f"PyPDF {pypdf.__version__}",
+}
+
+# keys of the metadata, which are stored under the name used by the other parsers as well
+RENAMED_METADATA = {
+    "page_count": "total_pages",
+    "file_path": "source",
+}
+
+
+class PageTextCollector(PDFLayoutAnalyzer):
+    """Collects the text of the last processed page, the same way as the PDFMiner parser of langchain."""
+
+    def __init__(self, resource_manager: PDFResourceManager) -> None:
+        super().__init__(resource_manager, laparams=LAParams())
+        self.text = ""
 
-        defaults = {"producer": "REIS", "creator": "REIS", "creationdate": ""}
+    def receive_layout(self, ltpage: LTPage) -> None:
+        parts = []
 
-        for key, val in defaults.items():
-            # match case insensitive
-            if not any(k.lower() == key.lower() for k in metadata.keys()):
-                metadata[key] = val
+        def render(item: LTItem) -> None:
+            if isinstance(item, LTContainer):
+                for child in item:
+                    render(child)
+            elif isinstance(item, LTText):
+                parts.append(item.get_text())
+            if isinstance(item, LTTextBox):
+                parts.append("\n")
 
-        return metadata
+        render(ltpage)
+        self.text = "".join(parts)
+
+
+def normalize_metadata(metadata: dict[str, Any]) -> dict[str, Any]:
+    """Normalizes the metadata of a PDF the same way as the PDF parsers of langchain, e.g., `/Author` to `author`.
+
+    The dates are kept as they are, since they are removed from the chunks anyway.
+    """
+    normalized: dict[str, Any] = {}
+    for key, value in metadata.items():
+        name = key.removeprefix("/").lower()
+        if type(value) not in [str, int]:
+            value = str(value)
+        if isinstance(value, str) and name not in RENAMED_METADATA:
+            value = value.strip()
+        if name in RENAMED_METADATA:
+            normalized[RENAMED_METADATA[name]] = value
+        normalized[name] = value
+    return normalized
+
+
+def get_pdfminer_metadata(document: PDFDocument, total_pages: int) -> dict[str, Any]:
+    metadata: dict[str, Any] = {}
+    for info in document.info:
+        metadata.update(info)
+    for key, value in metadata.items():
+        try:
+            metadata[key] = PDFMinerParser.resolve_and_decode(value)
+        except Exception as e:
+            logger.warning(f"Metadata `{key}` of PDF could not be parsed: {e}")
+    metadata["total_pages"] = total_pages
+
+    metadata = normalize_metadata({"producer": "PDFMiner", "creator": "PDFMiner", "creationdate": ""} | metadata)
+    metadata["source"] = "stream"
+    return metadata
+
+
+class TieredPdfExtractor:
+    """Extracts the text of a PDF page by page with PDFMiner.
+
+    Pages which PDFMiner fails on are extracted with PyPDF instead, all other pages are still handled by PDFMiner.
+    The structure of the document is parsed only once, PyPDF only parses it if it is needed.
+    If the number of pages is already known, the page tree is only read up to the last extracted page,
+    such that a range of pages at the start of a large document does not need the whole tree.
+    """
+
+    def __init__(self, fp: BinaryIO, file_id: str | None = None, page_count: int | None = None) -> None:
+        self.fp = fp
+        self.file_id = file_id
+        self.pypdf_reader: pypdf.PdfReader | None = None
+        self.pypdf_metadata: dict[str, Any] = {}
+
+        self.pages: list[PDFPage] = []
+        self.page_iter: Iterator[PDFPage] | None
+        try:
+            document = PDFDocument(PDFParser(fp))
+            # the content of the pages is only parsed on extraction
+            self.page_iter = PDFPage.create_pages(document)
+            if page_count is None:
+                self.pages = list(self.page_iter)
+                page_count = len(self.pages)
+            self.pdfminer_page_count = page_count
+            self.metadata = get_pdfminer_metadata(document, page_count)
+        except Exception as e:
+            # sometimes PyPDF is more tolerant to malformed PDFs
+            logger.warning(f"PDFMiner failed to load PDF {file_id}, falling back to PyPDF. Error: `{e}`")
+            self.page_iter = None
+
+        self.resource_manager = PDFResourceManager()
+        self.reset_interpreter()
+
+    def reset_interpreter(self) -> None:
+        # a page which failed, e.g., inside a form XObject, leaves the state of the collector behind,
+        # which would let every later page fail as well
+        self.collector = PageTextCollector(self.resource_manager)
+        self.interpreter = PDFPageInterpreter(self.resource_manager, self.collector)
+
+    def get_pypdf_reader(self) -> pypdf.PdfReader:
+        if self.pypdf_reader is None:
+            self.pypdf_reader = pypdf.PdfReader(self.fp)
+            self.pypdf_metadata = normalize_metadata(
+                {"producer": "PyPDF", "creator": "PyPDF", "creationdate": ""}
+                | dict(self.pypdf_reader.metadata or {})
+                | {"source": "stream", "total_pages": len(self.pypdf_reader.pages)}
+            )
+        return self.pypdf_reader
+
+    @property
+    def page_count(self) -> int:
+        if self.page_iter is not None:
+            return self.pdfminer_page_count
+        return len(self.get_pypdf_reader().pages)
+
+    def get_pdfminer_page(self, number: int) -> PDFPage:
+        assert self.page_iter is not None
+        while len(self.pages) <= number:
+            self.pages.append(next(self.page_iter))
+        return self.pages[number]
+
+    def extract(self, number: int) -> tuple[Document, str]:
+        """Returns the page of the given number (counted from 0) and the name of the parser which extracted it."""
+        if self.page_iter is not None:
+            try:
+                self.interpreter.process_page(self.get_pdfminer_page(number))
+                page = Document(page_content=self.collector.text.strip(), metadata=self.metadata | {"page": number})
+                return page, "PDFMiner"
+            except Exception as e:
+                self.reset_interpreter()
+                logger.warning(
+                    f"PDFMiner failed to extract page {number + 1} of PDF {self.file_id}, "
+                    f"falling back to PyPDF. Error: `{e}`"
+                )
+
+        reader = self.get_pypdf_reader()
+        text = reader.pages[number].extract_text(extraction_mode="plain").strip()
+        metadata = self.pypdf_metadata | {"page": number, "page_label": reader.page_labels[number]}
+        return Document(page_content=text, metadata=metadata), "PyPDF"
 
 
 class PdfProvider(AbstractFormatProvider):
     name = "pdf"
+    family = "pdf"
 
     file_name_extensions = [".pdf"]
 
@@ -57,25 +197,57 @@ class PdfProvider(AbstractFormatProvider):
     def process_file(
         self, file: SourceFile, chunk_size: int | None = None, chunk_overlap: int | None = None
     ) -> list[Document]:
-        loader = GenericLoader(
-            blob_loader=BytesLoader(BytesIO(file.buffer)),
-            blob_parser=TolerantPDFMinerParser(extract_images=False, mode="page"),
-        )
+        return list(self.iter_chunks(file, chunk_size, chunk_overlap))
+
+    def iter_chunks(
+        self, file: SourceFile, chunk_size: int | None = None, chunk_overlap: int | None = None
+    ) -> Iterator[Document]:
+        # The pages are parsed, split and yielded one by one, such that only a single page
+        # is kept in memory, independent of the number of pages of the document.
+        splitter = self.splitter(chunk_size, chunk_overlap)
+        for page in self.iter_split_pages(file, splitter):
+            page_extraction_seconds.labels(format=self.name, parser=page.parser).observe(page.seconds)
+            yield from page.chunks
 
+    def count_pages(self, file: SourceFile) -> int | None:
         try:
-            documents = loader.load()
-            parser_info = f"PDFMiner {pdfminer.__version__}"
-        except Exception as e:
-            # Fallback to PyPDF if PDFMiner fails
-            # sometimes PyPDF is more tolerant to malformed PDFs
-            logger.warning(f"PDFMiner failed to load PDF {file.id}, falling back to PyPDF. Error: `{e}`")
-            loader = GenericLoader(
-                blob_loader=BytesLoader(BytesIO(file.buffer)),
-                blob_parser=PyPDFParser(extract_images=False, mode="page"),
-            )
-            documents = loader.load()
-            parser_info = f"PyPDF {pypdf.__version__}"
+            with file.open_stream() as fp:
+                return TieredPdfExtractor(fp, file.id).page_count
+        except Exception:
+            # files which neither parser can read fail when they are processed
+            return None
+
+    def process_pages(
+        self, file: SourceFile, first_page: int, last_page: int, page_count: int, chunk_size: int | None = None
+    ) -> list[ProcessedPage]:
+        return list(self.iter_split_pages(file, self.splitter(chunk_size), first_page, last_page, page_count))
 
+    def iter_split_pages(
+        self,
+        file: SourceFile,
+        splitter: RecursiveCharacterTextSplitter,
+        first_page: int = 0,
+        last_page: int | None = None,
+        page_count: int | None = None,
+    ) -> Iterator[ProcessedPage]:
+        with file.open_stream() as fp:
+            extractor = TieredPdfExtractor(fp, file.id, page_count)
+            page_count = extractor.page_count
+            last_page = page_count if last_page is None else min(last_page, page_count)
+
+            for number in range(first_page, last_page):
+                start = time.perf_counter()
+                page, parser = extractor.extract(number)
+                seconds = time.perf_counter() - start
+                if seconds > SLOW_PAGE_SECONDS:
+                    logger.warning(f"Extracting page {number + 1} of PDF {file.id} took {seconds:.1f}s")
+
+                yield ProcessedPage(
+                    chunks=self.split_page(splitter, page, PARSER_VERSIONS[parser]), parser=parser, seconds=seconds
+                )
+
+    @staticmethod
+    def split_page(splitter: RecursiveCharacterTextSplitter, page: Document, parser_info: str) -> list[Document]:
         uninteresting_metadata = [
             "producer",
             "creator",
@@ -84,17 +256,16 @@ class PdfProvider(AbstractFormatProvider):
             "ptex.fullbanner",
         ]
 
-        for doc in documents:
-            doc.metadata["pdf_parser"] = parser_info
-            if "page" in doc.metadata:
-                # this loader starts to count at 0
-                # since convention for pdfs (and books, ...) is to start at 1, we need to increase it here
-                doc.metadata["page"] += 1
-            for key in uninteresting_metadata:
-                if key in doc.metadata:
-                    del doc.metadata[key]
-
-        chunks = self.splitter(chunk_size, chunk_overlap).split_documents(documents)
+        page.metadata["pdf_parser"] = parser_info
+        if "page" in page.metadata:
+            # this loader starts to count at 0
+            # since convention for pdfs (and books, ...) is to start at 1, we need to increase it here
+            page.metadata["page"] += 1
+        for key in uninteresting_metadata:
+            if key in page.metadata:
+                del page.metadata[key]
+
+        chunks = splitter.split_documents([page])
 
         # apparently we can encounter 0x00 bytes, which can not be handled by pgvector
         for c in chunks:
@@ -0,0 +1,278 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+import posixpath
+import re
+from itertools import groupby
+from typing import IO, Any, Iterable, Iterator
+from xml.etree import ElementTree
+from xml.etree.ElementTree import Element
+from zipfile import ZipFile
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+
+# Spreadsheets are read row by row, such that only the current chunk is kept in memory,
+# instead of rendering the whole workbook to pdf first.
+# A row is given by the name of its sheet, its row number (starting at 1) and the texts of its cells.
+Row = tuple[str, int, list[str]]
+
+S = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+R = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+RELATIONSHIPS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+TABLE = "{urn:oasis:names:tc:opendocument:xmlns:table:1.0}"
+OFFICE = "{urn:oasis:names:tc:opendocument:xmlns:office:1.0}"
+TEXT = "{urn:oasis:names:tc:opendocument:xmlns:text:1.0}"
+
+# built-in number formats of Excel, which show dates or times
+DATE_FORMAT_IDS = {14, 15, 16, 17, 18, 19, 20, 21, 22, 27, 30, 36, 45, 46, 47, 50, 57}
+
+# rows and cells of ods files, which are repeated more often, are only expanded up to this number
+MAX_REPEATED = 1000
+
+
+def is_date_format(format_code: str) -> bool:
+    # ignore quoted text, escaped characters and colors or conditions in brackets
+    code = re.sub(r'"[^"]*"|\\.|\[[^\]]*\]', "", format_code).lower()
+    return any(token in code for token in "ymdhs") and code != "general"
+
+
+def get_date_styles(archive: ZipFile) -> set[int]:
+    """Returns the indices of the cell styles, which show their number as a date."""
+    if "xl/styles.xml" not in archive.namelist():
+        return set()
+    with archive.open("xl/styles.xml") as xml:
+        root = ElementTree.parse(xml).getroot()
+
+    date_formats = set(DATE_FORMAT_IDS)
+    for number_format in root.iter(f"{S}numFmt"):
+        if is_date_format(number_format.get("formatCode", "")):
+            date_formats.add(int(number_format.get("numFmtId", "0")))
+
+    cell_formats = root.find(f"{S}cellXfs")
+    if cell_formats is None:
+        return set()
+    return {
+        index
+        for index, cell_format in enumerate(cell_formats.iter(f"{S}xf"))
+        if int(cell_format.get("numFmtId", "0")) in date_formats
+    }
+
+
+def format_date(serial: float, date1904: bool) -> str:
+    epoch = datetime(1904, 1, 1) if date1904 else datetime(1899, 12, 30)
+    value = epoch + timedelta(days=serial)
+    if serial < 1:
+        return value.time().isoformat(timespec="seconds")
+    if value.time() == datetime.min.time():
+        return value.date().isoformat()
+    return value.isoformat(sep=" ", timespec="seconds")
+
+
+def get_shared_strings(archive: ZipFile) -> list[str]:
+    # the shared strings are referenced in any order by the cells, so they need to be kept in memory
+    if "xl/sharedStrings.xml" not in archive.namelist():
+        return []
+    strings = []
+    with archive.open("xl/sharedStrings.xml") as xml:
+        for _, element in ElementTree.iterparse(xml):
+            if element.tag == f"{S}si":
+                # rich text consists of several runs, phonetic hints are skipped
+                texts = element.findall(f"{S}t") + element.findall(f"{S}r/{S}t")
+                strings.append("".join(t.text or "" for t in texts))
+                element.clear()
+    return strings
+
+
+def get_sheets(archive: ZipFile) -> list[tuple[str, str]]:
+    """Returns the names and paths of the worksheets inside the archive in the order of the workbook."""
+    with archive.open("xl/_rels/workbook.xml.rels") as xml:
+        targets = {
+            relationship.get("Id"): relationship.get("Target", "")
+            for relationship in ElementTree.parse(xml).getroot().iter(f"{RELATIONSHIPS}Relationship")
+        }
+    with archive.open("xl/workbook.xml") as xml:
+        sheets = [
+            (sheet.get("name", ""), sheet.get(f"{R}id")) for sheet in ElementTree.parse(xml).getroot().iter(f"{S}sheet")
+        ]
+
+    result = []
+    for name, id_ in sheets:
+        target = targets[id_]
+        # targets are relative to the workbook, unless they are absolute
+        result.append(
+            (name, target[1:] if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target)))
+        )
+    return result
+
+
+def is_date1904(archive: ZipFile) -> bool:
+    with archive.open("xl/workbook.xml") as xml:
+        properties = ElementTree.parse(xml).getroot().find(f"{S}workbookPr")
+    return properties is not None and properties.get("date1904", "false") in {"1", "true"}
+
+
+def column_index(reference: str) -> int:
+    """Returns the index (starting at 0) of the column of a cell reference like `AB12`."""
+    index = 0
+    for char in reference:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - ord("A") + 1
+    return index - 1
+
+
+def cell_text(cell: Element, shared_strings: list[str], date_styles: set[int], date1904: bool) -> str:
+    cell_type = cell.get("t", "n")
+    if cell_type == "inlineStr":
+        return "".join(t.text or "" for t in cell.iter(f"{S}t"))
+
+    value = cell.findtext(f"{S}v")
+    if value is None:
+        return ""
+    if cell_type == "s":
+        return shared_strings[int(value)]
+    if cell_type == "b":
+        return "TRUE" if value == "1" else "FALSE"
+    if cell_type == "n" and int(cell.get("s", "0")) in date_styles:
+        try:
+            return format_date(float(value), date1904)
+        except (ValueError, OverflowError):
+            return value
+    return value
+
+
+def iterparse_rows(xml: IO[bytes], row_tag: str, table_tag: str | None = None) -> Iterator[tuple[str, Element]]:
+    """Yields the name of the current table and every completed row.
+
+    The rows are removed from the tree afterwards, such that the memory needed does not grow with the number of rows.
+    """
+    parents: list[Element] = []
+    table = ""
+    for event, element in ElementTree.iterparse(xml, events=("start", "end")):
+        if event == "start":
+            parents.append(element)
+            if element.tag == table_tag:
+                table = element.get(f"{TABLE}name", "")
+            continue
+
+        parents.pop()
+        if element.tag == row_tag:
+            yield table, element
+            if parents:
+                parents[-1].remove(element)
+
+
+def iter_xlsx_rows(path: str | Path) -> Iterator[Row]:
+    with ZipFile(path) as archive:
+        shared_strings = get_shared_strings(archive)
+        date_styles = get_date_styles(archive)
+        date1904 = is_date1904(archive)
+
+        for sheet, name in get_sheets(archive):
+            with archive.open(name) as xml:
+                row_number = 0
+                for _, row in iterparse_rows(xml, f"{S}row"):
+                    row_number = int(row.get("r", row_number + 1))
+                    cells: list[str] = []
+                    for cell in row.iter(f"{S}c"):
+                        # empty cells are omitted, so the position is taken from the reference if given
+                        index = column_index(cell.get("r", "")) if cell.get("r") else len(cells)
+                        cells.extend([""] * (index - len(cells)))
+                        cells.append(cell_text(cell, shared_strings, date_styles, date1904))
+                    yield sheet, row_number, cells
+
+
+def ods_cell_text(cell: Element) -> str:
+    if cell.get(f"{OFFICE}value-type") == "date":
+        return cell.get(f"{OFFICE}date-value", "")
+    return "\n".join("".join(paragraph.itertext()) for paragraph in cell.iter(f"{TEXT}p"))
+
+
+def iter_ods_rows(path: str | Path) -> Iterator[Row]:
+    with ZipFile(path) as archive, archive.open("content.xml") as xml:
+        row_number = 0
+        current_sheet = None
+        for sheet, row in iterparse_rows(xml, f"{TABLE}table-row", f"{TABLE}table"):
+            if sheet != current_sheet:
+                current_sheet = sheet
+                row_number = 0
+
+            cells: list[str] = []
+            for cell in row:
+                if cell.tag not in {f"{TABLE}table-cell", f"{TABLE}covered-table-cell"}:
+                    continue
+                text = ods_cell_text(cell)
+                repeated = int(cell.get(f"{TABLE}number-columns-repeated", "1"))
+                # empty cells are repeated up to the last column of the sheet
+                cells.extend([text] * (repeated if text else min(repeated, MAX_REPEATED)))
+
+            # e.g. the empty rows up to the end of the sheet are given as a single repeated row
+            repeated = int(row.get(f"{TABLE}number-rows-repeated", "1"))
+            if not any(cells):
+                row_number += repeated
+                continue
+            for _ in range(min(repeated, MAX_REPEATED)):
+                row_number += 1
+                yield sheet, row_number, cells
+            row_number += max(0, repeated - MAX_REPEATED)
+
+
+def format_row(cells: list[str]) -> str:
+    # the cells are formatted as a row of a markdown table
+    return "| " + " | ".join(cell.replace("|", "\\|").replace("\n", " ") for cell in cells) + " |"
+
+
+def split_chunk(
+    splitter: RecursiveCharacterTextSplitter, chunk_size: int, text: str, metadata: dict[str, Any]
+) -> list[Document]:
+    document = Document(page_content=text, metadata=metadata)
+    # only a single row which is too long on its own needs to be split
+    if len(text) <= chunk_size:
+        return [document]
+    return splitter.split_documents([document])
+
+
+def trim(cells: list[str]) -> list[str]:
+    end = len(cells)
+    while end > 0 and not cells[end - 1].strip():
+        end -= 1
+    return cells[:end]
+
+
+def iter_row_chunks(
+    rows: Iterable[Row], splitter: RecursiveCharacterTextSplitter, chunk_size: int
+) -> Iterator[Document]:
+    """Joins consecutive rows of a sheet to chunks of up to `chunk_size` characters.
+
+    The first non-empty row of every sheet is taken as its header and repeated at the start of every chunk,
+    such that every chunk can be understood on its own. Rows are not cut, unless a single row is too long.
+    """
+    # trailing empty cells are not shown and empty rows are skipped
+    trimmed = ((sheet, row_number, trim(cells)) for sheet, row_number, cells in rows)
+    non_empty = ((sheet, row_number, cells) for sheet, row_number, cells in trimmed if cells)
+
+    for sheet, group in groupby(non_empty, key=lambda row: row[0]):
+        sheet_rows = iter(group)
+        _, header_row, header_cells = next(sheet_rows)
+        header = "\n".join([format_row(header_cells), format_row(["---"] * len(header_cells))])
+
+        lines: list[str] = []
+        length = len(header)
+        first_row = last_row = header_row
+        for _, row_number, cells in sheet_rows:
+            line = format_row(cells)
+            if lines and length + len(line) + 1 > chunk_size:
+                metadata = {"sheet": sheet, "first_row": first_row, "last_row": last_row}
+                yield from split_chunk(splitter, chunk_size, "\n".join([header, *lines]), metadata)
+                lines = []
+                length = len(header)
+            if not lines:
+                first_row = row_number
+            lines.append(line)
+            length += len(line) + 1
+            last_row = row_number
+
+        metadata = {"sheet": sheet, "first_row": first_row, "last_row": last_row}
+        yield from split_chunk(splitter, chunk_size, "\n".join([header, *lines]), metadata)
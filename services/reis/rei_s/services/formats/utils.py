@@ -1,19 +1,12 @@
-from io import BytesIO
 import os
 from pathlib import Path
 import shutil
 import subprocess
 import tempfile
-from typing import Generator
 from uuid import uuid4
 
-from langchain_core.documents.base import Blob
-from langchain_community.document_loaders.blob_loaders import BlobLoader
-import markdown
-from pygments.formatters import HtmlFormatter
-from weasyprint import HTML
-
 from rei_s import logger
+from rei_s.services.office_pool import get_office_pool
 from rei_s.types.source_file import SourceFile
 from rei_s.utils import get_new_file_path
 
@@ -40,14 +33,6 @@ def validate_chunk_overlap(chunk_overlap: int | None, default: int) -> int:
     return chunk_overlap
 
 
-class BytesLoader(BlobLoader):
-    def __init__(self, buffer: BytesIO) -> None:
-        self.buffer = buffer
-
-    def yield_blobs(self) -> Generator[Blob, None, None]:
-        yield Blob.from_data(self.buffer.getvalue(), path="stream")
-
-
 class ProcessingError(Exception):
     def __init__(self, message: str, status: int) -> None:
         super().__init__(message)
@@ -56,7 +41,7 @@ class ProcessingError(Exception):
 
 
 def generate_pdf_from_md_file(file: SourceFile, format_: str | None = None) -> SourceFile:
-    markdown_text = file.buffer.decode()
+    markdown_text = file.read_text()
     if format_ in {"plain", "md", "markdown"}:
         markdown_text = markdown_text
     elif format_:
@@ -67,6 +52,11 @@ def generate_pdf_from_md_file(file: SourceFile, format_: str | None = None) -> S
 
 
 def generate_pdf_from_md(markdown_text: str, doc_id: str, file_name: str) -> SourceFile:
+    # these are imported on first use, because weasyprint is heavy and not needed for searching
+    import markdown
+    from pygments.formatters import HtmlFormatter
+    from weasyprint import HTML
+
     # Convert markdown to HTML
     html = markdown.markdown(markdown_text, extensions=["fenced_code", "codehilite", "tables", "sane_lists"])
     formatter = HtmlFormatter(style="vs", cssclass="codehilite")
@@ -82,6 +72,22 @@ def generate_pdf_from_md(markdown_text: str, doc_id: str, file_name: str) -> Sou
 def convert_office_to_pdf(file: SourceFile) -> SourceFile:
     output_dir = Path(tempfile.gettempdir()) / uuid4().hex
     output_dir.mkdir(parents=True, exist_ok=True)
+    base = os.path.basename(file.path)
+    pdf_name = os.path.splitext(base)[0] + ".pdf"
+    pdf_path = os.path.join(output_dir, pdf_name)
+
+    # without the pool, e.g., in a worker process, LibreOffice is started for this file only
+    office_pool = get_office_pool()
+    if office_pool is not None:
+        try:
+            office_pool.convert(file.path, pdf_path)
+        except Exception as e:
+            shutil.rmtree(output_dir, ignore_errors=True)
+            raise ValueError(f"Can not convert {file.id} to pdf: {e!r}") from e
+        return SourceFile(
+            id=file.id, path=pdf_path, mime_type="application/pdf", file_name=file.file_name, delete_dir=True
+        )
+
     libreoffice_home = Path(tempfile.gettempdir()) / uuid4().hex
     libreoffice_home.mkdir(parents=True, exist_ok=True)
 
@@ -106,8 +112,4 @@ def convert_office_to_pdf(file: SourceFile) -> SourceFile:
     finally:
         shutil.rmtree(libreoffice_home, ignore_errors=True)
 
-    base = os.path.basename(file.path)
-    pdf_name = os.path.splitext(base)[0] + ".pdf"
-    pdf_path = os.path.join(output_dir, pdf_name)
-
     return SourceFile(id=file.id, path=pdf_path, mime_type="application/pdf", file_name=file.file_name, delete_dir=True)
@@ -1,17 +1,14 @@
-from pathlib import Path
 from typing import Any
 
-from langchain_core.documents import Document
 import ffmpeg
 
-from rei_s import logger
 from rei_s.config import Config
-from rei_s.services.formats.utils import ProcessingError, generate_pdf_from_md_file
 from rei_s.services.formats.voice_transcription_provider import VoiceTranscriptionProvider
-from rei_s.types.source_file import SourceFile, temp_file
 
 
 class VideoTranscriptionProvider(VoiceTranscriptionProvider):
+    # The audio track is demuxed and segmented by a single pass of ffmpeg,
+    # without writing the whole audio track to a file first.
     name = "video-transcription"
 
     file_name_extensions = [
@@ -40,53 +37,3 @@ class VideoTranscriptionProvider(VoiceTranscriptionProvider):
             "Error extracting audio track from video file for voice transcription with ffmpeg\n\n"
             f"ffmpeg stderr:\n{e.stderr}"
         )
-
-    def extract_audio_to_file(self, input_video_path: str | Path, output_bitrate: str = "128k") -> SourceFile:
-        metadata = self.probe_audio_codec(input_video_path)
-        audio_codec = metadata.audio_codec
-
-        if audio_codec in self.supported_audio_codecs:
-            logger.info(f"extract audiotrack ({audio_codec}) from video")
-            output_kwargs = {"acodec": "copy"}
-        else:
-            logger.info(f"transcode audiotrack ({audio_codec}) to ogg")
-            output_kwargs = {"audio_bitrate": output_bitrate}
-            audio_codec = "vorbis"
-
-        audio_only_file = SourceFile.new_temporary_file(extension=self.audio_codecs_to_file_extension[audio_codec])
-        try:
-            _out, _err = (
-                ffmpeg.input(input_video_path)
-                .output(audio_only_file.path, y=None, vn=None, **output_kwargs)
-                .run(capture_stdout=True, capture_stderr=True)
-            )
-        except ffmpeg.Error as e:  # pragma: no cover
-            message = self.build_ffmpeg_error_message(e)
-            logger.error(message)
-            raise ProcessingError(message, 400) from e
-
-        return audio_only_file
-
-    def parse_file(
-        self, file: SourceFile, chunk_size: int | None = None, chunk_overlap: int | None = None
-    ) -> list[Document]:
-        audio_file = self.extract_audio_to_file(file.path)
-        docs = super().parse_file(audio_file)
-        audio_file.delete()
-        return docs
-
-    def process_file(
-        self, file: SourceFile, chunk_size: int | None = None, chunk_overlap: int | None = None
-    ) -> list[Document]:
-        audio_file = self.extract_audio_to_file(file.path)
-        chunks = super().process_file(audio_file, chunk_size, chunk_overlap)
-        audio_file.delete()
-        return chunks
-
-    def convert_file_to_pdf(self, file: SourceFile) -> SourceFile:
-        docs = self.parse_file(file)
-
-        plain = "\n".join([doc.page_content for doc in docs])
-
-        with temp_file(plain.encode()) as plain_file:
-            return generate_pdf_from_md_file(plain_file, "plain")
@@ -1,6 +1,15 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing
+import csv
 from dataclasses import dataclass
+from glob import escape as glob_escape, glob
+import os
 from pathlib import Path
-from typing import Any
+import subprocess
+import tempfile
+from threading import BoundedSemaphore, Lock
+import time
+from typing import Any, Generator
 
 from langchain_core.documents import Document
 from langchain_core.documents.base import Blob
@@ -19,16 +28,47 @@ from rei_s.services.formats.utils import (
     generate_pdf_from_md_file,
 )
 from rei_s.types.source_file import SourceFile, temp_file
+from rei_s.utils import get_new_file_path
+
+
+# whisper rejects files larger than 25 MB
+MAX_SEGMENT_BYTES = 25 * 1000 * 1000
+# the bitrate of a part of the audio can be higher than the average bitrate, and the container adds some overhead
+SEGMENT_SIZE_MARGIN = 0.8
+# seconds between checks for new segments written by ffmpeg
+SEGMENT_POLL_SECONDS = 0.5
+
+
+class SegmentTooLargeError(Exception):
+    pass
+
+
+# one limit of the requests in flight per deployment, shared by the providers of all formats and all files
+request_limits: dict[str, BoundedSemaphore] = {}
+request_limits_lock = Lock()
+
+
+def get_request_limit(deployment: str, concurrency: int) -> BoundedSemaphore:
+    with request_limits_lock:
+        limit = request_limits.get(deployment)
+        if limit is None:
+            limit = BoundedSemaphore(concurrency)
+            request_limits[deployment] = limit
+        return limit
 
 
 @dataclass
 class MediaMetadata:
     audio_codec: str | None
     duration: float
+    # average bits per second of the audio, if known
+    bit_rate: int | None = None
 
 
 class VoiceTranscriptionProvider(AbstractFormatProvider):
     name = "audio"
+    family = "transcription"
+    chunks_from_pdf = True
 
     file_name_extensions = [
         ".mp3",
@@ -74,6 +114,14 @@ class VoiceTranscriptionProvider(AbstractFormatProvider):
         self.default_chunk_size = chunk_size
         self.default_chunk_overlap = chunk_overlap
         self.default_segment_duration = default_segment_duration
+        self.concurrency = config.stt_concurrency if config else 1
+        # the limit is shared by audio and video files, such that the rate limit of the deployment is respected
+        deployment = (
+            f"{config.stt_azure_openai_whisper_endpoint}/{config.stt_azure_openai_whisper_deployment_name}"
+            if config
+            else ""
+        )
+        self.requests = get_request_limit(deployment, self.concurrency)
 
         if config and config.stt_type == "azure-openai-whisper":
             # this is ensured by the config validation, the following lines are there to help the mypy typechecker
@@ -119,93 +167,228 @@ class VoiceTranscriptionProvider(AbstractFormatProvider):
             raise ProcessingError(message, 400) from e
 
         audio_codec = None
+        bit_rate = None
         for stream in metadata["streams"]:
             if stream["codec_type"] == "audio":
                 audio_codec = stream["codec_name"]
+                bit_rate = stream.get("bit_rate")
                 break
 
         duration = float(metadata["format"]["duration"])
+        has_video = any(stream["codec_type"] == "video" for stream in metadata["streams"])
+        if bit_rate is None and audio_codec is not None and not has_video:
+            # e.g. flac streams do not state their bitrate, but then the audio is the only content of the file
+            bit_rate = metadata["format"].get("bit_rate")
 
-        return MediaMetadata(audio_codec, duration)
+        return MediaMetadata(audio_codec, duration, int(bit_rate) if bit_rate is not None else None)
 
-    def split_into_compatible_format(
+    @staticmethod
+    def predict_segment_size(metadata: MediaMetadata, segment_duration_seconds: int) -> float | None:
+        if metadata.bit_rate is None:
+            return None
+        return metadata.bit_rate / 8 * min(segment_duration_seconds, metadata.duration)
+
+    def is_bit_rate_safe(self, metadata: MediaMetadata, first_segment: SourceFile) -> bool:
+        """Estimates the bitrate from the first segment, e.g., for Matroska files which do not state it."""
+        # all segments except the last one are as long as the first
+        duration = min(self.default_segment_duration, metadata.duration)
+        if duration <= 0:
+            return False
+        estimate = MediaMetadata(metadata.audio_codec, metadata.duration, int(first_segment.size * 8 / duration))
+        predicted_size = self.predict_segment_size(estimate, self.default_segment_duration)
+        safe = predicted_size is not None and predicted_size < SEGMENT_SIZE_MARGIN * MAX_SEGMENT_BYTES
+        if safe:
+            logger.info(f"estimated audio bitrate of {estimate.bit_rate} bit/s, transcribe the segments early")
+        return safe
+
+    def output_codec(self, metadata: MediaMetadata, segment_duration_seconds: int | None, force_reencode: bool) -> str:
+        """Returns the codec of the segments, which is the codec of the input if it can be copied."""
+        if segment_duration_seconds is None:
+            segment_duration_seconds = self.default_segment_duration
+
+        # segments larger than 25 MB, e.g., for very high bitrates, are reencoded with a lower bitrate.
+        # Their size is predicted from the bitrate, such that the audio is only segmented once.
+        predicted_size = self.predict_segment_size(metadata, segment_duration_seconds)
+        too_large = predicted_size is not None and predicted_size >= SEGMENT_SIZE_MARGIN * MAX_SEGMENT_BYTES
+
+        if metadata.audio_codec in self.supported_audio_codecs and not force_reencode and not too_large:
+            return metadata.audio_codec
+        return "vorbis"
+
+    def iter_segments(
         self,
         input_path: str | Path,
+        metadata: MediaMetadata,
         segment_duration_seconds: int | None = None,
         output_bitrate: str = "128k",
         force_reencode: bool = False,
-    ) -> tuple[list[SourceFile], list[int | float], str]:
-        metadata = self.probe_audio_codec(input_path)
-        audio_codec = metadata.audio_codec
-        duration = metadata.duration
+    ) -> Generator[tuple[SourceFile, float], None, None]:
+        """Yields the segments of the audio track and their start times, as soon as ffmpeg finished them.
 
+        The audio track is demuxed (e.g. from a video) and segmented by a single pass of ffmpeg,
+        the segments belong to the caller afterwards.
+        """
         if segment_duration_seconds is None:
             segment_duration_seconds = self.default_segment_duration
 
-        if audio_codec in self.supported_audio_codecs and not force_reencode:
-            logger.info(f"segment audio of length {duration} s")
+        audio_codec = self.output_codec(metadata, segment_duration_seconds, force_reencode)
+        if audio_codec == metadata.audio_codec:
+            logger.info(f"segment audio of length {metadata.duration} s")
             output_kwargs = {"c": "copy"}
         else:
-            logger.info(f"segment and reencode audio of length {duration} s")
+            logger.info(f"segment and reencode audio of length {metadata.duration} s")
             output_kwargs = {"audio_bitrate": output_bitrate}
-            audio_codec = "vorbis"
-
-        segments_files: list[SourceFile] = []
-        segment_timestamps: list[int | float] = list(range(0, int(duration), segment_duration_seconds))
-        for n, start_time in enumerate(segment_timestamps):
-            logger.info(f"segment {n + 1} / {len(segment_timestamps)}")
 
-            segment_file = SourceFile.new_temporary_file(extension=self.audio_codecs_to_file_extension[audio_codec])
-            try:
-                _out, _err = (
-                    ffmpeg.input(input_path, ss=start_time, t=segment_duration_seconds)
-                    .output(segment_file.path, y=None, **output_kwargs)
-                    .run(capture_stdout=True, capture_stderr=True)
-                )
-            except ffmpeg.Error as e:  # pragma: no cover
-                message = self.build_ffmpeg_error_message(e)
-                logger.error(message)
-                raise ProcessingError(message, 400) from e
-
-            segments_files.append(segment_file)
-
-        segment_timestamps.append(duration)
-
-        # check that no segment is larger than 25 MB. This could happen for very high bitrates.
-        # In that case we reencode with a lower bitrate
-        if any(x.size >= 25 * 1000 * 1000 for x in segments_files):
-            # cleanup first
-            for i in segments_files:
-                i.delete()
-            # split with reencode
-            return self.split_into_compatible_format(
-                input_path, segment_duration_seconds, output_bitrate, force_reencode=True
+        # ffmpeg lists the file names and timestamps of the finished segments
+        prefix = get_new_file_path()
+        segment_list = f"{prefix}.csv"
+        cmd = (
+            ffmpeg.input(input_path)
+            .output(
+                f"{prefix}_%05d.{self.audio_codecs_to_file_extension[audio_codec]}",
+                f="segment",
+                segment_time=segment_duration_seconds,
+                segment_list=segment_list,
+                segment_list_type="csv",
+                reset_timestamps=1,
+                # only the first audio track, e.g., without the video or the cover art of mp3 files
+                map="0:a:0",
+                y=None,
+                **output_kwargs,
             )
+            .compile()
+        )
 
-        return segments_files, segment_timestamps, audio_codec
+        yielded: set[str] = set()
+        # the log of ffmpeg is written to a file, since a pipe would block ffmpeg if it is not read continuously
+        with tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=stderr)
+            try:
+                while True:
+                    exited = process.poll() is not None
+                    for segment, start in self.read_segment_list(segment_list)[len(yielded) :]:
+                        yielded.add(str(segment.path))
+                        yield segment, start
+                    if exited:
+                        break
+                    time.sleep(SEGMENT_POLL_SECONDS)
+
+                if process.returncode != 0:
+                    stderr.seek(0)
+                    e = ffmpeg.Error("ffmpeg", None, stderr.read())
+                    message = self.build_ffmpeg_error_message(e)
+                    logger.error(message)
+                    raise ProcessingError(message, 400) from e
+            finally:
+                if process.poll() is None:
+                    # the consumer stopped early
+                    process.kill()
+                    process.wait()
+                if os.path.exists(segment_list):
+                    os.remove(segment_list)
+                # segments which were not handed out, e.g., since they were not finished
+                for path in glob(f"{glob_escape(prefix)}_*"):
+                    if path not in yielded:
+                        os.remove(path)
 
-    def parse_file(self, file: SourceFile) -> list[Document]:
+    @staticmethod
+    def read_segment_list(segment_list: str) -> list[tuple[SourceFile, float]]:
+        """Returns the finished segments and their start times from the list written by the segment muxer of ffmpeg."""
+        if not os.path.exists(segment_list):
+            return []
+        with open(segment_list, newline="") as f:
+            # the last line might not be written completely yet
+            lines = [line for line in f.readlines() if line.endswith("\n")]
+
+        directory = os.path.dirname(segment_list)
+        segments = []
+        for name, start, _end in csv.reader(lines):
+            path = os.path.join(directory, os.path.basename(name))
+            segments.append((SourceFile(path=path, mime_type="", file_name=os.path.basename(path)), float(start)))
+        return segments
+
+    def transcribe_segment(self, segment: SourceFile, n: int) -> list[Document]:
         if self.parser is None:
             raise ValueError(f"calling disabled format provider: `{self.__class__.name}`")
 
-        # Azure detects the format depending on the extension, so we need to preserve that.
-        # If the file is larger than 25 MB, split it into multiple files and combine the output
-        segments, segment_timestamps, _audio_codec = self.split_into_compatible_format(file.path)
-
-        results = []
-        for n, segment in enumerate(segments):
-            blob = Blob.from_path(segment.path)
-            logger.info(f"process {n + 1} / {len(segments)}")
+        blob = Blob.from_path(segment.path)
+        with self.requests:
+            logger.info(f"process segment {n + 1}")
             try:
-                docs = self.parser.parse(blob)
+                return self.parser.parse(blob)
             except openai.APIStatusError as e:  # pragma: no cover
                 if e.status_code == 413:
                     raise ProcessingError("File too large. The limit is 25 MiB.", e.status_code) from e
                 else:
                     raise
             finally:
+                # free the disk space as early as possible
                 segment.delete()
 
+    def parse_file(self, file: SourceFile) -> list[Document]:
+        if self.parser is None:
+            raise ValueError(f"calling disabled format provider: `{self.__class__.name}`")
+
+        # the probe is only done once, even if the audio needs to be segmented again
+        metadata = self.probe_audio_codec(file.path)
+        try:
+            return self.transcribe_segments(file, metadata, force_reencode=False)
+        except SegmentTooLargeError:
+            # the bitrate was unknown or too far off
+            logger.warning("segments larger than predicted, reencode audio")
+            return self.transcribe_segments(file, metadata, force_reencode=True)
+
+    def transcribe_segments(self, file: SourceFile, metadata: MediaMetadata, force_reencode: bool) -> list[Document]:
+        # Azure detects the format depending on the extension, so we need to preserve that.
+        # Long files are split into segments of at most 25 MB, which are transcribed concurrently
+        # as soon as ffmpeg finished them, and their results are combined in order.
+        segments: list[SourceFile] = []
+        segment_timestamps: list[int | float] = []
+        futures: list[Future[list[Document]]] = []
+        # If the size of the copied segments can not be predicted, any of them might be too large and the audio
+        # would have to be segmented again. Then the segments are held back, such that no transcriptions are wasted,
+        # until the bitrate estimated from the first segment is safely under the limit.
+        copied = self.output_codec(metadata, None, force_reencode) == metadata.audio_codec
+        check_all_first = copied and self.predict_segment_size(metadata, self.default_segment_duration) is None
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                # closing the generator stops ffmpeg, if a segment fails
+                with closing(self.iter_segments(file.path, metadata, force_reencode=force_reencode)) as produced:
+                    try:
+                        for n, (segment, start) in enumerate(produced):
+                            segments.append(segment)
+                            segment_timestamps.append(start)
+                            if segment.size >= MAX_SEGMENT_BYTES:
+                                if force_reencode:
+                                    raise ProcessingError("File too large. The limit is 25 MiB.", 413)
+                                raise SegmentTooLargeError()
+                            if check_all_first and n == 0:
+                                check_all_first = not self.is_bit_rate_safe(metadata, segment)
+                            if not check_all_first:
+                                # including the segments which were held back
+                                futures.extend(
+                                    executor.submit(self.transcribe_segment, segments[m], m)
+                                    for m in range(len(futures), n + 1)
+                                )
+                        if check_all_first:
+                            futures = [
+                                executor.submit(self.transcribe_segment, segment, n)
+                                for n, segment in enumerate(segments)
+                            ]
+                        transcripts = [future.result() for future in futures]
+                    except BaseException:
+                        for future in futures:
+                            future.cancel()
+                        raise
+        finally:
+            # e.g. segments which were not transcribed, since another one failed
+            for segment in segments:
+                if os.path.exists(segment.path):
+                    segment.delete()
+        segment_timestamps.append(metadata.duration)
+
+        results = []
+        for n, docs in enumerate(transcripts):
             for doc in docs:
                 doc.metadata["segment_begin_seconds"] = segment_timestamps[n]
                 doc.metadata["segment_end_seconds"] = segment_timestamps[n + 1]
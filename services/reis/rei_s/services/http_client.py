@@ -0,0 +1,60 @@
+from importlib.util import find_spec
+
+import httpx
+
+from rei_s import logger
+from rei_s.config import Config
+
+
+# clients for the requests to the embedding model, which keep their connections alive for the lifetime of the process
+http_client: httpx.Client | None = None
+async_http_client: httpx.AsyncClient | None = None
+
+
+def get_limits(config: Config) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=config.embeddings_http_max_connections,
+        max_keepalive_connections=config.embeddings_http_max_connections,
+        keepalive_expiry=config.embeddings_http_keepalive_expiry,
+    )
+
+
+def use_http2(config: Config) -> bool:
+    if not config.embeddings_http2:
+        return False
+    # HTTP/2 needs the optional `h2` package
+    if find_spec("h2") is None:
+        logger.warning("HTTP/2 for the embedding model needs the package `h2`, falling back to HTTP/1.1")
+        return False
+    return True
+
+
+def start_http_clients(config: Config) -> None:
+    global http_client, async_http_client
+
+    http2 = use_http2(config)
+    timeout = httpx.Timeout(config.embeddings_http_timeout, connect=10)
+    http_client = httpx.Client(limits=get_limits(config), http2=http2, timeout=timeout)
+    async_http_client = httpx.AsyncClient(limits=get_limits(config), http2=http2, timeout=timeout)
+    logger.info(f"Started HTTP clients for the embedding model (HTTP/{'2' if http2 else '1.1'})")
+
+
+async def stop_http_clients() -> None:
+    global http_client, async_http_client
+
+    if http_client is not None:
+        http_client.close()
+        http_client = None
+    if async_http_client is not None:
+        await async_http_client.aclose()
+        async_http_client = None
+    logger.info("Stopped HTTP clients for the embedding model")
+
+
+def get_http_client() -> httpx.Client | None:
+    """Returns the shared client, or None if it is not started, e.g., in a worker process."""
+    return http_client
+
+
+def get_async_http_client() -> httpx.AsyncClient | None:
+    return async_http_client
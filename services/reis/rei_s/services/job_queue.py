@@ -0,0 +1,331 @@
+import os
+import shutil
+import sqlite3
+import time
+from threading import Event, Lock, Thread
+import uuid
+
+from fastapi import HTTPException
+
+from rei_s import logger
+from rei_s.config import Config
+from rei_s.types.dtos import JobResult, JobStatus
+from rei_s.types.source_file import SourceFile
+
+
+# a running job, whose lease was not renewed for this time, is considered abandoned, e.g., after a restart
+LEASE_SECONDS = 60
+# jobs which failed this often, e.g. because they crash the server, are not retried again
+MAX_ATTEMPTS = 3
+
+
+class JobQueue:
+    """A durable queue of ingestion jobs in a SQLite file.
+
+    The queue can be shared by multiple processes. A running job holds a lease, which its worker renews
+    periodically. If the worker dies, the lease expires and the job is picked up again.
+    """
+
+    def __init__(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        self.files_path = os.path.join(path, "files")
+        os.makedirs(self.files_path, exist_ok=True)
+
+        self.lock = Lock()
+        self.connection = sqlite3.connect(
+            os.path.join(path, "jobs.sqlite"), timeout=30, check_same_thread=False, isolation_level=None
+        )
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, "
+                "file_id TEXT NOT NULL, file_name TEXT NOT NULL, mime_type TEXT NOT NULL, path TEXT NOT NULL, "
+                "bucket TEXT NOT NULL, index_name TEXT, "
+                "batches_done INTEGER NOT NULL DEFAULT 0, batches_total INTEGER, "
+                "error TEXT, status_code INTEGER, attempts INTEGER NOT NULL DEFAULT 0, "
+                "lease_until REAL, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def new_file_path(self, job_id: str) -> str:
+        return os.path.join(self.files_path, job_id)
+
+    def enqueue(self, job_id: str, file: SourceFile, bucket: str, index_name: str | None) -> None:
+        now = time.time()
+        values = (job_id, JobStatus.queued.value, file.id, file.file_name, file.mime_type, str(file.path))
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO jobs (id, status, file_id, file_name, mime_type, path, bucket, index_name, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (*values, bucket, index_name, now, now),
+            )
+
+    def claim(self) -> tuple[str, SourceFile, str, str | None, int] | None:
+        """Marks the oldest queued or abandoned job as running and returns it."""
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute(
+                    "SELECT id, file_id, file_name, mime_type, path, bucket, index_name, attempts FROM jobs "
+                    "WHERE status = ? OR (status = ? AND lease_until < ?) ORDER BY created_at LIMIT 1",
+                    (JobStatus.queued.value, JobStatus.running.value, now),
+                ).fetchone()
+                if row is not None:
+                    self.connection.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, updated_at = ? "
+                        "WHERE id = ?",
+                        (JobStatus.running.value, now + LEASE_SECONDS, now, row[0]),
+                    )
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+        if row is None:
+            return None
+
+        job_id, file_id, file_name, mime_type, path, bucket, index_name, attempts = row
+        file = SourceFile(id=file_id, path=path, file_name=file_name, mime_type=mime_type)
+        return job_id, file, bucket, index_name, attempts + 1
+
+    def renew(self, job_ids: list[str]) -> None:
+        now = time.time()
+        with self.lock:
+            self.connection.executemany(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = ?",
+                [(now + LEASE_SECONDS, job_id, JobStatus.running.value) for job_id in job_ids],
+            )
+
+    def progress(self, job_id: str, batches_done: int, batches_total: int | None) -> None:
+        with self.lock:
+            self.connection.execute(
+                "UPDATE jobs SET batches_done = ?, batches_total = ?, updated_at = ? WHERE id = ?",
+                (batches_done, batches_total, time.time(), job_id),
+            )
+
+    def finish(self, job_id: str, error: str | None = None, status_code: int | None = None) -> None:
+        status = JobStatus.failed.value if error is not None else JobStatus.succeeded.value
+        with self.lock:
+            self.connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, status_code = ?, lease_until = NULL, updated_at = ? "
+                "WHERE id = ?",
+                (status, error, status_code, time.time(), job_id),
+            )
+            if error is None:
+                # for streamed files, the total number of batches is only known at the end
+                self.connection.execute("UPDATE jobs SET batches_total = batches_done WHERE id = ?", (job_id,))
+
+    def get(self, job_id: str) -> JobResult | None:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT id, file_id, status, batches_done, batches_total, error, status_code, attempts, "
+                "created_at, updated_at FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        keys = [
+            "id",
+            "file_id",
+            "status",
+            "batches_done",
+            "batches_total",
+            "error",
+            "status_code",
+            "attempts",
+            "created_at",
+            "updated_at",
+        ]
+        return JobResult.model_validate(dict(zip(keys, row, strict=True)))
+
+    def cleanup(self, max_age: float) -> None:
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (JobStatus.succeeded.value, JobStatus.failed.value, time.time() - max_age),
+            )
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+class JobDispatcher:
+    """Runs the jobs of the queue in `concurrency` background threads."""
+
+    def __init__(self, config: Config, queue: JobQueue, concurrency: int, poll_interval: float = 1) -> None:
+        self.config = config
+        self.queue = queue
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.stopped = Event()
+        self.wakeup = Event()
+        self.running: set[str] = set()
+        self.running_lock = Lock()
+        self.threads: list[Thread] = []
+
+    def start(self) -> None:
+        for i in range(self.concurrency):
+            thread = Thread(target=self.work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        thread = Thread(target=self.renew_leases, name="job-lease-renewal", daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def notify(self) -> None:
+        self.wakeup.set()
+
+    def stop(self, timeout: float = 5) -> bool:
+        """Stops the workers and returns whether all of them finished within the timeout.
+
+        Running jobs are not interrupted. If the process exits before they are finished,
+        their leases expire and they are picked up again after a restart.
+        """
+        self.stopped.set()
+        self.wakeup.set()
+
+        deadline = time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in self.threads)
+
+    def renew_leases(self) -> None:
+        while not self.stopped.wait(LEASE_SECONDS / 3):
+            with self.running_lock:
+                job_ids = list(self.running)
+            if job_ids:
+                self.queue.renew(job_ids)
+
+    def work(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                job = self.queue.claim()
+            except sqlite3.Error as e:
+                logger.error(f"Could not claim a job: {e!r}")
+                job = None
+
+            if job is None:
+                self.wakeup.wait(self.poll_interval)
+                self.wakeup.clear()
+                continue
+
+            with self.running_lock:
+                self.running.add(job[0])
+            try:
+                self.run(*job)
+            except Exception as e:
+                logger.error(f"Failed running job {job[0]}: {e!r}")
+            finally:
+                with self.running_lock:
+                    self.running.discard(job[0])
+
+    def run(self, job_id: str, file: SourceFile, bucket: str, index_name: str | None, attempt: int) -> None:
+        # imported here to avoid a circular import
+        from rei_s.services import store_service
+
+        logger.info(f"Start job {job_id} for file {file.id} (attempt {attempt})")
+        failure: tuple[str, int] | None = None
+        try:
+            if attempt > MAX_ATTEMPTS:
+                raise HTTPException(status_code=500, detail=f"Processing failed after {MAX_ATTEMPTS} attempts")
+            if attempt > 1:
+                # a previous attempt might have left some chunks behind
+                store_service.get_vector_store(self.config, index_name).delete(file.id)
+
+            store_service.process_and_add_file(
+                self.config,
+                file,
+                bucket,
+                index_name=index_name,
+                progress=lambda done, total: self.queue.progress(job_id, done, total),
+            )
+        except HTTPException as e:
+            logger.error(f"Job {job_id} failed: {e.detail}")
+            failure = (str(e.detail), e.status_code)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e!r}")
+            failure = ("Processing failed", 500)
+
+        if failure is not None and self.stopped.is_set():
+            # the job probably failed because the pools and clients are shut down, so it is neither finished
+            # nor is its file removed. Its lease expires and it is picked up again after a restart.
+            logger.warning(f"Job {job_id} was interrupted by the shutdown")
+            return
+        if failure is not None:
+            self.queue.finish(job_id, error=failure[0], status_code=failure[1])
+        else:
+            logger.info(f"Finished job {job_id}")
+            self.queue.finish(job_id)
+
+        try:
+            file.delete()
+        except FileNotFoundError:
+            pass
+
+
+job_queue: JobQueue | None = None
+job_dispatcher: JobDispatcher | None = None
+
+
+def start_job_queue(config: Config) -> None:
+    global job_queue, job_dispatcher
+
+    if config.jobs_path is None:
+        logger.info("Job queue disabled, files are always processed synchronously")
+        return
+
+    concurrency = config.jobs_concurrency if config.jobs_concurrency is not None else config.workers
+    job_queue = JobQueue(config.jobs_path)
+    job_queue.cleanup(config.jobs_retention_hours * 3600)
+    job_dispatcher = JobDispatcher(config, job_queue, concurrency)
+    job_dispatcher.start()
+    logger.info(f"Started job queue in {config.jobs_path} with {concurrency} workers")
+
+
+def stop_job_queue() -> bool:
+    """Stops the job queue and returns whether no jobs are running anymore."""
+    global job_queue, job_dispatcher
+
+    stopped = True
+    if job_dispatcher is not None and job_queue is not None:
+        stopped = job_dispatcher.stop()
+        if stopped:
+            job_queue.close()
+        else:
+            logger.warning("Stopped job queue while jobs are still running")
+        job_dispatcher = None
+        job_queue = None
+        logger.info("Stopped job queue")
+    return stopped
+
+
+def submit_job(file: SourceFile, bucket: str, index_name: str | None) -> str | None:
+    """Moves the file into the queue and returns the job id, or None if the job queue is disabled."""
+    if job_queue is None or job_dispatcher is None:
+        return None
+
+    job_id = str(uuid.uuid4())
+    path = job_queue.new_file_path(job_id)
+    # the upload needs to survive a restart, so it is moved out of the temporary directory
+    shutil.move(file.path, path)
+    queued_file = file.model_copy(update={"path": path})
+
+    try:
+        job_queue.enqueue(job_id, queued_file, bucket, index_name)
+    except BaseException:
+        queued_file.delete()
+        raise
+
+    job_dispatcher.notify()
+    return job_id
+
+
+def get_job(job_id: str) -> JobResult | None:
+    if job_queue is None:
+        return None
+    return job_queue.get(job_id)
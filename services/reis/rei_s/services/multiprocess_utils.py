@@ -1,5 +1,8 @@
 import logging
 import multiprocessing as mp
+from multiprocessing.connection import Connection
+import os
+import resource
 
 from rei_s.logger_formatter import JsonFormatter
 from rei_s.services.formats.abstract_format_provider import AbstractFormatProvider
@@ -43,3 +46,50 @@ def convert_file_in_process(
         queue.put(e)
     else:
         queue.put(chunks)
+
+
+def get_rss() -> int:
+    """Returns the current resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # not on linux, fall back to the peak rss, which is given in kilobytes
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def pool_worker_main(connection: Connection) -> None:
+    """Main loop of the long-lived worker processes of the process pool"""
+    init_subprocess_logger()
+
+    # pre-warm the worker, such that the heavy imports of the format providers
+    # are not paid for by the first task
+    from rei_s.services.formats import import_format_providers
+
+    import_format_providers()
+
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            break
+
+        # `None` signals a shutdown
+        if task is None:
+            break
+
+        fn, args, stream = task
+        try:
+            if stream:
+                # items are sent as soon as they are produced, the final result is empty
+                for item in fn(*args):
+                    connection.send(("item", item, None))
+                result = None
+            else:
+                result = fn(*args)
+        except Exception as e:
+            connection.send(("error", e, get_rss()))
+        else:
+            connection.send(("result", result, get_rss()))
+
+    connection.close()
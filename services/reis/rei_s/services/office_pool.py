@@ -0,0 +1,304 @@
+import atexit
+from contextlib import contextmanager
+import os
+from pathlib import Path
+import queue
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+from threading import Lock
+import time
+from typing import Generator
+from uuid import uuid4
+
+from rei_s import logger
+from rei_s.config import Config
+from rei_s.metrics.metrics import office_pool_busy_instances, office_pool_restarts
+
+
+# seconds to wait for a freshly started instance to accept connections
+STARTUP_TIMEOUT = 60
+# seconds between two checks, whether a caller waiting for an instance should give up
+ACQUIRE_POLL_SECONDS = 1
+# the server and the client of unoserver, which run with the python of LibreOffice
+SERVER_EXECUTABLE = "unoserver"
+CLIENT_EXECUTABLE = "unoconvert"
+
+
+class OfficeInstanceDiedError(Exception):
+    pass
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return int(s.getsockname()[1])
+
+
+class OfficeInstance:
+    """A long-running headless LibreOffice process, which is controlled by `unoserver`.
+
+    Files are converted by calling `unoconvert`, which talks to the server over XML-RPC, such that the service
+    does not need the python module `uno`, which only the python of LibreOffice provides.
+    Every instance has its own user profile, since a profile can only be used by one process at a time.
+    """
+
+    def __init__(self) -> None:
+        self.port = get_free_port()
+        self.profile = Path(tempfile.gettempdir()) / uuid4().hex
+        self.profile.mkdir(parents=True, exist_ok=True)
+        cmd = [
+            SERVER_EXECUTABLE,
+            "--interface",
+            "127.0.0.1",
+            "--port",
+            str(self.port),
+            "--uno-port",
+            str(get_free_port()),
+            "--executable",
+            "soffice",
+            "--user-installation",
+            f"file://{self.profile}",
+        ]
+        # a session of its own, such that LibreOffice is killed together with the server
+        self.process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            env={"HOME": tempfile.gettempdir(), "PATH": os.environ.get("PATH", os.defpath)},
+            start_new_session=True,
+        )
+        self.ready = False
+        self.conversions = 0
+        self.timed_out = False
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def accepts_connections(self) -> bool:
+        try:
+            with socket.create_connection(("127.0.0.1", self.port), timeout=1):
+                return True
+        except OSError:
+            return False
+
+    def wait_until_ready(self) -> None:
+        """Waits for a freshly started instance to accept connections."""
+        if self.ready:
+            return
+
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while not self.accepts_connections():
+            if not self.alive:
+                raise OfficeInstanceDiedError(f"LibreOffice {self.process.pid} exited on startup")
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"LibreOffice {self.process.pid} did not start within {STARTUP_TIMEOUT}s")
+            time.sleep(0.1)
+        self.ready = True
+
+    def healthy(self) -> bool:
+        if not self.alive:
+            return False
+        try:
+            self.wait_until_ready()
+        except Exception as e:
+            logger.warning(f"LibreOffice {self.process.pid} is unhealthy: {e!r}")
+            return False
+        # fails if the server exited or its connection broke since it was started
+        return self.accepts_connections()
+
+    def send_signal(self, sig: signal.Signals) -> None:
+        try:
+            os.killpg(self.process.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def kill(self) -> None:
+        self.timed_out = True
+        self.send_signal(signal.SIGKILL)
+
+    def convert(self, path: str | Path, pdf_path: str | Path, timeout: float) -> None:
+        self.wait_until_ready()
+        cmd = [
+            CLIENT_EXECUTABLE,
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(self.port),
+            "--convert-to",
+            "pdf",
+            str(Path(path).absolute()),
+            str(Path(pdf_path).absolute()),
+        ]
+        try:
+            result = subprocess.run(cmd, capture_output=True, timeout=timeout)
+        except subprocess.TimeoutExpired as e:
+            # a hanging conversion is aborted by killing the instance
+            self.kill()
+            raise TimeoutError(f"LibreOffice did not convert {path} within {timeout}s") from e
+
+        if result.returncode != 0:
+            if not self.alive:
+                raise OfficeInstanceDiedError(f"LibreOffice {self.process.pid} died while converting")
+            error = result.stderr.decode(errors="replace").strip().splitlines()
+            raise ValueError(f"LibreOffice can not convert {path}: {error[-1] if error else result.returncode}")
+        self.conversions += 1
+
+    def stop(self, timeout: float = 5) -> None:
+        self.send_signal(signal.SIGTERM)
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.send_signal(signal.SIGKILL)
+            self.process.wait()
+        shutil.rmtree(self.profile, ignore_errors=True)
+
+
+class OfficePool:
+    """A pool of long-running LibreOffice instances, such that office documents are converted without
+    paying for the startup of LibreOffice and the creation of a user profile every time.
+
+    Instances are checked before every conversion and replaced if they crashed, hang, exceeded the timeout
+    of a conversion or converted `max_conversions` documents.
+    """
+
+    def __init__(self, size: int, timeout: float, max_conversions: int) -> None:
+        self.size = size
+        self.timeout = timeout
+        self.max_conversions = max_conversions
+        self.idle: queue.Queue[OfficeInstance] = queue.Queue()
+        self.instances: set[OfficeInstance] = set()
+        self.lock = Lock()
+        self.closed = False
+
+    def start(self) -> None:
+        for _ in range(self.size):
+            self.idle.put(self.spawn_instance())
+
+    def spawn_instance(self) -> OfficeInstance:
+        instance = OfficeInstance()
+        with self.lock:
+            self.instances.add(instance)
+        return instance
+
+    def stop_instance(self, instance: OfficeInstance) -> None:
+        with self.lock:
+            self.instances.discard(instance)
+        instance.stop()
+
+    def replace_instance(self, instance: OfficeInstance, reason: str) -> None:
+        logger.info(f"Restart LibreOffice {instance.process.pid} ({reason})")
+        self.stop_instance(instance)
+        office_pool_restarts.labels(reason=reason).inc()
+        if not self.closed:
+            self.idle.put(self.spawn_instance())
+
+    def release_instance(self, instance: OfficeInstance) -> None:
+        if instance.conversions >= self.max_conversions:
+            self.replace_instance(instance, "max_conversions")
+        elif self.closed:
+            self.stop_instance(instance)
+        else:
+            self.idle.put(instance)
+
+    def get_idle_instance(self) -> OfficeInstance:
+        # waiting callers must not block the shutdown forever
+        while not self.closed:
+            try:
+                instance = self.idle.get(timeout=ACQUIRE_POLL_SECONDS)
+            except queue.Empty:
+                continue
+            if self.closed:
+                # the instance was released just before the shutdown
+                self.stop_instance(instance)
+                break
+            return instance
+        raise RuntimeError("The LibreOffice pool was already shut down")
+
+    @contextmanager
+    def acquire_instance(self) -> Generator[OfficeInstance, None, None]:
+        instance = self.get_idle_instance()
+        if not instance.healthy():
+            # the replacement is not checked again, if it is broken as well, the conversion fails
+            self.replace_instance(instance, "unhealthy")
+            instance = self.get_idle_instance()
+
+        office_pool_busy_instances.inc()
+        try:
+            yield instance
+        except TimeoutError:
+            self.replace_instance(instance, "timeout")
+            raise
+        except OfficeInstanceDiedError:
+            self.replace_instance(instance, "crashed")
+            raise
+        except BaseException:
+            # e.g. documents which can not be loaded
+            self.release_instance(instance)
+            raise
+        else:
+            self.release_instance(instance)
+        finally:
+            office_pool_busy_instances.dec()
+
+    def convert(self, path: str | Path, pdf_path: str | Path) -> None:
+        with self.acquire_instance() as instance:
+            instance.convert(path, pdf_path, self.timeout)
+
+    def kill(self) -> None:
+        """Kills all instances, e.g., if the process exits while some of them are still busy."""
+        with self.lock:
+            instances = list(self.instances)
+        for instance in instances:
+            instance.send_signal(signal.SIGKILL)
+
+    def shutdown(self) -> None:
+        # instances which are busy at the moment are stopped as soon as they are released
+        self.closed = True
+        while True:
+            try:
+                instance = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self.stop_instance(instance)
+
+
+office_pool: OfficePool | None = None
+
+
+def start_office_pool(config: Config) -> None:
+    global office_pool
+
+    if config.office_pool_size == 0:
+        return
+    # the pool was configured explicitly, so it must not silently fall back to starting LibreOffice for every file
+    missing = [name for name in (SERVER_EXECUTABLE, CLIENT_EXECUTABLE) if shutil.which(name) is None]
+    if missing:
+        raise RuntimeError(f"The LibreOffice pool needs {' and '.join(missing)}, set OFFICE_POOL_SIZE=0 to disable it")
+
+    office_pool = OfficePool(
+        size=config.office_pool_size,
+        timeout=config.office_pool_timeout,
+        max_conversions=config.office_pool_max_conversions,
+    )
+    office_pool.start()
+    # the instances run in sessions of their own, so they would outlive the process otherwise
+    atexit.register(office_pool.kill)
+    logger.info(f"Started {config.office_pool_size} LibreOffice instances")
+
+
+def stop_office_pool() -> None:
+    global office_pool
+
+    if office_pool is not None:
+        office_pool.shutdown()
+        office_pool = None
+        logger.info("Stopped all LibreOffice instances")
+
+
+def get_office_pool() -> OfficePool | None:
+    """Returns the pool, or None if it is disabled or not started, e.g., in a worker process."""
+    return office_pool
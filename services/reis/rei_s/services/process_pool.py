@@ -0,0 +1,235 @@
+from contextlib import contextmanager
+import multiprocessing as mp
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+import queue
+from threading import Lock
+from typing import Any, Callable, Generator, Iterable, TypeVar
+
+from rei_s import logger
+from rei_s.config import Config
+from rei_s.metrics.metrics import process_pool_busy_workers, process_pool_recycles, process_pool_size
+from rei_s.services.multiprocess_utils import pool_worker_main
+
+
+T = TypeVar("T")
+
+# seconds between checks whether the pool was shut down, while waiting for an idle worker
+ACQUIRE_POLL_SECONDS = 1
+
+
+class WorkerDiedError(Exception):
+    pass
+
+
+class PoolWorker:
+    process: BaseProcess
+    connection: Connection
+    tasks_done: int
+    in_task: bool
+    rss: int
+
+    def __init__(self, ctx: Any) -> None:
+        parent_connection, child_connection = ctx.Pipe()
+        self.process = ctx.Process(target=pool_worker_main, args=(child_connection,), daemon=True)
+        self.process.start()
+        # the child end is only needed in the child process
+        child_connection.close()
+        self.connection = parent_connection
+        self.tasks_done = 0
+        self.in_task = False
+        self.rss = 0
+
+    def submit(self, fn: Callable[..., Any], args: tuple[Any, ...], stream: bool) -> None:
+        try:
+            self.connection.send((fn, args, stream))
+        except (EOFError, OSError) as e:
+            raise WorkerDiedError(f"worker process {self.process.pid} died") from e
+        self.in_task = True
+
+    def receive(self) -> tuple[str, Any]:
+        """Receives the next message of the current task, which is either an `item`, the `result` or an `error`"""
+        try:
+            kind, value, rss = self.connection.recv()
+        except (EOFError, OSError) as e:
+            raise WorkerDiedError(f"worker process {self.process.pid} died while processing") from e
+
+        if kind != "item":
+            self.in_task = False
+            self.tasks_done += 1
+            self.rss = rss
+        return kind, value
+
+    def stop(self, timeout: float = 5) -> None:
+        if self.in_task:
+            # the worker would not listen for the shutdown signal
+            self.process.kill()
+        try:
+            self.connection.send(None)
+        except (EOFError, OSError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+
+class ProcessPool:
+    """A pool of long-lived, pre-warmed worker processes for the CPU intensive processing steps.
+
+    Workers are recycled after `max_tasks` tasks or if their memory usage exceeds `max_rss` bytes,
+    such that the memory used for processing large files is released back to the operating system.
+    """
+
+    def __init__(self, size: int, max_tasks: int, max_rss: int) -> None:
+        self.size = size
+        self.max_tasks = max_tasks
+        self.max_rss = max_rss
+        self.ctx = mp.get_context("spawn")
+        self.idle: queue.Queue[PoolWorker] = queue.Queue()
+        self.workers: set[PoolWorker] = set()
+        self.lock = Lock()
+        self.closed = False
+
+    def start(self) -> None:
+        for _ in range(self.size):
+            self.idle.put(self.spawn_worker())
+
+    def spawn_worker(self) -> PoolWorker:
+        worker = PoolWorker(self.ctx)
+        with self.lock:
+            self.workers.add(worker)
+            process_pool_size.set(len(self.workers))
+        return worker
+
+    def stop_worker(self, worker: PoolWorker) -> None:
+        with self.lock:
+            self.workers.discard(worker)
+            process_pool_size.set(len(self.workers))
+        worker.stop()
+
+    def replace_worker(self, worker: PoolWorker, reason: str) -> None:
+        logger.info(f"Recycle worker process {worker.process.pid} ({reason})")
+        self.stop_worker(worker)
+        process_pool_recycles.labels(reason=reason).inc()
+        if not self.closed:
+            self.idle.put(self.spawn_worker())
+
+    def release_worker(self, worker: PoolWorker) -> None:
+        if worker.in_task:
+            # the task was abandoned, e.g., a stream which was not consumed completely.
+            # The worker would still send the rest of it, so we can not reuse it.
+            self.replace_worker(worker, "aborted")
+        elif worker.tasks_done >= self.max_tasks:
+            self.replace_worker(worker, "max_tasks")
+        elif worker.rss > self.max_rss:
+            self.replace_worker(worker, "max_rss")
+        elif self.closed:
+            self.stop_worker(worker)
+        else:
+            self.idle.put(worker)
+
+    def get_idle_worker(self) -> PoolWorker:
+        # waiting callers must not block the shutdown forever
+        while not self.closed:
+            try:
+                worker = self.idle.get(timeout=ACQUIRE_POLL_SECONDS)
+            except queue.Empty:
+                continue
+            if self.closed:
+                # the worker was released just before the shutdown
+                self.stop_worker(worker)
+                break
+            return worker
+        raise RuntimeError("The process pool was already shut down")
+
+    @contextmanager
+    def acquire_worker(self) -> Generator[PoolWorker, None, None]:
+        worker = self.get_idle_worker()
+        process_pool_busy_workers.inc()
+        try:
+            yield worker
+        except WorkerDiedError:
+            self.replace_worker(worker, "crashed")
+            raise
+        except BaseException:
+            # e.g. exceptions raised in the worker, or arguments which can not be pickled
+            self.release_worker(worker)
+            raise
+        else:
+            self.release_worker(worker)
+        finally:
+            process_pool_busy_workers.dec()
+
+    def run(self, fn: Callable[..., T], *args: Any) -> T:
+        """Runs `fn(*args)` in one of the worker processes and returns its result or raises its exception."""
+        with self.acquire_worker() as worker:
+            worker.submit(fn, args, stream=False)
+            kind, value = worker.receive()
+
+        if kind == "error":
+            raise value
+        result: T = value
+        return result
+
+    def stream(self, fn: Callable[..., Iterable[T]], *args: Any) -> Generator[T, None, None]:
+        """Runs `fn(*args)` in one of the worker processes and yields the items of the returned iterable
+        as soon as they are produced.
+
+        The items are sent one by one through a pipe, which blocks the worker if the consumer is too slow.
+        Thus, neither side needs to keep all items in memory.
+        """
+        with self.acquire_worker() as worker:
+            worker.submit(fn, args, stream=True)
+            while True:
+                kind, value = worker.receive()
+                if kind == "item":
+                    yield value
+                elif kind == "error":
+                    raise value
+                else:
+                    return
+
+    def shutdown(self) -> None:
+        # workers which are busy at the moment are stopped as soon as they are released
+        self.closed = True
+        while True:
+            try:
+                worker = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self.stop_worker(worker)
+
+
+process_pool: ProcessPool | None = None
+
+
+def start_process_pool(config: Config) -> None:
+    global process_pool
+
+    size = config.process_pool_size if config.process_pool_size is not None else config.workers
+    if size == 0:
+        logger.info("Process pool disabled, large files will be processed in newly spawned processes")
+        return
+
+    process_pool = ProcessPool(
+        size=size,
+        max_tasks=config.process_pool_max_tasks,
+        max_rss=config.process_pool_max_rss_mb * 1024 * 1024,
+    )
+    process_pool.start()
+    logger.info(f"Started {size} worker processes")
+
+
+def stop_process_pool() -> None:
+    global process_pool
+
+    if process_pool is not None:
+        process_pool.shutdown()
+        process_pool = None
+        logger.info("Stopped all worker processes")
+
+
+def get_process_pool() -> ProcessPool | None:
+    return process_pool
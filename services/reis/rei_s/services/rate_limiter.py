@@ -0,0 +1,297 @@
+import asyncio
+import sqlite3
+import time
+from threading import Lock
+from typing import Callable
+
+from langchain_core.embeddings import Embeddings
+import httpx
+import openai
+
+from rei_s import logger
+from rei_s.metrics.metrics import (
+    embeddings_rate_limit_tpm,
+    embeddings_rate_limit_wait_seconds,
+    embeddings_rate_limited,
+)
+
+
+# after a 429, the rate is reduced by this factor, but never below `MIN_RATE_FACTOR` of the configured rate
+DECREASE_FACTOR = 0.7
+MIN_RATE_FACTOR = 0.1
+# after every successful request, the rate recovers by this fraction of the configured rate
+INCREASE_FRACTION = 0.05
+# waiting time after a 429 without Retry-After header
+DEFAULT_RETRY_AFTER = 10.0
+# maximum waiting time between retries of other transient errors
+MAX_BACKOFF = 30.0
+
+
+def estimate_tokens(texts: list[str]) -> int:
+    # a rough estimation, which is good enough to pace the requests: about 4 characters per token
+    return sum(len(text) // 4 + 1 for text in texts)
+
+
+def get_status_code(e: BaseException) -> int | None:
+    """Returns the HTTP status code of a failed request to the embedding model, if there is one."""
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code
+    # e.g. the errors of the ollama client
+    status_code = getattr(e, "status_code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def get_retry_after(e: BaseException) -> float | None:
+    """Returns the seconds to wait, if the exception is caused by a rate limit (429), otherwise None."""
+    if get_status_code(e) != 429:
+        return None
+
+    response = getattr(e, "response", None)
+    headers = response.headers if isinstance(response, httpx.Response) else {}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return DEFAULT_RETRY_AFTER
+
+
+def is_transient(e: BaseException) -> bool:
+    # connection errors and timeouts of the OpenAI client and of clients using httpx directly, e.g., ollama
+    if isinstance(e, (openai.APIConnectionError, httpx.TransportError)):
+        return True
+    status_code = get_status_code(e)
+    return status_code is not None and (status_code in (408, 409) or status_code >= 500)
+
+
+class RateLimiter:
+    """Adaptive token buckets for the requests per minute and the tokens per minute of an embedding model.
+
+    The buckets live in a SQLite file, such that all threads and worker processes using the same file share them.
+    A 429 pauses all callers until its Retry-After has passed and reduces the rate multiplicatively,
+    every successful request lets the rate recover additively up to the configured limit.
+    The size of the requests is adapted in the same way.
+    """
+
+    def __init__(self, path: str | None, model: str, rpm: int | None, tpm: int | None, max_batch_size: int) -> None:
+        self.model = model
+        self.limits = {name: limit for name, limit in [("requests", rpm), ("tokens", tpm)] if limit is not None}
+        self.max_batch_size = max_batch_size
+        self.batch_size = max_batch_size
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path or ":memory:", timeout=30, check_same_thread=False, isolation_level=None)
+        with self.lock:
+            if path is not None:
+                self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "model TEXT NOT NULL, name TEXT NOT NULL, "
+                "available REAL NOT NULL, rate REAL NOT NULL, updated REAL NOT NULL, PRIMARY KEY (model, name))"
+            )
+            self.connection.execute("CREATE TABLE IF NOT EXISTS pauses (model TEXT PRIMARY KEY, until REAL NOT NULL)")
+            self.connection.execute("INSERT OR IGNORE INTO pauses (model, until) VALUES (?, 0)", (model,))
+            now = time.time()
+            for name, limit in self.limits.items():
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO buckets (model, name, available, rate, updated) VALUES (?, ?, ?, ?, ?)",
+                    (model, name, limit, limit, now),
+                )
+
+    def try_acquire(self, needed: dict[str, int]) -> float:
+        """Takes the needed capacity and returns 0 if it is available, otherwise returns the seconds to wait."""
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                wait = self.compute_wait(needed, now, take=True)
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        return wait
+
+    def wait_time(self, texts: list[str]) -> float:
+        """Returns the seconds a request with the texts would wait, without taking any capacity."""
+        with self.lock:
+            return self.compute_wait({"requests": 1, "tokens": estimate_tokens(texts)}, time.time(), take=False)
+
+    def compute_wait(self, needed: dict[str, int], now: float, take: bool) -> float:
+        (paused_until,) = self.connection.execute("SELECT until FROM pauses WHERE model = ?", (self.model,)).fetchone()
+        if paused_until > now:
+            return float(paused_until - now)
+
+        wait = 0.0
+        refilled: dict[str, float] = {}
+        for name, available, rate, updated in self.connection.execute(
+            "SELECT name, available, rate, updated FROM buckets WHERE model = ?", (self.model,)
+        ).fetchall():
+            limit = self.limits.get(name)
+            if limit is None:
+                continue
+            available = min(limit, available + rate * max(0, now - updated) / 60)
+            # a request larger than the bucket would wait forever, so it only waits until the bucket is full
+            amount = min(needed[name], limit)
+            if available < amount:
+                wait = max(wait, (amount - available) / rate * 60)
+            refilled[name] = available
+
+        if wait > 0 or not take:
+            return wait
+
+        for name, available in refilled.items():
+            self.connection.execute(
+                "UPDATE buckets SET available = ?, updated = ? WHERE model = ? AND name = ?",
+                (available - needed[name], now, self.model, name),
+            )
+        return 0.0
+
+    def acquire(self, texts: list[str]) -> None:
+        needed = {"requests": 1, "tokens": estimate_tokens(texts)}
+        started = time.monotonic()
+        while (wait := self.try_acquire(needed)) > 0:
+            # other callers may have a different view of the buckets, so check again from time to time
+            time.sleep(min(wait, 5))
+        embeddings_rate_limit_wait_seconds.observe(time.monotonic() - started)
+
+    async def aacquire(self, texts: list[str]) -> None:
+        """Like `acquire`, but waits without blocking the event loop.
+
+        The SQLite transaction may wait for other processes holding the file, so it runs in a thread as well.
+        """
+        needed = {"requests": 1, "tokens": estimate_tokens(texts)}
+        started = time.monotonic()
+        while (wait := await asyncio.to_thread(self.try_acquire, needed)) > 0:
+            await asyncio.sleep(min(wait, 5))
+        embeddings_rate_limit_wait_seconds.observe(time.monotonic() - started)
+
+    def on_rate_limited(self, retry_after: float) -> None:
+        embeddings_rate_limited.inc()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.execute(
+                    "UPDATE pauses SET until = MAX(until, ?) WHERE model = ?", (time.time() + retry_after, self.model)
+                )
+                for name, limit in self.limits.items():
+                    self.connection.execute(
+                        "UPDATE buckets SET rate = MAX(rate * ?, ?) WHERE model = ? AND name = ?",
+                        (DECREASE_FACTOR, limit * MIN_RATE_FACTOR, self.model, name),
+                    )
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.batch_size = max(1, self.batch_size // 2)
+            self.report()
+
+    def on_success(self) -> None:
+        with self.lock:
+            for name, limit in self.limits.items():
+                self.connection.execute(
+                    "UPDATE buckets SET rate = MIN(rate + ?, ?) WHERE model = ? AND name = ?",
+                    (limit * INCREASE_FRACTION, limit, self.model, name),
+                )
+            self.batch_size = min(self.max_batch_size, self.batch_size + max(1, self.batch_size // 10))
+            self.report()
+
+    def report(self) -> None:
+        row = self.connection.execute(
+            "SELECT rate FROM buckets WHERE model = ? AND name = 'tokens'", (self.model,)
+        ).fetchone()
+        if row is not None:
+            embeddings_rate_limit_tpm.set(row[0])
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+class RateLimitedEmbeddings(Embeddings):
+    """Embeddings, which pace their requests with a shared rate limiter and retry rate limits and transient errors."""
+
+    def __init__(self, embeddings: Embeddings, limiter: RateLimiter, max_retries: int) -> None:
+        self.embeddings = embeddings
+        self.limiter = limiter
+        self.max_retries = max_retries
+
+    def backoff(self, e: Exception, attempt: int) -> float:
+        """Returns the seconds to wait before the next attempt or raises the exception, if it should not be retried."""
+        if attempt >= self.max_retries:
+            raise e
+
+        retry_after = get_retry_after(e)
+        if retry_after is not None:
+            logger.warning(f"Rate limited by the embedding model, retry after {retry_after}s (attempt {attempt + 1})")
+            # the limiter is paused, so all callers wait for it
+            self.limiter.on_rate_limited(retry_after)
+            return 0
+        if is_transient(e):
+            logger.warning(f"Embedding request failed, retry (attempt {attempt + 1}): {e!r}")
+            return min(MAX_BACKOFF, 0.5 * 2.0**attempt)
+        raise e
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors: list[list[float]] = []
+        attempt = 0
+        while len(vectors) < len(texts):
+            # the batch size shrinks after a 429, so it is taken again for every request
+            part = texts[len(vectors) : len(vectors) + self.limiter.batch_size]
+            self.limiter.acquire(part)
+            try:
+                result = self.embeddings.embed_documents(part)
+            except Exception as e:
+                time.sleep(self.backoff(e, attempt))
+                attempt += 1
+                continue
+
+            self.limiter.on_success()
+            vectors.extend(result)
+            attempt = 0
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        attempt = 0
+        while True:
+            self.limiter.acquire([text])
+            try:
+                vector = self.embeddings.embed_query(text)
+            except Exception as e:
+                time.sleep(self.backoff(e, attempt))
+                attempt += 1
+                continue
+
+            self.limiter.on_success()
+            return vector
+
+    async def aembed_query(self, text: str) -> list[float]:
+        attempt = 0
+        while True:
+            await self.limiter.aacquire([text])
+            try:
+                vector = await self.embeddings.aembed_query(text)
+            except Exception as e:
+                # the limiter is updated in its SQLite file, which must not block the event loop
+                await asyncio.sleep(await asyncio.to_thread(self.backoff, e, attempt))
+                attempt += 1
+                continue
+
+            await asyncio.to_thread(self.limiter.on_success)
+            return vector
+
+
+# one limiter per embedding model, shared by all requests of this process
+limiters: dict[str, RateLimiter] = {}
+limiters_lock = Lock()
+
+
+def get_rate_limiter(model: str, create: Callable[[], RateLimiter]) -> RateLimiter:
+    with limiters_lock:
+        limiter = limiters.get(model)
+        if limiter is None:
+            limiter = create()
+            limiters[model] = limiter
+        return limiter
@@ -1,15 +1,24 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing
 import multiprocessing as mp
-from typing import Any, Generator, List
+from itertools import islice
+import queue
+from threading import Event, Thread
+from typing import Any, Callable, Generator, Iterable, Iterator, List, Sized
 from math import ceil
 
 from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
 from langchain_core.documents import Document
 
 from rei_s import logger
+from rei_s.services.admission import format_family_slot
 from rei_s.services.filestore_adapter import FileStoreAdapter
-from rei_s.services.formats.pdf_provider import PdfProvider
 from rei_s.services.formats.utils import ProcessingError
 from rei_s.services.multiprocess_utils import convert_file_in_process, process_file_in_process
+from rei_s.services.office_pool import get_office_pool
+from rei_s.services.process_pool import ProcessPool, get_process_pool
 from rei_s.services.embeddings_provider import get_embeddings
 from rei_s.config import Config
 from rei_s.services.vectorstore_adapter import VectorStoreAdapter, VectorStoreFilter
@@ -17,22 +26,41 @@ from rei_s.services import filestore_provider
 from rei_s.services import vectorstore_provider
 from rei_s.types.dtos import SourceDto, ChunkDto, DocumentDto
 from rei_s.types.source_file import SourceFile
-from rei_s.services.formats.abstract_format_provider import AbstractFormatProvider
-from rei_s.services.formats import get_format_provider_mappings, get_format_providers
-from rei_s.metrics.metrics import files_processed_counter
+from rei_s.services.formats.abstract_format_provider import AbstractFormatProvider, ProcessedPage
+from rei_s.services.formats import (
+    find_format_provider_spec,
+    get_format_provider,
+    get_format_provider_spec,
+    get_format_provider_specs,
+)
+from rei_s.metrics.metrics import files_processed_counter, page_extraction_seconds
 
 
-def batched(iterable: List[Document], n: int) -> Generator[List[Document], None, None]:
-    for i in range(0, len(iterable), n):
-        yield iterable[i : i + n]
+# called with the number of batches added so far and the total number of batches, if known
+Progress = Callable[[int, int | None], None]
+
+# chunks which are produced ahead of their embedding, while the slot of the format family is held
+CHUNK_BUFFER_SIZE = 1000
+# seconds between checks, whether the consumer of the chunks stopped early
+CHUNK_POLL_SECONDS = 0.5
+
+
+def batched(iterable: Iterable[Document], n: int | None) -> Generator[List[Document], None, None]:
+    # `n = None` yields everything in a single batch
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, n)):
+        yield batch
 
 
 def get_vector_store(
     config: Config,
     index_name: str | None,
 ) -> VectorStoreAdapter:
-    embeddings = get_embeddings(config)
-    vector_store = vectorstore_provider.get_vectorstore(config=config, embeddings=embeddings, index_name=index_name)
+    def create_vector_store() -> VectorStoreAdapter:
+        embeddings = get_embeddings(config)
+        return vectorstore_provider.get_vectorstore(config=config, embeddings=embeddings, index_name=index_name)
+
+    vector_store = vectorstore_provider.vectorstore_registry.get(config, index_name, create_vector_store)
 
     if vector_store is None:
         raise RuntimeError("Vector store service has not been configured")
@@ -40,6 +68,11 @@ def get_vector_store(
     return vector_store
 
 
+def check_vector_store(config: Config) -> None:
+    embeddings = get_embeddings(config)
+    vectorstore_provider.check_vectorstore(config=config, embeddings=embeddings)
+
+
 def get_file_store(
     config: Config,
 ) -> FileStoreAdapter | None:
@@ -50,8 +83,8 @@ def get_file_store(
 
 def get_file_name_extensions(config: Config) -> list[str]:
     file_name_extensions: list[str] = []
-    for format_provider in get_format_providers(config):
-        for value in format_provider.file_name_extensions:
+    for spec in get_format_provider_specs(config):
+        for value in spec.file_name_extensions:
             file_name_extensions.append(value)
 
     return file_name_extensions
@@ -69,26 +102,75 @@ def process_file(config: Config, file: SourceFile, chunk_size: int | None = None
     return chunks_with_metadata
 
 
-def process_and_add_file(config: Config, file: SourceFile, bucket: str, index_name: str | None) -> bool:
+def process_and_add_file(
+    config: Config, file: SourceFile, bucket: str, index_name: str | None, progress: Progress | None = None
+) -> bool:
     logger.info(f"Processing and add file: {file.id}")
-    add_file(config, file, bucket, file.id, index_name)
+    add_file(config, file, bucket, file.id, index_name, progress)
     files_processed_counter.inc()
     logger.info(f"Completed file: {file.id}")
     return True
 
 
+def process_pages_in_parallel(
+    pool: ProcessPool,
+    format_: AbstractFormatProvider,
+    file: SourceFile,
+    pages: int,
+    chunk_size: int | None,
+    pages_per_task: int,
+) -> Iterator[Document]:
+    # the ranges of pages are extracted by all workers of the pool at the same time,
+    # but the chunks are yielded in the order of the pages.
+    # At most one range per worker is pending, such that finished ranges do not pile up in memory.
+    ranges = [(first, min(first + pages_per_task, pages)) for first in range(0, pages, pages_per_task)]
+    pending: deque[Future[list[ProcessedPage]]] = deque()
+
+    def collect(future: Future[list[ProcessedPage]]) -> Iterator[Document]:
+        for page in future.result():
+            page_extraction_seconds.labels(format=format_.name, parser=page.parser).observe(page.seconds)
+            yield from page.chunks
+
+    with ThreadPoolExecutor(max_workers=min(pool.size, len(ranges)) or 1) as executor:
+        try:
+            for first, last in ranges:
+                if len(pending) >= pool.size:
+                    yield from collect(pending.popleft())
+                pending.append(executor.submit(pool.run, format_.process_pages, file, first, last, pages, chunk_size))
+            while pending:
+                yield from collect(pending.popleft())
+        finally:
+            # e.g. if a range failed or the consumer stopped early
+            for future in pending:
+                future.cancel()
+
+
 def process_file_synchronously(
-    format_: AbstractFormatProvider, file: SourceFile, chunk_size: int | None, threshold: int = 10**5
+    format_: AbstractFormatProvider,
+    file: SourceFile,
+    chunk_size: int | None,
+    threshold: int = 10**5,
+    pages_per_task: int = 50,
 ) -> List[Document]:
     # this function tries to optimize for performance,
     # since the process step is the single CPU intensive part
     # * small files are processed in the same thread to avoid overhead of starting a new process,
     #   pickling, copying and unpickling the file
-    # * large files will start a new process to avoid the GIL
-    #   this will also lead python to release the RAM used for the processing back to the operating system
+    # * large files will be processed in one of the pre-warmed pool processes to avoid the GIL
+    #   the pool recycles its processes, which releases the RAM used for processing back to the operating system
+    # * large files with pages, which can be processed independently, are split into ranges of pages,
+    #   which are processed by all processes of the pool in parallel
+    # * if the pool is disabled, large files will start a new process
 
     if not format_.multiprocessable or file.size < threshold:
         return format_.process_file(file, chunk_size)
+
+    pool = get_process_pool()
+    if pool is not None:
+        pages = format_.count_pages(file)
+        if pages is not None:
+            return list(process_pages_in_parallel(pool, format_, file, pages, chunk_size, pages_per_task))
+        return pool.run(format_.process_file, file, chunk_size)
     else:
         ctx = mp.get_context("spawn")
         queue = ctx.Queue()
@@ -106,16 +188,47 @@ def process_file_synchronously(
         return chunks
 
 
+def process_file_lazily(
+    format_: AbstractFormatProvider,
+    file: SourceFile,
+    chunk_size: int | None,
+    threshold: int = 10**5,
+    pages_per_task: int = 50,
+) -> Iterator[Document]:
+    # generator version of `process_file_synchronously`, which yields the chunks as soon as they are produced
+    # such that large documents do not need to be held in memory completely
+    if not format_.multiprocessable or file.size < threshold:
+        return format_.iter_chunks(file, chunk_size)
+
+    pool = get_process_pool()
+    if pool is not None:
+        pages = format_.count_pages(file)
+        if pages is not None:
+            return process_pages_in_parallel(pool, format_, file, pages, chunk_size, pages_per_task)
+        return pool.stream(format_.iter_chunks, file, chunk_size)
+    else:
+        return iter(process_file_synchronously(format_, file, chunk_size, threshold, pages_per_task))
+
+
 def convert_file_synchronously(format_: AbstractFormatProvider, file: SourceFile, threshold: int = 10**5) -> SourceFile:
     # this function tries to optimize for performance,
     # since the process step is the single CPU intensive part
     # * small files are processed in the same thread to avoid overhead of starting a new process,
     #   pickling, copying and unpickling the file
-    # * large files will start a new process to avoid the GIL
-    #   this will also lead python to release the RAM used for the processing back to the operating system
+    # * large files will be processed in one of the pre-warmed pool processes to avoid the GIL
+    #   the pool recycles its processes, which releases the RAM used for processing back to the operating system
+    # * if the pool is disabled, large files will start a new process
 
     if not format_.multiprocessable or file.size < threshold:
         return format_.convert_file_to_pdf(file)
+
+    # the pool of LibreOffice instances converts office documents in its own processes
+    if format_.family == "office" and get_office_pool() is not None:
+        return format_.convert_file_to_pdf(file)
+
+    pool = get_process_pool()
+    if pool is not None:
+        return pool.run(format_.convert_file_to_pdf, file)
     else:
         ctx = mp.get_context("spawn")
         queue = ctx.Queue()
@@ -136,40 +249,38 @@ def convert_file_synchronously(format_: AbstractFormatProvider, file: SourceFile
 def generate_batches(
     config: Config,
     file: SourceFile,
-    chunks: list[Document],
+    chunks: Iterable[Document],
     format_: AbstractFormatProvider,
     bucket: str | None = None,
     doc_id: str | None = None,
-) -> Generator[tuple[List[Document], int, int], None, None]:
-    if len(chunks) > 0:
-        batch_size = config.batch_size if config.batch_size else len(chunks)
-        num_batches = ceil(len(chunks) / batch_size)
-        for index, chunk_batch in enumerate(batched(chunks, batch_size)):
-            with_metadata = [
-                Document(
-                    page_content=x.page_content,
-                    metadata={
-                        **x.metadata,
-                        "format": format_.name,
-                        "mime_type": file.mime_type,
-                        "doc_id": doc_id,
-                        "bucket": bucket,
-                        "source": file.file_name,
-                    },
-                )
-                for x in chunk_batch
-            ]
-
-            yield with_metadata, index, num_batches
-
-    return
+) -> Generator[tuple[List[Document], int, int | None], None, None]:
+    # if the chunks are produced lazily, we do not know the number of batches in advance
+    num_batches = None
+    if isinstance(chunks, Sized):
+        num_batches = ceil(len(chunks) / config.batch_size) if config.batch_size else 1
+
+    for index, chunk_batch in enumerate(batched(chunks, config.batch_size)):
+        # the metadata is added in place to avoid copying every chunk
+        for x in chunk_batch:
+            x.metadata.update(
+                {
+                    "format": format_.name,
+                    "mime_type": file.mime_type,
+                    "doc_id": doc_id,
+                    "bucket": bucket,
+                    "source": file.file_name,
+                }
+            )
+
+        yield chunk_batch, index, num_batches
 
 
 def find_format_provider(config: Config, file: SourceFile) -> AbstractFormatProvider:
-    for format_ in get_format_providers(config):
-        if format_.supports(file):
-            return format_
-    raise HTTPException(status_code=415, detail="File format not supported.")
+    spec = find_format_provider_spec(config, file)
+    if spec is None:
+        raise HTTPException(status_code=415, detail="File format not supported.")
+    # only the module of the matching provider is imported
+    return get_format_provider(config, spec.name)
 
 
 def process_file_into_chunks(
@@ -180,7 +291,10 @@ def process_file_into_chunks(
     chunk_size: int | None = None,
 ) -> list[Document]:
     try:
-        chunks = process_file_synchronously(format_, file, chunk_size, config.filesize_threshold)
+        with format_family_slot(config, format_.family):
+            chunks = process_file_synchronously(
+                format_, file, chunk_size, config.filesize_threshold, config.pdf_pages_per_task
+            )
     except ProcessingError as e:
         logger.warning(f"Failed processing file `{doc_id}`: {e.message}")
         raise HTTPException(status_code=e.status, detail=f"Processing failed: {e.message}") from e
@@ -192,6 +306,68 @@ def process_file_into_chunks(
     return chunks
 
 
+def iter_file_chunks(
+    config: Config,
+    file: SourceFile,
+    format_: AbstractFormatProvider,
+    doc_id: str | None = None,
+    chunk_size: int | None = None,
+) -> Generator[Document, None, None]:
+    # generator version of `process_file_into_chunks`.
+    # The file is processed in a thread of its own, which holds the slot of the format family until all chunks
+    # are produced and hands them over through a bounded buffer, such that the embedding and inserting of the chunks
+    # by the consumer is not limited by the slot.
+    buffer: queue.Queue[Document | BaseException | None] = queue.Queue(maxsize=CHUNK_BUFFER_SIZE)
+    stopped = Event()
+
+    def put(item: Document | BaseException | None) -> bool:
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=CHUNK_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            with format_family_slot(config, format_.family):
+                chunks = process_file_lazily(
+                    format_, file, chunk_size, config.filesize_threshold, config.pdf_pages_per_task
+                )
+                try:
+                    for chunk in chunks:
+                        if not put(chunk):
+                            return
+                finally:
+                    # e.g. stops the worker process, if the consumer stopped early
+                    if isinstance(chunks, Generator):
+                        chunks.close()
+            put(None)
+        except BaseException as e:
+            put(e)
+
+    producer = Thread(target=produce, name=f"chunks-{doc_id}", daemon=True)
+    producer.start()
+    try:
+        while (item := buffer.get()) is not None:
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    except ProcessingError as e:
+        logger.warning(f"Failed processing file `{doc_id}`: {e.message}")
+        raise HTTPException(status_code=e.status, detail=f"Processing failed: {e.message}") from e
+    except Exception as e:
+        # catchall, since the format_providers
+        # yield individual errors from special exception classes to ValueError
+        logger.warning(f"Failed processing file `{doc_id}`: {e!r}")
+        raise HTTPException(status_code=400, detail="Processing failed") from e
+    finally:
+        # the file must not be removed while it is still processed
+        stopped.set()
+        producer.join()
+
+
 def convert_file_to_pdf(
     config: Config,
     file: SourceFile,
@@ -199,7 +375,8 @@ def convert_file_to_pdf(
     doc_id: str | None = None,
 ) -> SourceFile:
     try:
-        pdf = convert_file_synchronously(format_, file, config.filesize_threshold)
+        with format_family_slot(config, format_.family):
+            pdf = convert_file_synchronously(format_, file, config.filesize_threshold)
     except ProcessingError as e:
         logger.warning(f"Failed converting file `{doc_id}`: {e.message}")
         raise HTTPException(status_code=e.status, detail=f"Conversion failed: {e.message}") from e
@@ -211,34 +388,110 @@ def convert_file_to_pdf(
     return pdf
 
 
-def add_file(config: Config, file: SourceFile, bucket: str, doc_id: str, index_name: str | None = None) -> None:
-    file_store = get_file_store(config=config)
-
+def add_file(
+    config: Config,
+    file: SourceFile,
+    bucket: str,
+    doc_id: str,
+    index_name: str | None = None,
+    progress: Progress | None = None,
+) -> None:
     format_ = find_format_provider(config, file)
     logger.info(f"start adding doc_id {doc_id} with format {format_.name}")
 
+    vector_store = get_vector_store(config=config, index_name=index_name)
+
     file_store = get_file_store(config=config)
     if file_store:
         pdf = convert_file_to_pdf(config, file, format_, doc_id)
         try:
             logger.info(f"converted doc_id {doc_id} to pdf")
-            chunks = process_file_into_chunks(config, pdf, PdfProvider(), doc_id)
-            logger.info(f"chunked pdf version of doc_id {doc_id} into {len(chunks)} chunks")
+            # the pdf is saved first, such that no searchable chunks reference a missing pdf
             file_store.add_document(pdf)
             logger.info(f"saved pdf for doc_id {doc_id}")
-        except Exception as e:
-            raise e
+            # the chunks are produced from the file itself, the same way as without a file store
+            if format_.chunks_from_pdf:
+                chunks = iter_file_chunks(config, pdf, get_format_provider(config, "pdf"), doc_id)
+            else:
+                chunks = iter_file_chunks(config, file, format_, doc_id)
+            try:
+                # closing the chunks stops their processing on every exit path
+                with closing(chunks):
+                    add_chunks(config, vector_store, file, chunks, format_, bucket, doc_id, progress)
+            except Exception:
+                try:
+                    file_store.delete(doc_id)
+                except Exception as e:
+                    logger.error(f"Failed removing pdf of doc_id {doc_id}: {e!r}")
+                raise
+            logger.info(f"added chunks of doc_id {doc_id}")
         finally:
             pdf.delete()
     else:
-        chunks = process_file_into_chunks(config, file, format_, doc_id)
-        logger.info(f"chunked doc_id {doc_id} into {len(chunks)} chunks")
+        with closing(iter_file_chunks(config, file, format_, doc_id)) as chunks:
+            add_chunks(config, vector_store, file, chunks, format_, bucket, doc_id, progress)
+        logger.info(f"added chunks of doc_id {doc_id}")
 
-    vector_store = get_vector_store(config=config, index_name=index_name)
-    for batch, index, num_batches in generate_batches(config, file, chunks, format_, bucket, doc_id):
-        logger.info(f"add {len(batch)} chunks for doc_id {doc_id}: ({index + 1}/{num_batches})")
-        vector_store.add_documents(batch)
-        logger.info(f"ready with {len(batch)} chunks for doc_id {doc_id}: ({index + 1}/{num_batches})")
+
+def add_chunks(
+    config: Config,
+    vector_store: VectorStoreAdapter,
+    file: SourceFile,
+    chunks: Iterable[Document],
+    format_: AbstractFormatProvider,
+    bucket: str,
+    doc_id: str,
+    progress: Progress | None = None,
+) -> None:
+    # the chunks are consumed lazily batch by batch, so processing, embedding and inserting overlap
+    batches = generate_batches(config, file, chunks, format_, bucket, doc_id)
+    try:
+        add_batches(vector_store, batches, doc_id, config.embeddings_concurrency, progress)
+    except Exception:
+        # since we add batches while the file is still processed, a failure can leave a partial document behind
+        logger.warning(f"Failed adding doc_id {doc_id}, removing already added chunks")
+        try:
+            vector_store.delete(doc_id)
+        except Exception as e:
+            logger.error(f"Failed removing chunks of doc_id {doc_id}: {e!r}")
+        raise
+
+
+def add_batches(
+    vector_store: VectorStoreAdapter,
+    batches: Iterable[tuple[List[Document], int, int | None]],
+    doc_id: str,
+    concurrency: int,
+    progress: Progress | None = None,
+) -> None:
+    # Embedding and inserting are pipelined: while batch n is written to the vector store,
+    # the next `concurrency` batches are embedded in the background.
+    # The number of batches ahead is bounded, such that we do not keep all embeddings in memory.
+    pending: deque[tuple[Future[list[list[float]]], List[Document], int, int | None]] = deque()
+
+    def insert_oldest() -> None:
+        future, batch, index, num_batches = pending.popleft()
+        embeddings = future.result()
+        progress_message = f"{index + 1}/{num_batches if num_batches is not None else '?'}"
+        logger.info(f"add {len(batch)} chunks for doc_id {doc_id}: ({progress_message})")
+        vector_store.add_documents(batch, embeddings)
+        logger.info(f"ready with {len(batch)} chunks for doc_id {doc_id}: ({progress_message})")
+        if progress is not None:
+            progress(index + 1, num_batches)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        try:
+            for batch, index, num_batches in batches:
+                pending.append((executor.submit(vector_store.embed_documents, batch), batch, index, num_batches))
+                if len(pending) > concurrency:
+                    insert_oldest()
+
+            while pending:
+                insert_oldest()
+        except BaseException:
+            for future, *_ in pending:
+                future.cancel()
+            raise
 
 
 def search(
@@ -256,14 +509,41 @@ def search(
 
     docs = vector_store.similarity_search(query, take, store_filter)
 
+    return clean_up_results(config, docs)
+
+
+async def asearch(
+    config: Config,
+    query: str,
+    bucket: str | None,
+    take: int,
+    doc_ids: List[str] | None = None,
+    index_name: str | None = None,
+) -> List[Document]:
+    """Like `search`, but embeds the query and queries the vector store without blocking the event loop."""
+    vector_store = vectorstore_provider.vectorstore_registry.peek(config, index_name)
+    if vector_store is None:
+        # creating the adapter may set up indexes or collections, which is not worth an async implementation
+        vector_store = await run_in_threadpool(get_vector_store, config, index_name)
+    store_filter = VectorStoreFilter(bucket=bucket, doc_ids=doc_ids)
+
+    logger.info("start similarity search")
+
+    docs = await vector_store.asimilarity_search(query, take, store_filter)
+
+    return clean_up_results(config, docs)
+
+
+def clean_up_results(config: Config, docs: List[Document]) -> List[Document]:
     # remove bucket before passing it back
     # also call possibly existing cleanup methods for the format
     result: List[Document] = []
     for doc in docs:
-        provider = get_format_provider_mappings(config).get(doc.metadata["format"])
-
-        if provider is not None:
-            cleaned = provider.clean_up(doc)
+        cleaned = doc
+        # providers are only imported if they actually clean up, such that searching stays lightweight
+        spec = get_format_provider_spec(config, doc.metadata["format"])
+        if spec is not None and spec.cleans_up:
+            cleaned = get_format_provider(config, spec.name).clean_up(doc)
         try:
             del cleaned.metadata["bucket"]
         except KeyError:
@@ -353,7 +633,7 @@ def get_file_sources(config: Config, results: List[Document]) -> List[SourceDto]
     file_store = get_file_store(config=config)
     if file_store:
         doc_ids = {doc.metadata["doc_id"] for doc in results if "doc_id" in doc.metadata}
-        exists = {doc_id: file_store.exists(doc_id) for doc_id in doc_ids}
+        exists = file_store.exists_many(doc_ids)
     else:
         exists = {}
 
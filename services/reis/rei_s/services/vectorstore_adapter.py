@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
 from typing import List
 
+from fastapi.concurrency import run_in_threadpool
 from langchain_core.documents import Document
 from pydantic import BaseModel
 
@@ -12,7 +13,12 @@ class VectorStoreFilter(BaseModel):
 
 class VectorStoreAdapter(ABC):
     @abstractmethod
-    def add_documents(self, documents: list[Document]) -> None:
+    def embed_documents(self, documents: list[Document]) -> list[list[float]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_documents(self, documents: list[Document], embeddings: list[list[float]] | None = None) -> None:
+        """Adds the documents to the store, if no `embeddings` are given, they are calculated on the fly"""
         raise NotImplementedError
 
     @abstractmethod
@@ -25,6 +31,12 @@ class VectorStoreAdapter(ABC):
     ) -> List[Document]:
         raise NotImplementedError
 
+    async def asimilarity_search(
+        self, query: str, k: int = 4, search_filter: VectorStoreFilter | None = None
+    ) -> List[Document]:
+        """Searches without blocking the event loop, stores without native async support use a thread"""
+        return await run_in_threadpool(self.similarity_search, query, k, search_filter)
+
     @abstractmethod
     def get_documents(self, ids: List[str]) -> List[Document]:
         raise NotImplementedError
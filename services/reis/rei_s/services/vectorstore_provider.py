@@ -1,5 +1,11 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable
+
 from langchain_core.embeddings.embeddings import Embeddings
 
+from rei_s import logger
+
 from rei_s.config import Config
 from rei_s.services.vectorstore_adapter import VectorStoreAdapter
 from rei_s.services.vectorstores.azure_ai_search import AzureAISearchStoreAdapter
@@ -20,3 +26,59 @@ def get_vectorstore(
         return DevNullVectorStoreAdapter.create(config=config, embeddings=embeddings, index_name=index_name)
     else:
         raise ValueError(f"Store type {config.store_type} not supported")
+
+
+def check_vectorstore(config: Config, embeddings: Embeddings) -> None:
+    # checks which are too expensive to do on every request
+    if config.store_type == "azure-ai-search":
+        AzureAISearchStoreAdapter.check(config=config, embeddings=embeddings)
+
+
+class VectorStoreRegistry:
+    """Keeps the most recently used vector store adapters per config and index, such that the setup cost of the
+    adapters (clients, connection pools, creation of collections and indexes) is only paid once."""
+
+    def __init__(self) -> None:
+        self.adapters: OrderedDict[tuple[Config, str | None], VectorStoreAdapter] = OrderedDict()
+        self.lock = Lock()
+
+    def get(
+        self, config: Config, index_name: str | None, factory: Callable[[], VectorStoreAdapter]
+    ) -> VectorStoreAdapter:
+        if config.store_adapter_cache_size == 0:
+            return factory()
+
+        key = (config, index_name)
+        with self.lock:
+            adapter = self.adapters.get(key)
+            if adapter is not None:
+                self.adapters.move_to_end(key)
+                return adapter
+
+        # the lock is not held during the creation, which may take a while.
+        # If two threads create the same adapter concurrently, the first one wins.
+        adapter = factory()
+
+        with self.lock:
+            adapter = self.adapters.setdefault(key, adapter)
+            self.adapters.move_to_end(key)
+            while len(self.adapters) > config.store_adapter_cache_size:
+                (_, evicted_index), _ = self.adapters.popitem(last=False)
+                logger.info(f"Evicted vector store adapter for index {evicted_index}")
+
+        return adapter
+
+    def peek(self, config: Config, index_name: str | None) -> VectorStoreAdapter | None:
+        """Returns the adapter if it is cached, without creating it."""
+        with self.lock:
+            adapter = self.adapters.get((config, index_name))
+            if adapter is not None:
+                self.adapters.move_to_end((config, index_name))
+            return adapter
+
+    def clear(self) -> None:
+        with self.lock:
+            self.adapters.clear()
+
+
+vectorstore_registry = VectorStoreRegistry()
@@ -4,6 +4,9 @@ from typing import Awaitable, List
 from langchain_core.documents import Document
 from langchain_core.embeddings.embeddings import Embeddings
 from langchain_community.vectorstores.azuresearch import AzureSearch
+from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import ResourceNotFoundError
+from azure.search.documents.indexes import SearchIndexClient
 from azure.search.documents.indexes.models import (
     SearchableField,
     SearchField,
@@ -11,7 +14,9 @@ from azure.search.documents.indexes.models import (
     SimpleField,
 )
 
+from rei_s import logger
 from rei_s.config import Config
+from rei_s.services.embeddings_provider import get_embeddings_dimensions
 from rei_s.services.vectorstore_adapter import VectorStoreAdapter, VectorStoreFilter
 
 
@@ -20,6 +25,7 @@ lock = Lock()
 
 class AzureAISearchStoreAdapter(VectorStoreAdapter):
     vector_store: AzureSearch
+    embeddings: Embeddings
 
     @classmethod
     def create(cls, config: Config, embeddings: Embeddings, index_name: str | None) -> "AzureAISearchStoreAdapter":
@@ -53,7 +59,7 @@ class AzureAISearchStoreAdapter(VectorStoreAdapter):
                 name="content_vector",
                 type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
                 searchable=True,
-                vector_search_dimensions=len(embeddings.embed_query("Text")),
+                vector_search_dimensions=get_embeddings_dimensions(config, embeddings),
                 vector_search_profile_name="myHnswProfile",
             ),
             SearchableField(
@@ -91,16 +97,60 @@ class AzureAISearchStoreAdapter(VectorStoreAdapter):
         instance = cls()
 
         instance.vector_store = azure_vector_store
+        instance.embeddings = embeddings
 
         return instance
 
-    def add_documents(self, documents: list[Document]) -> None:
+    @classmethod
+    def check(cls, config: Config, embeddings: Embeddings) -> None:
+        """Checks that the existing index matches the size of the embedding vectors of the configured model."""
+        if config.store_azure_ai_search_service_endpoint is None:
+            raise ValueError("The env variable `STORE_AZURE_AI_SEARCH_SERVICE_ENDPOINT` is missing.")
+        if config.store_azure_ai_search_service_api_key is None:
+            raise ValueError("The env variable `STORE_AZURE_AI_SEARCH_SERVICE_API_KEY` is missing.")
+
+        dimensions = get_embeddings_dimensions(config, embeddings)
+        index_name = config.store_azure_ai_search_service_index_name
+
+        client = SearchIndexClient(
+            endpoint=config.store_azure_ai_search_service_endpoint,
+            credential=AzureKeyCredential(config.store_azure_ai_search_service_api_key.get_secret_value()),
+        )
+        try:
+            index = client.get_index(index_name)
+        except ResourceNotFoundError:
+            # the index will be created with the correct size on first use
+            return
+        finally:
+            client.close()
+
+        for field in index.fields:
+            if field.name == "content_vector" and field.vector_search_dimensions != dimensions:
+                raise ValueError(
+                    f"The index {index_name} expects embeddings of size {field.vector_search_dimensions}, "
+                    f"but the configured embedding model produces embeddings of size {dimensions}."
+                )
+        logger.info(f"Index {index_name} matches the embedding dimensions {dimensions}")
+
+    def embed_documents(self, documents: list[Document]) -> list[list[float]]:
+        return self.embeddings.embed_documents([doc.page_content for doc in documents])
+
+    def add_documents(self, documents: list[Document], embeddings: list[list[float]] | None = None) -> None:
         # langchain's abstraction of Azure AI seems to forget the ids and replaces them with the kwarg "key"
         # and langchains interface needs us to provide either no keys or keys for every document
         keys = [doc.id for doc in documents if doc.id is not None]
         if len(keys) > 0 and len(keys) != len(documents):
             raise ValueError("If you give an `id` for any document, you need to give an id for every document")
-        self.vector_store.add_documents(documents, keys=keys)
+
+        if embeddings is None:
+            self.vector_store.add_documents(documents, keys=keys)
+            return
+
+        self.vector_store.add_embeddings(
+            zip([doc.page_content for doc in documents], embeddings, strict=True),
+            [doc.metadata for doc in documents],
+            keys=keys or None,
+        )
 
     def delete(self, doc_id: str) -> None:
         # The `delete` method can only delete by the "key", which is unique, i.e., the chunk id.
@@ -142,6 +192,17 @@ class AzureAISearchStoreAdapter(VectorStoreAdapter):
 
         return self.vector_store.similarity_search(query, k, filters=filter_expression)
 
+    async def asimilarity_search(
+        self, query: str, k: int = 4, search_filter: VectorStoreFilter | None = None
+    ) -> List[Document]:
+        if search_filter is not None and search_filter.doc_ids is not None and len(search_filter.doc_ids) == 0:
+            return []
+
+        filter_expression = self.convert_filter(search_filter)
+
+        # uses the async search client of the vector store
+        return await self.vector_store.asimilarity_search(query, k, filters=filter_expression)
+
     def get_documents(self, ids: List[str]) -> List[Document]:
         filter_query = f"search.in(id, '{', '.join(ids)}')"
         docs = self.vector_store.similarity_search("", len(ids), filters=filter_query)
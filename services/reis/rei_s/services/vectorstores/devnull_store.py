@@ -15,7 +15,10 @@ class DevNullVectorStoreAdapter(VectorStoreAdapter):
     ) -> "DevNullVectorStoreAdapter":
         return cls()
 
-    def add_documents(self, documents: list[Document]) -> None:
+    def embed_documents(self, documents: list[Document]) -> list[list[float]]:
+        return [[] for _ in documents]
+
+    def add_documents(self, documents: list[Document], embeddings: list[list[float]] | None = None) -> None:
         pass
 
     def delete(self, doc_id: str) -> None:
@@ -1,9 +1,13 @@
+from dataclasses import dataclass
 from threading import Lock
 from typing import Any, Dict, List
 
 from langchain_core.documents import Document
 from langchain_postgres import PGVector
 from langchain_core.embeddings.embeddings import Embeddings
+from sqlalchemy import Engine, create_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.orm import Session
 
 from rei_s import logger
 from rei_s.config import Config
@@ -12,9 +16,86 @@ from rei_s.services.vectorstore_adapter import VectorStoreAdapter, VectorStoreFi
 
 lock = Lock()
 
+# one connection pool per database, shared by all collections
+engines: dict[str, Engine] = {}
+
+
+def get_engine(config: Config, url: str) -> tuple[Engine, bool]:
+    """Returns the shared engine for the url and whether it was newly created."""
+    engine = engines.get(url)
+    if engine is not None:
+        return engine, False
+
+    engine = create_engine(url, pool_size=config.store_pgvector_pool_size, pool_pre_ping=True)
+    engines[url] = engine
+    return engine, True
+
+
+def dispose_engines() -> None:
+    with lock:
+        for engine in engines.values():
+            engine.dispose()
+        engines.clear()
+
+
+# the async connection pools for the search path, created on first use
+async_engines: dict[str, AsyncEngine] = {}
+
+
+def get_async_engine(config: Config, url: str) -> AsyncEngine:
+    engine = async_engines.get(url)
+    if engine is None:
+        # psycopg 3 supports async connections with the same url
+        engine = create_async_engine(url, pool_size=config.store_pgvector_pool_size, pool_pre_ping=True)
+        async_engines[url] = engine
+    return engine
+
+
+async def dispose_async_engines() -> None:
+    with lock:
+        engines_to_dispose = list(async_engines.values())
+        async_engines.clear()
+    for engine in engines_to_dispose:
+        await engine.dispose()
+
+
+@dataclass(frozen=True)
+class CollectionRef:
+    uuid: Any
+
+
+class CachedCollectionPGVector(PGVector):
+    """PGVector, which looks up the uuid of its collection only once instead of in every query.
+
+    Note that the returned collection is a plain reference, not a database object,
+    so `delete_collection` can not be used with this class.
+    """
+
+    collection_ref: CollectionRef | None = None
+
+    def get_collection(self, session: Session) -> Any:
+        if self.collection_ref is None:
+            collection = super().get_collection(session)
+            if collection is None:
+                return None
+            self.collection_ref = CollectionRef(uuid=collection.uuid)
+        return self.collection_ref
+
+    async def aget_collection(self, session: AsyncSession) -> Any:
+        if self.collection_ref is None:
+            collection = await super().aget_collection(session)
+            if collection is None:
+                return None
+            self.collection_ref = CollectionRef(uuid=collection.uuid)
+        return self.collection_ref
+
 
 class PGVectorStoreAdapter(VectorStoreAdapter):
     vector_store: PGVector
+    # the async store is only created when it is needed, e.g., not in worker processes
+    async_vector_store: PGVector | None = None
+    config: Config
+    collection_name: str
 
     @classmethod
     def create(cls, config: Config, embeddings: Embeddings, index_name: str | None = None) -> "PGVectorStoreAdapter":
@@ -33,21 +114,55 @@ class PGVectorStoreAdapter(VectorStoreAdapter):
         # This means, that we can not switch between the js-Rag-server and the py-rei-server
         # We need to lock this, otherwise it two processes might race to create the same collection
         with lock:
-            pg_vector_store = PGVector(
+            engine, is_new = get_engine(config, config.store_pgvector_url)
+            pg_vector_store = CachedCollectionPGVector(
                 embeddings,
-                connection=config.store_pgvector_url,
+                connection=engine,
                 collection_name=collection_name,
                 use_jsonb=True,
+                # the extension only needs to be ensured once per database
+                create_extension=is_new,
             )
 
         instance = cls()
 
         instance.vector_store = pg_vector_store
+        instance.config = config
+        instance.collection_name = collection_name
 
         return instance
 
-    def add_documents(self, documents: list[Document]) -> None:
-        self.vector_store.add_documents(documents)
+    def get_async_vector_store(self) -> PGVector:
+        # this is ensured by the creation of the sync store
+        if self.config.store_pgvector_url is None:
+            raise ValueError("The env variable `STORE_PGVECTOR_URL` is missing.")
+        with lock:
+            if self.async_vector_store is None:
+                self.async_vector_store = CachedCollectionPGVector(
+                    self.vector_store.embeddings,
+                    connection=get_async_engine(self.config, self.config.store_pgvector_url),
+                    collection_name=self.collection_name,
+                    use_jsonb=True,
+                    # the sync store already ensured the extension
+                    create_extension=False,
+                )
+            return self.async_vector_store
+
+    def embed_documents(self, documents: list[Document]) -> list[list[float]]:
+        return self.vector_store.embeddings.embed_documents([doc.page_content for doc in documents])
+
+    def add_documents(self, documents: list[Document], embeddings: list[list[float]] | None = None) -> None:
+        if embeddings is None:
+            self.vector_store.add_documents(documents)
+            return
+
+        ids = [doc.id for doc in documents if doc.id is not None]
+        self.vector_store.add_embeddings(
+            texts=[doc.page_content for doc in documents],
+            embeddings=embeddings,
+            metadatas=[doc.metadata for doc in documents],
+            ids=ids if len(ids) == len(documents) else None,
+        )
 
     def delete(self, doc_id: str) -> None:
         # The vector store does not offer a method to delete chunks by metadata (only chunk id), thus
@@ -89,5 +204,12 @@ class PGVectorStoreAdapter(VectorStoreAdapter):
 
         return self.vector_store.similarity_search(query, k, filter_dict)
 
+    async def asimilarity_search(
+        self, query: str, k: int = 4, search_filter: VectorStoreFilter | None = None
+    ) -> List[Document]:
+        filter_dict = self.convert_filter(search_filter)
+
+        return await self.get_async_vector_store().asimilarity_search(query, k, filter_dict)
+
     def get_documents(self, ids: List[str]) -> List[Document]:
         return self.vector_store.get_by_ids(ids)
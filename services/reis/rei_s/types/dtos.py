@@ -1,3 +1,4 @@
+from enum import Enum
 from typing import Any, List, Optional, Dict, Tuple
 from pydantic import BaseModel, Field, ConfigDict
 from pydantic.alias_generators import to_camel
@@ -66,3 +67,26 @@ class UploadRequest(BaseModel):
 
 class DocumentResponse(BaseModel):
     documents: List[str]
+
+
+class JobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    succeeded = "succeeded"
+    failed = "failed"
+
+
+class JobResult(BaseModel):
+    id: str = Field(description="The ID of the job")
+    file_id: str = Field(description="The ID of the file which is processed")
+    status: JobStatus = Field(description="The status of the job")
+    batches_done: int = Field(description="The number of batches of chunks which were added to the vector store")
+    batches_total: int | None = Field(
+        description="The total number of batches. The chunks are added while the file is still processed, "
+        "so the total is only known once the job succeeded, before that only `batches_done` shows the progress"
+    )
+    error: str | None = Field(description="The reason of the failure, if the job failed")
+    status_code: int | None = Field(description="The status code the synchronous upload would have responded with")
+    attempts: int = Field(description="The number of times the job was started")
+    created_at: float = Field(description="The unix timestamp of the creation of the job")
+    updated_at: float = Field(description="The unix timestamp of the last update of the job")
@@ -1,8 +1,9 @@
 from contextlib import contextmanager
+import mmap
 import os
 from pathlib import Path
 from tempfile import NamedTemporaryFile
-from typing import Generator
+from typing import BinaryIO, Generator
 import uuid
 
 from pydantic import BaseModel, Field
@@ -24,9 +25,34 @@ class SourceFile(BaseModel):
 
     @property
     def buffer(self) -> bytes:
+        """Reads the whole file into memory on every access, prefer `open_stream`, `mapped` or `path`."""
         with open(self.path, "rb") as f:
             return f.read()
 
+    def open_stream(self) -> BinaryIO:
+        """Opens the file for reading, the caller has to close it."""
+        return open(self.path, "rb")
+
+    @contextmanager
+    def mapped(self) -> Generator[mmap.mmap | bytes, None, None]:
+        """Maps the file read-only into memory.
+
+        The content is paged in by the operating system on access and shared with the page cache,
+        instead of being copied into the memory of the process.
+        """
+        with open(self.path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # empty files can not be mapped
+                yield b""
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                yield view
+
+    def read_text(self, encoding: str = "utf-8") -> str:
+        # decoding the mapped file directly saves an intermediate copy of the file as bytes
+        with self.mapped() as view:
+            return str(view, encoding)
+
     @staticmethod
     def new_temporary_file(buffer: bytes | None = None, extension: str | None = None) -> "SourceFile":
         id_ = str(uuid.uuid4())
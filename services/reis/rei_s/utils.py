@@ -1,4 +1,3 @@
-from concurrent.futures import ThreadPoolExecutor
 import os
 import tempfile
 from typing import Any
@@ -8,7 +7,7 @@ from fastapi import FastAPI
 from fastapi.concurrency import asynccontextmanager
 
 from rei_s.logger import logger
-from rei_s.config import get_config
+from rei_s.config import Config, get_config
 from rei_s.prometheus_server import PrometheusHttpServer
 
 
@@ -26,14 +25,68 @@ def get_new_file_path(base_name: str | None = None, extension: str | None = None
     return normalized_path
 
 
-async def startup_workers(app: FastAPI, workers: int) -> None:
-    app.state.executor = ThreadPoolExecutor(max_workers=workers)
-    logger.info(f"Started {workers} workers")
+async def startup_workers(app: FastAPI, config: Config) -> None:
+    # imported here to avoid a circular import, since the services depend on the utils
+    from rei_s.services.admission import BoundedExecutor
+    from rei_s.services.http_client import start_http_clients
+    from rei_s.services.job_queue import start_job_queue
+    from rei_s.services.office_pool import start_office_pool
+    from rei_s.services.process_pool import start_process_pool
+
+    app.state.executor = BoundedExecutor(
+        max_workers=config.workers, max_queue_size=config.workers_queue_size, retry_after=config.workers_retry_after
+    )
+    logger.info(f"Started {config.workers} workers")
+    start_http_clients(config)
+    start_process_pool(config)
+    start_office_pool(config)
+    start_job_queue(config)
 
 
 async def shutdown_workers(app: FastAPI) -> None:
-    logger.info("Stopped all workers")
+    from rei_s.services.embeddings_batcher import stop_batchers
+    from rei_s.services.embeddings_pool import stop_pools
+    from rei_s.services.filestore_provider import clear_filestores
+    from rei_s.services.http_client import stop_http_clients
+    from rei_s.services.job_queue import stop_job_queue
+    from rei_s.services.office_pool import stop_office_pool
+    from rei_s.services.process_pool import stop_process_pool
+    from rei_s.services.vectorstore_provider import vectorstore_registry
+    from rei_s.services.vectorstores.pgvector import dispose_async_engines, dispose_engines
+
+    jobs_stopped = stop_job_queue()
     app.state.executor.shutdown()
+    logger.info("Stopped all workers")
+    if not jobs_stopped:
+        # the jobs which are still running use the pools, engines and clients, so they are left to the exit
+        # of the process. Jobs which are not finished until then are picked up again after a restart.
+        logger.warning("Jobs are still running, the pools and clients are not stopped")
+        return
+
+    stop_process_pool()
+    stop_office_pool()
+
+    vectorstore_registry.clear()
+    dispose_engines()
+    await dispose_async_engines()
+    clear_filestores()
+    # the batchers and pools hold embeddings using the HTTP clients, so they are stopped first
+    stop_batchers()
+    stop_pools()
+    await stop_http_clients()
+
+
+async def startup_checks(config: Config) -> None:
+    from rei_s.services.store_service import check_vector_store
+
+    try:
+        check_vector_store(config)
+    except ValueError:
+        # the configuration does not match the existing data, so we can not work correctly
+        raise
+    except Exception as e:
+        # e.g. the vector store or the embedding model are temporarily unreachable
+        logger.warning(f"Could not check the vector store: {e!r}")
 
 
 @asynccontextmanager
@@ -45,7 +98,8 @@ async def lifespan(app: FastAPI) -> Any:
         logger.info(f"Starting Prometheus server on port {config.metrics_port}")
         metrics_server.start()
 
-    await startup_workers(app, config.workers)
+    await startup_workers(app, config)
+    await startup_checks(config)
 
     yield
 
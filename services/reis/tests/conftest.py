@@ -5,6 +5,8 @@ from concurrent.futures import ThreadPoolExecutor
 
 from rei_s import app_factory
 from rei_s.config import Config, get_config
+from rei_s.services.filestore_provider import clear_filestores
+from rei_s.services.vectorstore_provider import vectorstore_registry
 
 
 def get_test_config(settings: dict[str, Any] | None = None) -> Config:
@@ -41,6 +43,14 @@ def app() -> Generator[FastAPI, None, None]:
     yield app
 
 
+# the vector store and file store adapters are cached process-wide, but tests mock their dependencies individually
+@pytest.fixture(autouse=True)
+def clear_vectorstore_registry() -> Generator[None, None, None]:
+    yield
+    vectorstore_registry.clear()
+    clear_filestores()
+
+
 def pytest_addoption(parser: Any) -> None:
     parser.addoption("--stress", action="store_true", default=False, help="run stress tests")
 
@@ -0,0 +1,58 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+
+# modules, which are only needed for processing files, but not for searching
+HEAVY_MODULES = ["weasyprint", "pdfminer", "pypdf", "ffmpeg", "oxmsg"]
+
+STARTUP_SCRIPT = """
+import json
+import resource
+import sys
+import time
+
+started = time.perf_counter()
+from rei_s import app_factory
+
+app_factory.create()
+{extra}
+print(json.dumps({{
+    "seconds": time.perf_counter() - started,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "modules": sorted(sys.modules),
+}}))
+"""
+
+
+EAGER = "from rei_s.services.formats import import_format_providers; import_format_providers()"
+
+
+def start_app(extra: str = "") -> tuple[float, float, list[str]]:
+    """Returns the seconds and the peak RSS in MB needed to create the app, and the imported modules."""
+    # a fresh interpreter, such that nothing is imported yet
+    output = subprocess.run(
+        [sys.executable, "-c", STARTUP_SCRIPT.format(extra=extra)], check=True, capture_output=True, text=True
+    ).stdout
+    result = json.loads(output.splitlines()[-1])
+    return result["seconds"], result["rss_mb"], result["modules"]
+
+
+def test_startup_does_not_import_format_providers() -> None:
+    _, _, modules = start_app()
+    assert not [module for module in modules if module.split(".")[0] in HEAVY_MODULES]
+
+
+@pytest.mark.stress
+def test_startup_benchmark() -> None:
+    lazy = [start_app() for _ in range(3)]
+    eager = [start_app(EAGER) for _ in range(3)]
+
+    lazy_seconds, lazy_rss = min(r[0] for r in lazy), min(r[1] for r in lazy)
+    eager_seconds, eager_rss = min(r[0] for r in eager), min(r[1] for r in eager)
+    print(f"cold start: {lazy_seconds:.2f}s, idle rss: {lazy_rss:.0f} MB")
+    print(f"with all format providers: {eager_seconds:.2f}s, rss: {eager_rss:.0f} MB")
+    # the difference depends on the installed libraries, e.g., weasyprint loads its native libraries on import
+    assert lazy_rss <= eager_rss
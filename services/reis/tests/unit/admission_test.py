@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
+import time
+
+import pytest
+
+from rei_s.services import admission
+from rei_s.services.admission import BoundedExecutor, ExecutorFullError, format_family_slot
+from tests.conftest import get_test_config
+
+
+def test_executor_rejects_when_full() -> None:
+    release = Event()
+    executor = BoundedExecutor(max_workers=1, max_queue_size=1, retry_after=7)
+    try:
+        running = executor.submit(release.wait, 5)
+        waiting = executor.submit(lambda: 42)
+
+        with pytest.raises(ExecutorFullError) as e:
+            executor.submit(lambda: 0)
+        assert e.value.retry_after == 7
+
+        release.set()
+        assert running.result() is True
+        assert waiting.result() == 42
+
+        # the slots are free again
+        assert executor.submit(lambda: 1).result() == 1
+    finally:
+        release.set()
+        executor.shutdown()
+
+
+def test_format_family_is_limited() -> None:
+    config = get_test_config({"format_concurrency_transcription": 2})
+    lock = Lock()
+    active = 0
+    max_active = 0
+
+    def work() -> None:
+        nonlocal active, max_active
+        with format_family_slot(config, "transcription"):
+            with lock:
+                active += 1
+                max_active = max(max_active, active)
+            time.sleep(0.05)
+            with lock:
+                active -= 1
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        for future in [executor.submit(work) for _ in range(5)]:
+            future.result()
+
+    assert max_active == 2
+
+
+def test_format_family_limit_follows_the_config() -> None:
+    try:
+        for limit in [1, 2]:
+            with format_family_slot(get_test_config({"format_concurrency_office": limit}), "office"):
+                pass
+        # a config with another limit does not reuse the semaphore of the first one
+        assert {("office", 1), ("office", 2)} <= set(admission.family_semaphores)
+    finally:
+        admission.family_semaphores.pop(("office", 1), None)
+        admission.family_semaphores.pop(("office", 2), None)
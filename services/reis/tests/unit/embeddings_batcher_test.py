@@ -0,0 +1,51 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_community.embeddings import DeterministicFakeEmbedding
+import pytest
+
+from rei_s.services.embeddings_batcher import EmbeddingsBatcher
+
+
+class RecordingEmbeddings(DeterministicFakeEmbedding):
+    requests: list[list[str]] = []
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.requests.append(texts)
+        if "bad" in texts:
+            raise ValueError("bad text")
+        return super().embed_documents(texts)
+
+
+def test_concurrent_callers_are_merged() -> None:
+    inner = RecordingEmbeddings(size=4, requests=[])
+    batcher = EmbeddingsBatcher(inner, max_batch_size=100, max_delay=0.2, concurrency=1)
+
+    texts = [[f"{i}-{j}" for j in range(3)] for i in range(5)]
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        results = list(executor.map(batcher.embed_documents, texts))
+
+    assert len(inner.requests) < 5
+    for request_texts, vectors in zip(texts, results, strict=True):
+        assert vectors == DeterministicFakeEmbedding(size=4).embed_documents(request_texts)
+
+
+def test_requests_are_split_at_the_batch_size() -> None:
+    inner = RecordingEmbeddings(size=4, requests=[])
+    batcher = EmbeddingsBatcher(inner, max_batch_size=2, max_delay=0, concurrency=1)
+
+    texts = ["a", "b", "c", "d", "e"]
+    assert batcher.embed_documents(texts) == DeterministicFakeEmbedding(size=4).embed_documents(texts)
+    assert all(len(request) <= 2 for request in inner.requests)
+
+
+def test_errors_only_affect_the_offending_caller() -> None:
+    inner = RecordingEmbeddings(size=4, requests=[])
+    batcher = EmbeddingsBatcher(inner, max_batch_size=100, max_delay=0.2, concurrency=1)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        good = executor.submit(batcher.embed_documents, ["good"])
+        bad = executor.submit(batcher.embed_documents, ["bad"])
+
+        assert good.result() == DeterministicFakeEmbedding(size=4).embed_documents(["good"])
+        with pytest.raises(ValueError, match="bad text"):
+            bad.result()
@@ -0,0 +1,132 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Event
+import time
+
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+from rei_s.services.embeddings_cache import (
+    CachedEmbeddings,
+    CachedQueryEmbeddings,
+    EmbeddingsCacheStore,
+    QueryEmbeddingsCache,
+)
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    embedded: int = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.embedded += len(texts)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        self.embedded += 1
+        return super().embed_query(text)
+
+
+def test_only_misses_are_embedded(tmp_path: Path) -> None:
+    inner = CountingEmbeddings(size=8)
+    store = EmbeddingsCacheStore(str(tmp_path / "cache.sqlite"), max_size=1024**2)
+    embeddings = CachedEmbeddings(inner, store, "model")
+
+    first = embeddings.embed_documents(["a", "b"])
+    second = embeddings.embed_documents(["b", "c", "a"])
+
+    assert inner.embedded == 3
+    assert second == [first[1], DeterministicFakeEmbedding(size=8).embed_query("c"), first[0]]
+
+
+def test_cache_is_per_model(tmp_path: Path) -> None:
+    inner = CountingEmbeddings(size=8)
+    store = EmbeddingsCacheStore(str(tmp_path / "cache.sqlite"), max_size=1024**2)
+
+    CachedEmbeddings(inner, store, "model a").embed_documents(["a"])
+    CachedEmbeddings(inner, store, "model b").embed_documents(["a"])
+
+    assert inner.embedded == 2
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path: Path) -> None:
+    inner = CountingEmbeddings(size=8)
+    # space for two vectors of 8 doubles, with some headroom since eviction frees 10% more than needed
+    store = EmbeddingsCacheStore(str(tmp_path / "cache.sqlite"), max_size=2 * 8 * 8 + 20)
+    embeddings = CachedEmbeddings(inner, store, "model")
+
+    embeddings.embed_documents(["a"])
+    embeddings.embed_documents(["b"])
+    embeddings.embed_documents(["a"])
+    embeddings.embed_documents(["c"])
+    assert inner.embedded == 3
+
+    # `b` was used least recently
+    embeddings.embed_documents(["a"])
+    assert inner.embedded == 3
+    embeddings.embed_documents(["b"])
+    assert inner.embedded == 4
+
+
+def test_query_embeddings_are_reused() -> None:
+    inner = CountingEmbeddings(size=8)
+    embeddings = CachedQueryEmbeddings(inner, QueryEmbeddingsCache(max_size=10, ttl=60), "model")
+
+    first = embeddings.embed_query("what is  the answer?")
+    assert embeddings.embed_query(" what is the answer? ") == first
+    assert inner.embedded == 1
+
+    embeddings.embed_query("another question")
+    assert inner.embedded == 2
+
+
+def test_query_embeddings_expire() -> None:
+    inner = CountingEmbeddings(size=8)
+    embeddings = CachedQueryEmbeddings(inner, QueryEmbeddingsCache(max_size=10, ttl=0.01), "model")
+
+    embeddings.embed_query("question")
+    time.sleep(0.02)
+    embeddings.embed_query("question")
+
+    assert inner.embedded == 2
+
+
+def test_concurrent_queries_share_one_call() -> None:
+    started = Event()
+    release = Event()
+
+    class SlowEmbeddings(CountingEmbeddings):
+        def embed_query(self, text: str) -> list[float]:
+            started.set()
+            assert release.wait(timeout=5)
+            return super().embed_query(text)
+
+    inner = SlowEmbeddings(size=8)
+    embeddings = CachedQueryEmbeddings(inner, QueryEmbeddingsCache(max_size=10, ttl=60), "model")
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        first = executor.submit(embeddings.embed_query, "question")
+        assert started.wait(timeout=5)
+        others = [executor.submit(embeddings.embed_query, "question") for _ in range(3)]
+        release.set()
+        results = [first.result()] + [other.result() for other in others]
+
+    assert inner.embedded == 1
+    assert all(result == results[0] for result in results)
+
+
+def test_concurrent_async_queries_share_one_call() -> None:
+    class SlowEmbeddings(CountingEmbeddings):
+        async def aembed_query(self, text: str) -> list[float]:
+            await asyncio.sleep(0.05)
+            return self.embed_query(text)
+
+    inner = SlowEmbeddings(size=8)
+    embeddings = CachedQueryEmbeddings(inner, QueryEmbeddingsCache(max_size=10, ttl=60), "model")
+
+    async def search() -> list[list[float]]:
+        return await asyncio.gather(*[embeddings.aembed_query("question") for _ in range(4)])
+
+    results = asyncio.run(search())
+
+    assert inner.embedded == 1
+    assert all(result == results[0] for result in results)
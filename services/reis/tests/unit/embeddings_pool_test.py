@@ -0,0 +1,94 @@
+import time
+
+import httpx
+from langchain_community.embeddings import DeterministicFakeEmbedding
+import openai
+import pytest
+from pytest_mock import MockerFixture
+
+from rei_s.services.embeddings_pool import PoolEmbeddings, PoolMember
+from rei_s.services.rate_limiter import RateLimiter
+
+
+def api_error(status_code: int) -> openai.APIStatusError:
+    request = httpx.Request("POST", "https://example.com/embeddings")
+    response = httpx.Response(status_code, headers={"retry-after": "60"}, request=request)
+    return openai.APIStatusError("failed", response=response, body=None)
+
+
+class FailingEmbeddings(DeterministicFakeEmbedding):
+    requests: list[list[str]] = []
+    status_code: int | None = None
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.requests.append(texts)
+        if self.status_code is not None:
+            raise api_error(self.status_code)
+        return super().embed_documents(texts)
+
+
+def member(name: str, embeddings: FailingEmbeddings) -> PoolMember:
+    return PoolMember(name, embeddings, RateLimiter(None, name, rpm=None, tpm=None, max_batch_size=4))
+
+
+def test_rate_limited_deployment_is_skipped() -> None:
+    limited = FailingEmbeddings(size=4, requests=[], status_code=429)
+    healthy = FailingEmbeddings(size=4, requests=[])
+    pool = PoolEmbeddings([member("limited", limited), member("healthy", healthy)], max_retries=3)
+
+    texts = [f"text {i}" for i in range(10)]
+    assert pool.embed_documents(texts) == DeterministicFakeEmbedding(size=4).embed_documents(texts)
+    # the limited deployment is paused after the first 429
+    assert len(limited.requests) == 1
+    assert pool.members[0].limiter.wait_time(["text"]) > 50
+
+
+def test_failing_deployment_is_drained() -> None:
+    failing = FailingEmbeddings(size=4, requests=[], status_code=500)
+    healthy = FailingEmbeddings(size=4, requests=[])
+    pool = PoolEmbeddings([member("failing", failing), member("healthy", healthy)], max_retries=3)
+
+    pool.embed_documents(["a", "b", "c", "d", "e"])
+    assert len(failing.requests) == 1
+    assert pool.members[0].drained_until > time.monotonic()
+
+
+def test_requests_go_to_the_faster_deployment() -> None:
+    slow = member("slow", FailingEmbeddings(size=4, requests=[]))
+    fast = member("fast", FailingEmbeddings(size=4, requests=[]))
+    slow.latency = 1.0
+    fast.latency = 0.1
+    pool = PoolEmbeddings([slow, fast], max_retries=3)
+
+    assert pool.choose(["text"]) is fast
+    # with requests in flight, the fast deployment is expected to answer later
+    fast.in_flight = 20
+    assert pool.choose(["text"]) is slow
+
+
+def test_other_errors_are_not_retried() -> None:
+    failing = FailingEmbeddings(size=4, requests=[], status_code=400)
+    pool = PoolEmbeddings([member("failing", failing), member("other", failing)], max_retries=3)
+
+    with pytest.raises(openai.APIStatusError):
+        pool.embed_documents(["text"])
+    assert len(failing.requests) == 1
+
+
+def test_single_failing_deployment_is_retried_with_backoff(mocker: MockerFixture) -> None:
+    class FlakyEmbeddings(FailingEmbeddings):
+        failures: int = 0
+
+        def embed_documents(self, texts: list[str]) -> list[list[float]]:
+            self.status_code = 500 if self.failures > 0 else None
+            self.failures -= 1
+            return super().embed_documents(texts)
+
+    flaky = FlakyEmbeddings(size=4, requests=[], failures=3)
+    pool = PoolEmbeddings([member("flaky", flaky)], max_retries=5)
+    sleep = mocker.patch("time.sleep")
+
+    assert pool.embed_documents(["text"]) == DeterministicFakeEmbedding(size=4).embed_documents(["text"])
+    # the deployment is drained for 1, 2 and 4 seconds after its failures
+    delays = [call.args[0] for call in sleep.call_args_list if call.args[0] > 0]
+    assert [round(delay) for delay in delays] == [1, 2, 4]
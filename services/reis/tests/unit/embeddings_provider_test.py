@@ -0,0 +1,81 @@
+import asyncio
+import json
+from pathlib import Path
+
+from langchain_community.embeddings import FakeEmbeddings
+from langchain_openai import OpenAIEmbeddings
+import pytest
+from pytest_mock import MockerFixture
+
+from rei_s.services import embeddings_provider
+from rei_s.services.embeddings_provider import get_embeddings_dimensions, get_embeddings_model_id, get_model_embeddings
+from rei_s.services.http_client import get_http_client, start_http_clients, stop_http_clients
+from tests.conftest import get_test_config
+
+
+class CountingEmbeddings(FakeEmbeddings):
+    calls: int = 0
+
+    def embed_query(self, text: str) -> list[float]:
+        self.calls += 1
+        return super().embed_query(text)
+
+
+@pytest.fixture(autouse=True)
+def empty_dimensions_cache(mocker: MockerFixture) -> None:
+    mocker.patch.dict(embeddings_provider.embeddings_dimensions, clear=True)
+
+
+def test_dimensions_from_config() -> None:
+    embeddings = FakeEmbeddings(size=12)
+    config = get_test_config({"embeddings_dimensions": 42})
+
+    assert get_embeddings_dimensions(config, embeddings) == 42
+
+
+def test_dimensions_are_determined_once(tmp_path: Path) -> None:
+    embeddings = CountingEmbeddings(size=12)
+    metadata_path = tmp_path / "metadata.json"
+    config = get_test_config({"embeddings_metadata_path": str(metadata_path)})
+
+    assert get_embeddings_dimensions(config, embeddings) == 12
+    assert get_embeddings_dimensions(config, embeddings) == 12
+    assert embeddings.calls == 1
+    assert json.loads(metadata_path.read_text()) == {get_embeddings_model_id(config): 12}
+
+    # after a restart, the size is read from the metadata file
+    embeddings_provider.embeddings_dimensions.clear()
+    assert get_embeddings_dimensions(config, embeddings) == 12
+    assert embeddings.calls == 1
+
+
+def test_model_id_depends_on_model() -> None:
+    config_a = get_test_config(
+        {"embeddings_type": "ollama", "embeddings_ollama_endpoint": "http://a", "embeddings_ollama_model_name": "a"}
+    )
+    config_b = get_test_config(
+        {"embeddings_type": "ollama", "embeddings_ollama_endpoint": "http://a", "embeddings_ollama_model_name": "b"}
+    )
+
+    assert get_embeddings_model_id(config_a) != get_embeddings_model_id(config_b)
+
+
+def test_embeddings_share_the_http_client() -> None:
+    config = get_test_config(
+        {
+            "embeddings_type": "openai",
+            "embeddings_openai_api_key": "key",
+            "embeddings_openai_model_name": "text-embedding-3-small",
+        }
+    )
+
+    start_http_clients(config)
+    try:
+        first = get_model_embeddings(config)
+        second = get_model_embeddings(config)
+        assert isinstance(first, OpenAIEmbeddings) and isinstance(second, OpenAIEmbeddings)
+        assert first.http_client is second.http_client is get_http_client()
+    finally:
+        asyncio.run(stop_http_clients())
+
+    assert get_http_client() is None
@@ -0,0 +1,58 @@
+from pathlib import Path
+from threading import Barrier
+
+from rei_s.services.filestore_provider import CachedFileStoreAdapter, get_filestore
+from rei_s.services.filestores.filesystem import FSFileStoreAdapter
+from rei_s.types.source_file import SourceFile
+from tests.conftest import get_test_config
+
+
+class CountingFileStore(FSFileStoreAdapter):
+    def __init__(self, path: Path, barrier: Barrier | None = None) -> None:
+        self.path = path
+        self.barrier = barrier
+        self.checks = 0
+
+    def exists(self, doc_id: str) -> bool:
+        self.checks += 1
+        if self.barrier is not None:
+            # all checks have to be in flight at the same time to pass the barrier
+            self.barrier.wait(timeout=5)
+        return super().exists(doc_id)
+
+
+def test_existence_is_cached(tmp_path: Path) -> None:
+    inner = CountingFileStore(tmp_path)
+    file_store = CachedFileStoreAdapter(inner, ttl=60, concurrency=4)
+    (tmp_path / "a").write_bytes(b"a")
+
+    assert file_store.exists_many({"a", "b"}) == {"a": True, "b": False}
+    assert file_store.exists_many({"a", "b"}) == {"a": True, "b": False}
+    assert inner.checks == 2
+
+
+def test_cache_follows_additions_and_deletions(tmp_path: Path) -> None:
+    inner = CountingFileStore(tmp_path)
+    file_store = CachedFileStoreAdapter(inner, ttl=60, concurrency=4)
+    source = tmp_path / "source"
+    source.write_bytes(b"content")
+
+    assert not file_store.exists("doc")
+    file_store.add_document(SourceFile(id="doc", path=source, mime_type="text/plain", file_name="doc.txt"))
+    assert file_store.exists("doc")
+    file_store.delete("doc")
+    assert not file_store.exists("doc")
+    assert inner.checks == 1
+
+
+def test_checks_run_concurrently(tmp_path: Path) -> None:
+    inner = CountingFileStore(tmp_path, barrier=Barrier(3))
+    file_store = CachedFileStoreAdapter(inner, ttl=0, concurrency=3)
+
+    assert file_store.exists_many({"a", "b", "c"}) == {"a": False, "b": False, "c": False}
+
+
+def test_file_store_is_reused(tmp_path: Path) -> None:
+    config = get_test_config({"file_store_type": "filesystem", "file_store_filesystem_basepath": str(tmp_path)})
+
+    assert get_filestore(config) is get_filestore(config)
@@ -1,7 +1,19 @@
 from itertools import combinations
+from pathlib import Path
+from threading import Barrier, Event
+import time
+from typing import Any
+from unittest.mock import MagicMock
+from zipfile import ZipFile
+
+from langchain_core.documents import Document
+from langchain_core.documents.base import Blob
+from pdfminer.pdfinterp import PDFPageInterpreter
+from pytest_mock import MockerFixture
 
 from rei_s.config import Config
-from rei_s.services.formats import get_format_providers
+from rei_s.services.formats import format_provider_specs, get_format_providers
+from rei_s.services.formats.abstract_format_provider import AbstractFormatProvider
 from rei_s.services.formats.code_provider import CodeProvider
 from rei_s.services.formats.html_provider import HtmlProvider
 from rei_s.services.formats.json_provider import JsonProvider
@@ -11,8 +23,10 @@ from rei_s.services.formats.ms_excel_provider import MsExcelProvider
 from rei_s.services.formats.ms_ppt_provider import MsPptProvider
 from rei_s.services.formats.ms_word_provider import MsWordProvider
 from rei_s.services.formats.outlook_provider import OutlookProvider
-from rei_s.services.formats.pdf_provider import PdfProvider
+from rei_s.services.formats.pdf_provider import PageTextCollector, PdfProvider
 from rei_s.services.formats.plain_provider import PlainProvider
+from rei_s.services.formats.video_transcription_provider import VideoTranscriptionProvider
+from rei_s.services.formats.voice_transcription_provider import MAX_SEGMENT_BYTES, VoiceTranscriptionProvider
 from rei_s.services.formats.xml_provider import XmlProvider
 from rei_s.services.formats.yaml_provider import YamlProvider
 from rei_s.types.source_file import SourceFile, temp_file
@@ -73,30 +87,13 @@ def test_odt_provider() -> None:
 
 
 def test_xlsx_provider() -> None:
-    expected_p1 = """Name
-Mickey Mouse
-Donald Duck
-
-Birthday
-3/14/1592
-2/7/1828
-
-BirthdaySheet
-
-Page 1"""
-    expected_p2 = """Name 1
-Mickey Mouse
-
-Name 2
-Mini Mouse
-
-Anniversary
-
-01/01/11
-
-AnniversarySheet
-
-Page 2"""
+    expected_p1 = """| Name | Birthday |
+| --- | --- |
+| Mickey Mouse | 3/14/1592 |
+| Donald Duck | 2/7/1828 |"""
+    expected_p2 = """| Name 1 | Name 2 | Anniversary |
+| --- | --- | --- |
+| Mickey Mouse | Mini Mouse | 1911-01-01 |"""
     source_file = SourceFile(
         path="tests/data/birthdays.xlsx",
         mime_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
@@ -108,16 +105,50 @@ Page 2"""
     docs = xlsx.process_file(source_file)
     assert len(docs) > 0
     assert docs[0].page_content == expected_p1
-    assert docs[0].metadata["page"] == 1
+    assert docs[0].metadata == {"sheet": "BirthdaySheet", "first_row": 2, "last_row": 3}
     assert docs[1].page_content == expected_p2
-    assert docs[1].metadata["page"] == 2
+    assert docs[1].metadata == {"sheet": "AnniversarySheet", "first_row": 2, "last_row": 2}
 
     pdf = xlsx.convert_file_to_pdf(source_file)
-    assert_pdf_contains_text(pdf, expected_p1)
-    assert_pdf_contains_text(pdf, expected_p2)
+    assert_pdf_contains_text(pdf, "Donald Duck")
+    assert_pdf_contains_text(pdf, "Mini Mouse")
     assert pdf.id == source_file.id
 
 
+def test_ods_rows_are_chunked_with_header(tmp_path: Path) -> None:
+    namespaces = (
+        'xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+        'xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0" '
+        'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0"'
+    )
+    header = "<table:table-row><table:table-cell><text:p>Name</text:p></table:table-cell>"
+    header += "<table:table-cell><text:p>Level</text:p></table:table-cell></table:table-row>"
+    row = (
+        "<table:table-row table:number-rows-repeated='3'><table:table-cell><text:p>Scrooge</text:p></table:table-cell>"
+        "<table:table-cell table:number-columns-repeated='2' office:value-type='float'><text:p>1</text:p>"
+        "</table:table-cell><table:table-cell table:number-columns-repeated='16000'/></table:table-row>"
+    )
+    empty = "<table:table-row table:number-rows-repeated='1048570'><table:table-cell/></table:table-row>"
+    content = f"<office:document-content {namespaces}><office:body><office:spreadsheet>"
+    content += f"<table:table table:name='Log'>{header}{row}{empty}</table:table>"
+    content += "</office:spreadsheet></office:body></office:document-content>"
+    path = tmp_path / "log.ods"
+    with ZipFile(path, "w") as archive:
+        archive.writestr("content.xml", content)
+
+    ods = LibreOfficeProvider()
+    docs = ods.process_file(SourceFile(path=path, mime_type="", file_name="log.ods"), chunk_size=60, chunk_overlap=0)
+
+    # every chunk repeats the header and contains whole rows only
+    assert [doc.page_content for doc in docs] == [
+        "| Name | Level |\n| --- | --- |\n| Scrooge | 1 | 1 |",
+        "| Name | Level |\n| --- | --- |\n| Scrooge | 1 | 1 |",
+        "| Name | Level |\n| --- | --- |\n| Scrooge | 1 | 1 |",
+    ]
+    assert [doc.metadata["first_row"] for doc in docs] == [2, 3, 4]
+    assert all(doc.metadata["sheet"] == "Log" for doc in docs)
+
+
 def test_docx_provider() -> None:
     expected = "Darkwing Duck was born on 9/17/1966."
     source_file = SourceFile(
@@ -131,6 +162,7 @@ def test_docx_provider() -> None:
     docs = docx.process_file(source_file)
     assert len(docs) > 0
     assert docs[0].page_content == expected
+    assert docs[0].metadata["section"] == 1
 
     pdf = docx.convert_file_to_pdf(source_file)
     assert_pdf_contains_text(pdf, expected)
@@ -152,12 +184,30 @@ Gladstone Gander: 5/14/2001"""
     docs = pptx.process_file(source_file)
     assert len(docs) > 0
     assert docs[0].page_content == expected
+    assert docs[0].metadata["slide"] == 1
 
     pdf = pptx.convert_file_to_pdf(source_file)
     assert_pdf_contains_text(pdf, "Gladstone Gander")
     assert pdf.id == source_file.id
 
 
+def test_docx_sections_and_nested_paragraphs(tmp_path: Path) -> None:
+    w = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+    body = (
+        "<w:p><w:r><w:t>first</w:t><w:tab/><w:t>section</w:t></w:r></w:p>"
+        "<w:p><w:pPr><w:sectPr/></w:pPr></w:p>"
+        "<w:p><w:r><w:t>outer</w:t><w:pict><w:txbxContent><w:p><w:r><w:t> inner</w:t></w:r></w:p>"
+        "</w:txbxContent></w:pict></w:r></w:p>"
+        "<w:sectPr/>"
+    )
+    path = tmp_path / "sections.docx"
+    with ZipFile(path, "w") as archive:
+        archive.writestr("word/document.xml", f"<w:document {w}><w:body>{body}</w:body></w:document>")
+
+    docs = MsWordProvider().process_file(SourceFile(path=path, mime_type="", file_name="sections.docx"))
+    assert [(doc.page_content, doc.metadata["section"]) for doc in docs] == [("first\tsection", 1), ("outer inner", 2)]
+
+
 def test_pdf_provider() -> None:
     expected_p1 = """Name
 Darkwing Duck
@@ -196,6 +246,53 @@ Page 2"""
     assert converted_pdf_file.id == source_file.id
 
 
+def test_pdf_provider_falls_back_for_single_pages(mocker: MockerFixture) -> None:
+    process_page = PDFPageInterpreter.process_page
+    calls = 0
+
+    def fail_on_first_page(self: PDFPageInterpreter, page: Any) -> None:
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise ValueError("broken page")
+        process_page(self, page)
+
+    mocker.patch.object(PDFPageInterpreter, "process_page", fail_on_first_page)
+    source_file = SourceFile(path="tests/data/birthdays.pdf", mime_type="application/pdf", file_name="text.pdf")
+
+    docs = PdfProvider().process_file(source_file)
+
+    assert [doc.metadata["page"] for doc in docs] == [1, 2]
+    assert docs[0].metadata["pdf_parser"].startswith("PyPDF")
+    assert "Darkwing Duck" in docs[0].page_content
+    assert docs[1].metadata["pdf_parser"].startswith("PDFMiner")
+    assert "Daniel Düsentrieb" in docs[1].page_content
+    assert calls == 2
+
+
+def test_pdf_provider_recovers_from_pages_failing_inside_figures(mocker: MockerFixture) -> None:
+    begin_page = PageTextCollector.begin_page
+    calls = 0
+
+    def fail_inside_figure_on_first_page(self: PageTextCollector, page: Any, ctm: Any) -> None:
+        nonlocal calls
+        calls += 1
+        begin_page(self, page, ctm)
+        if calls == 1:
+            # e.g. a broken form XObject, whose figure is never ended
+            self.begin_figure("broken", page.mediabox, (1, 0, 0, 1, 0, 0))
+            raise ValueError("broken figure")
+
+    mocker.patch.object(PageTextCollector, "begin_page", fail_inside_figure_on_first_page)
+    source_file = SourceFile(path="tests/data/birthdays.pdf", mime_type="application/pdf", file_name="text.pdf")
+
+    docs = PdfProvider().process_file(source_file)
+
+    assert docs[0].metadata["pdf_parser"].startswith("PyPDF")
+    assert docs[1].metadata["pdf_parser"].startswith("PDFMiner")
+    assert "Daniel Düsentrieb" in docs[1].page_content
+
+
 def test_code_provider() -> None:
     content = b'print("Hello World!)'
     expected = content.decode()
@@ -350,8 +447,211 @@ def test_format_providers_unique() -> None:
             assert not i.supports(f_extension) or not j.supports(f_extension)
 
 
+def test_format_provider_specs_match_providers() -> None:
+    # the registry knows the providers without importing them, so it has to be kept in sync
+    for spec in format_provider_specs:
+        cls = spec.load()
+        assert cls.name == spec.name
+        assert tuple(cls.file_name_extensions) == spec.file_name_extensions
+        assert spec.cleans_up == (cls.clean_up is not AbstractFormatProvider.clean_up)
+
+    subclasses = AbstractFormatProvider.__subclasses__()
+    for subclass in subclasses:
+        subclasses.extend(subclass.__subclasses__())
+    assert {spec.load() for spec in format_provider_specs} == set(subclasses)
+
+    for config in [get_test_config(), get_config_all_formats_enabled()]:
+        for spec in format_provider_specs:
+            assert spec.enabled(config) == spec.load()(config=config).enabled  # type: ignore[call-arg]
+
+
 def assert_pdf_contains_text(file: SourceFile, text: str) -> None:
     pdf = PdfProvider()
     docs = pdf.process_file(file, chunk_overlap=0)
     content = "\n".join(doc.page_content for doc in docs)
     assert text in content
+
+
+class FakeWhisperParser:
+    def __init__(self, concurrency: int) -> None:
+        # all segments have to be in flight at the same time to pass the barrier
+        self.barrier = Barrier(concurrency)
+
+    def parse(self, blob: Blob) -> list[Document]:
+        self.barrier.wait(timeout=5)
+        text = blob.as_string()
+        # the later segments are finished first
+        time.sleep(0.1 / int(text))
+        return [Document(page_content=f"segment {text}")]
+
+
+def test_segments_are_transcribed_concurrently(mocker: MockerFixture, tmp_path: Path) -> None:
+    config = get_test_config(
+        {
+            "stt_type": "azure-openai-whisper",
+            "stt_azure_openai_whisper_endpoint": "https://example.com",
+            "stt_azure_openai_whisper_api_key": "key",
+            "stt_azure_openai_whisper_api_version": "2024-06-01",
+            "stt_azure_openai_whisper_deployment_name": "whisper",
+            "stt_concurrency": 3,
+        }
+    )
+    audio = VoiceTranscriptionProvider(config=config)
+    audio.parser = FakeWhisperParser(concurrency=3)  # type: ignore[assignment]
+
+    segments = []
+    for n, start in enumerate([0, 300, 600], start=1):
+        (tmp_path / f"{n}.mp3").write_text(str(n))
+        segments.append((SourceFile(path=tmp_path / f"{n}.mp3", mime_type="audio/mp3", file_name=f"{n}.mp3"), start))
+    mocker.patch("ffmpeg.probe", return_value=probe_result("mp3", "128000", "128500"))
+    mocker.patch.object(audio, "iter_segments", return_value=(segment for segment in segments))
+
+    docs = audio.parse_file(SourceFile(path="audio.mp3", mime_type="audio/mp3", file_name="audio.mp3"))
+
+    assert [doc.page_content for doc in docs] == ["segment 1", "segment 2", "segment 3"]
+    assert [doc.metadata["segment_begin_seconds"] for doc in docs] == [0, 300, 600]
+    assert [doc.metadata["segment_end_seconds"] for doc in docs] == [300, 600, 750]
+    assert all(doc.metadata["total_duration"] == 750 for doc in docs)
+    assert not any(Path(segment.path).exists() for segment, _start in segments)
+
+
+def test_audio_and_video_share_the_request_limit() -> None:
+    config = get_test_config(
+        {
+            "stt_type": "azure-openai-whisper",
+            "stt_azure_openai_whisper_endpoint": "https://shared.example.com",
+            "stt_azure_openai_whisper_api_key": "key",
+            "stt_azure_openai_whisper_api_version": "2024-06-01",
+            "stt_azure_openai_whisper_deployment_name": "whisper",
+        }
+    )
+
+    assert VoiceTranscriptionProvider(config=config).requests is VideoTranscriptionProvider(config=config).requests
+
+
+def fake_segment_muxer(args: list[str], **_kwargs: Any) -> MagicMock:
+    # writes three segments and the list of their timestamps, like `ffmpeg -f segment`
+    pattern = args[-1]
+    segment_list = args[args.index("-segment_list") + 1]
+    with open(segment_list, "w") as f:
+        for n, (start, end) in enumerate([(0.0, 300.02), (300.02, 600.01), (600.01, 750.0)]):
+            name = pattern.replace("%05d", f"{n:05d}")
+            Path(name).write_bytes(b"segment")
+            f.write(f"{Path(name).name},{start},{end}\n")
+
+    process = MagicMock()
+    process.poll.return_value = 0
+    process.returncode = 0
+    return process
+
+
+def probe_result(codec: str, stream_bit_rate: str | None, format_bit_rate: str, video: bool = False) -> dict[str, Any]:
+    stream = {"codec_type": "audio", "codec_name": codec}
+    if stream_bit_rate is not None:
+        stream["bit_rate"] = stream_bit_rate
+    streams = [{"codec_type": "video", "codec_name": "h264"}, stream] if video else [stream]
+    return {"streams": streams, "format": {"duration": "750.0", "bit_rate": format_bit_rate}}
+
+
+def test_audio_is_segmented_in_a_single_pass(mocker: MockerFixture) -> None:
+    mocker.patch("ffmpeg.probe", return_value=probe_result("aac", "128000", "2000000", video=True))
+    popen = mocker.patch("subprocess.Popen", side_effect=fake_segment_muxer)
+    video = VideoTranscriptionProvider()
+    metadata = video.probe_audio_codec("video.mp4")
+
+    segments = list(video.iter_segments("video.mp4", metadata))
+
+    assert popen.call_count == 1
+    args = popen.call_args.args[0]
+    assert args[args.index("-i") + 1] == "video.mp4"
+    assert args[args.index("-f") + 1] == "segment"
+    assert args[args.index("-map") + 1] == "0:a:0"
+    assert args[args.index("-c") + 1] == "copy"
+    assert [start for _segment, start in segments] == [0.0, 300.02, 600.01]
+    assert all(str(segment.path).endswith(".m4a") for segment, _start in segments)
+    for segment, _start in segments:
+        segment.delete()
+
+
+def test_segments_of_unknown_size_are_checked_before_transcription(mocker: MockerFixture) -> None:
+    # the bitrate of flac audio in a video is unknown
+    mocker.patch("ffmpeg.probe", return_value=probe_result("flac", None, "1000000", video=True))
+
+    def muxer_with_large_last_segment(args: list[str], **kwargs: Any) -> MagicMock:
+        process = fake_segment_muxer(args, **kwargs)
+        if "-c" in args:
+            # only the copied segments are too large, the first one is too close to the limit to start early
+            Path(args[-1].replace("%05d", "00000")).write_bytes(b"x" * int(0.9 * MAX_SEGMENT_BYTES))
+            Path(args[-1].replace("%05d", "00002")).write_bytes(b"x" * MAX_SEGMENT_BYTES)
+        return process
+
+    popen = mocker.patch("subprocess.Popen", side_effect=muxer_with_large_last_segment)
+    video = VideoTranscriptionProvider()
+    video.parser = MagicMock()
+    video.parser.parse.return_value = [Document(page_content="transcript")]
+
+    docs = video.parse_file(SourceFile(path="video.mkv", mime_type="video/x-matroska", file_name="video.mkv"))
+
+    # the audio is segmented again with reencoding, only these segments are transcribed
+    assert popen.call_count == 2
+    assert video.parser.parse.call_count == 3
+    assert all(str(blob.path).endswith(".ogg") for (blob,), _kwargs in video.parser.parse.call_args_list)
+    assert len(docs) == 3
+
+
+def test_segments_of_unknown_size_are_transcribed_early_if_the_first_one_is_small(mocker: MockerFixture) -> None:
+    # Matroska does not state the bitrate of its audio streams
+    mocker.patch("ffmpeg.probe", return_value=probe_result("vorbis", None, "1000000", video=True))
+    transcribing = Event()
+    transcribing_before_ffmpeg_finished = []
+
+    def slow_segment_muxer(args: list[str], **kwargs: Any) -> MagicMock:
+        process = fake_segment_muxer(args, **kwargs)
+        segment_list = Path(args[args.index("-segment_list") + 1])
+        lines = segment_list.read_text().splitlines(keepends=True)
+        # only the first segment is finished at first
+        segment_list.write_text(lines[0])
+
+        def poll() -> int | None:
+            if process.poll.call_count == 1:
+                return None
+            transcribing_before_ffmpeg_finished.append(transcribing.wait(timeout=5))
+            segment_list.write_text("".join(lines))
+            return 0
+
+        process.poll.side_effect = poll
+        return process
+
+    popen = mocker.patch("subprocess.Popen", side_effect=slow_segment_muxer)
+    video = VideoTranscriptionProvider()
+
+    def parse(_blob: Blob) -> list[Document]:
+        transcribing.set()
+        return [Document(page_content="transcript")]
+
+    video.parser = MagicMock()
+    video.parser.parse.side_effect = parse
+
+    docs = video.parse_file(SourceFile(path="video.webm", mime_type="video/webm", file_name="video.webm"))
+
+    assert popen.call_count == 1
+    assert transcribing_before_ffmpeg_finished[0]
+    assert video.parser.parse.call_count == 3
+    assert len(docs) == 3
+
+
+def test_audio_with_high_bitrate_is_reencoded_up_front(mocker: MockerFixture) -> None:
+    # flac does not state the bitrate of the stream, segments of 5 minutes would have about 37 MB
+    mocker.patch("ffmpeg.probe", return_value=probe_result("flac", None, "1000000"))
+    popen = mocker.patch("subprocess.Popen", side_effect=fake_segment_muxer)
+    audio = VoiceTranscriptionProvider()
+    metadata = audio.probe_audio_codec("audio.flac")
+
+    segments = list(audio.iter_segments("audio.flac", metadata))
+
+    assert popen.call_count == 1
+    args = popen.call_args.args[0]
+    assert args[args.index("-b:a") + 1] == "128k"
+    assert all(str(segment.path).endswith(".ogg") for segment, _start in segments)
+    for segment, _start in segments:
+        segment.delete()
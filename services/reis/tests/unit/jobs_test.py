@@ -0,0 +1,105 @@
+from pathlib import Path
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from langchain_community.embeddings import FakeEmbeddings
+from pytest_mock import MockerFixture
+
+from rei_s.config import get_config
+from rei_s.services.job_queue import JobDispatcher, JobQueue
+from rei_s.services.vectorstores.devnull_store import DevNullVectorStoreAdapter
+from rei_s.types.dtos import JobStatus
+from rei_s.types.source_file import SourceFile
+from tests.conftest import get_test_config
+
+
+def test_add_file_as_job(mocker: MockerFixture, app: FastAPI, tmp_path: Path) -> None:
+    app.dependency_overrides[get_config] = lambda: get_test_config(
+        dict(metrics_port=0, jobs_path=str(tmp_path), batch_size=4)
+    )
+    mocker.patch("rei_s.services.embeddings_provider.get_embeddings", return_value=FakeEmbeddings(size=1352))
+    mocker.patch("rei_s.services.store_service.get_vector_store", return_value=DevNullVectorStoreAdapter())
+
+    # the job queue is started in the lifespan
+    with TestClient(app) as client:
+        with open("tests/data/birthdays.pdf", "rb") as f:
+            response = client.post(
+                "/files",
+                data=f,  # type: ignore[arg-type]
+                headers={
+                    "bucket": "15",
+                    "id": "1",
+                    "fileName": "test.pdf",
+                    "fileMimeType": "application/pdf",
+                    "Prefer": "respond-async",
+                },
+            )
+
+        assert response.status_code == 202
+        location = response.headers["Location"]
+        assert location == f"/jobs/{response.json()['id']}"
+
+        for _ in range(100):
+            job = client.get(location).json()
+            if job["status"] not in [JobStatus.queued, JobStatus.running]:
+                break
+            time.sleep(0.1)
+
+    assert job["status"] == JobStatus.succeeded
+    assert job["file_id"] == "1"
+    assert job["batches_done"] > 0
+    assert job["batches_done"] == job["batches_total"]
+    # the uploaded file is removed after processing
+    assert list((tmp_path / "files").iterdir()) == []
+
+
+def test_unknown_job(app: FastAPI) -> None:
+    client = TestClient(app)
+
+    assert client.get("/jobs/unknown").status_code == 404
+
+
+def test_abandoned_jobs_are_recovered(tmp_path: Path) -> None:
+    queue = JobQueue(str(tmp_path))
+    file = SourceFile(id="1", path=queue.new_file_path("job"), file_name="test.pdf", mime_type="application/pdf")
+    queue.enqueue("job", file, "bucket", None)
+
+    claimed = queue.claim()
+    assert claimed is not None
+    assert claimed[0] == "job"
+    assert claimed[4] == 1
+    # a running job with a valid lease is not claimed again
+    assert queue.claim() is None
+
+    # simulate a restart after the lease expired
+    queue.connection.execute("UPDATE jobs SET lease_until = 0")
+    queue = JobQueue(str(tmp_path))
+
+    claimed = queue.claim()
+    assert claimed is not None
+    assert claimed[0] == "job"
+    assert claimed[4] == 2
+
+
+def test_jobs_interrupted_by_the_shutdown_are_kept(mocker: MockerFixture, tmp_path: Path) -> None:
+    queue = JobQueue(str(tmp_path))
+    path = queue.new_file_path("job")
+    Path(path).write_bytes(b"content")
+    queue.enqueue("job", SourceFile(id="1", path=path, file_name="a.txt", mime_type="text/plain"), "bucket", None)
+    dispatcher = JobDispatcher(get_test_config(), queue, concurrency=1)
+
+    def shut_down_while_processing(*_args: object, **_kwargs: object) -> None:
+        dispatcher.stopped.set()
+        raise RuntimeError("The process pool was already shut down")
+
+    mocker.patch("rei_s.services.store_service.process_and_add_file", side_effect=shut_down_while_processing)
+    claimed = queue.claim()
+    assert claimed is not None
+    dispatcher.run(*claimed)
+
+    # the lease of the job expires and it is picked up again after a restart
+    job = queue.get("job")
+    assert job is not None
+    assert job.status == JobStatus.running
+    assert Path(path).exists()
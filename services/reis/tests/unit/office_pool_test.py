@@ -0,0 +1,138 @@
+from pathlib import Path
+import subprocess
+import sys
+from threading import Thread
+import time
+from typing import Generator
+
+import pytest
+
+from rei_s.services.office_pool import OfficeInstance, OfficeInstanceDiedError, OfficePool, start_office_pool
+from tests.conftest import get_test_config
+
+
+class FakeInstance(OfficeInstance):
+    """Stands in for LibreOffice, which is not available in the unit tests."""
+
+    def __init__(self) -> None:
+        # a short-lived process, such that the instance has a pid
+        self.process = subprocess.Popen([sys.executable, "-c", ""])
+        self.conversions = 0
+        self.timed_out = False
+        self.stopped = False
+        self.broken = False
+
+    @property
+    def alive(self) -> bool:
+        return not self.stopped and not self.broken
+
+    def healthy(self) -> bool:
+        return self.alive
+
+    def kill(self) -> None:
+        self.timed_out = True
+        self.broken = True
+
+    def convert(self, path: str | Path, pdf_path: str | Path, timeout: float) -> None:
+        if str(path) == "crash":
+            self.broken = True
+            raise OfficeInstanceDiedError("crashed")
+        if str(path) == "hang":
+            time.sleep(timeout)
+            raise TimeoutError("timed out")
+        if str(path) == "invalid":
+            raise ValueError("can not open")
+        self.conversions += 1
+
+    def stop(self, timeout: float = 5) -> None:
+        self.process.wait()
+        self.stopped = True
+
+
+class FakeOfficePool(OfficePool):
+    def spawn_instance(self) -> OfficeInstance:
+        instance = FakeInstance()
+        with self.lock:
+            self.instances.add(instance)
+        return instance
+
+
+@pytest.fixture
+def pool() -> Generator[FakeOfficePool, None, None]:
+    pool = FakeOfficePool(size=1, timeout=0.01, max_conversions=2)
+    pool.start()
+    yield pool
+    pool.shutdown()
+
+
+def get_instance(pool: OfficePool) -> OfficeInstance:
+    assert len(pool.instances) == 1
+    return next(iter(pool.instances))
+
+
+def test_reuses_and_restarts_instances(pool: FakeOfficePool) -> None:
+    pool.convert("a", "a.pdf")
+    first = get_instance(pool)
+    pool.convert("b", "b.pdf")
+    # after `max_conversions` conversions the instance is replaced
+    second = get_instance(pool)
+    pool.convert("c", "c.pdf")
+
+    assert first.conversions == 2
+    assert first is not second
+    assert get_instance(pool) is second
+
+
+@pytest.mark.parametrize("path,error", [("crash", OfficeInstanceDiedError), ("hang", TimeoutError)])
+def test_failed_instances_are_replaced(pool: FakeOfficePool, path: str, error: type[Exception]) -> None:
+    failed = get_instance(pool)
+    with pytest.raises(error):
+        pool.convert(path, "out.pdf")
+
+    assert get_instance(pool) is not failed
+    pool.convert("a", "a.pdf")
+
+
+def test_instance_survives_invalid_documents(pool: FakeOfficePool) -> None:
+    instance = get_instance(pool)
+    with pytest.raises(ValueError):
+        pool.convert("invalid", "out.pdf")
+
+    assert get_instance(pool) is instance
+
+
+def test_unhealthy_instances_are_replaced_before_use(pool: FakeOfficePool) -> None:
+    instance = get_instance(pool)
+    assert isinstance(instance, FakeInstance)
+    instance.broken = True
+
+    pool.convert("a", "a.pdf")
+    assert get_instance(pool) is not instance
+    assert get_instance(pool).conversions == 1
+
+
+def test_waiting_callers_fail_on_shutdown(pool: FakeOfficePool) -> None:
+    errors: list[Exception] = []
+
+    def wait_for_instance() -> None:
+        try:
+            pool.convert("a", "a.pdf")
+        except RuntimeError as e:
+            errors.append(e)
+
+    with pool.acquire_instance():
+        # the only instance is busy, so the other caller has to wait
+        waiting = Thread(target=wait_for_instance)
+        waiting.start()
+        pool.shutdown()
+    waiting.join(timeout=5)
+
+    assert not waiting.is_alive()
+    assert len(errors) == 1
+
+
+def test_pool_fails_to_start_without_unoserver(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr("shutil.which", lambda _: None)
+
+    with pytest.raises(RuntimeError, match="unoserver"):
+        start_office_pool(get_test_config({"office_pool_size": 1}))
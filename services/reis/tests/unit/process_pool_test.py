@@ -0,0 +1,106 @@
+import os
+from threading import Thread
+from typing import Generator
+
+import pytest
+
+from rei_s.services.process_pool import ProcessPool, WorkerDiedError
+
+
+def get_pid() -> int:
+    return os.getpid()
+
+
+def fail() -> None:
+    raise ValueError("failed in worker")
+
+
+def crash() -> None:
+    os._exit(1)
+
+
+@pytest.fixture
+def pool() -> Generator[ProcessPool, None, None]:
+    pool = ProcessPool(size=1, max_tasks=2, max_rss=1024**4)
+    pool.start()
+    yield pool
+    pool.shutdown()
+
+
+def test_runs_in_other_process(pool: ProcessPool) -> None:
+    assert pool.run(get_pid) != os.getpid()
+
+
+def test_reuses_and_recycles_workers(pool: ProcessPool) -> None:
+    first = pool.run(get_pid)
+    second = pool.run(get_pid)
+    # after `max_tasks` tasks the worker is replaced
+    third = pool.run(get_pid)
+
+    assert first == second
+    assert third != second
+
+
+def test_recycles_on_memory_limit() -> None:
+    pool = ProcessPool(size=1, max_tasks=100, max_rss=1)
+    pool.start()
+    try:
+        assert pool.run(get_pid) != pool.run(get_pid)
+    finally:
+        pool.shutdown()
+
+
+def test_exception_is_raised(pool: ProcessPool) -> None:
+    with pytest.raises(ValueError, match="failed in worker"):
+        pool.run(fail)
+
+    # the worker survives exceptions
+    assert pool.run(get_pid) != os.getpid()
+
+
+def test_crashed_worker_is_replaced(pool: ProcessPool) -> None:
+    with pytest.raises(WorkerDiedError):
+        pool.run(crash)
+
+    assert pool.run(get_pid) != os.getpid()
+
+
+def count(n: int) -> Generator[int, None, None]:
+    yield from range(n)
+
+
+def test_streams_items(pool: ProcessPool) -> None:
+    assert list(pool.stream(count, 5)) == [0, 1, 2, 3, 4]
+
+
+def test_aborted_stream_replaces_worker(pool: ProcessPool) -> None:
+    first = pool.run(get_pid)
+
+    stream = pool.stream(count, 1000)
+    assert next(stream) == 0
+    stream.close()
+
+    # the worker still sends the remaining items, thus it must not be reused
+    assert pool.run(get_pid) != first
+
+
+def test_waiting_callers_fail_on_shutdown() -> None:
+    pool = ProcessPool(size=1, max_tasks=100, max_rss=1024**4)
+    pool.start()
+    errors: list[Exception] = []
+
+    def wait_for_worker() -> None:
+        try:
+            pool.run(get_pid)
+        except RuntimeError as e:
+            errors.append(e)
+
+    with pool.acquire_worker():
+        # the only worker is busy, so the other caller has to wait
+        waiting = Thread(target=wait_for_worker)
+        waiting.start()
+        pool.shutdown()
+    waiting.join(timeout=5)
+
+    assert not waiting.is_alive()
+    assert len(errors) == 1
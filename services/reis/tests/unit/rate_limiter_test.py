@@ -0,0 +1,110 @@
+import asyncio
+import sqlite3
+
+import httpx
+from langchain_community.embeddings import DeterministicFakeEmbedding
+import ollama
+import openai
+import pytest
+
+from rei_s.services.rate_limiter import RateLimitedEmbeddings, RateLimiter, get_retry_after, is_transient
+
+
+def rate_limit_error(headers: dict[str, str]) -> openai.RateLimitError:
+    request = httpx.Request("POST", "https://example.com/embeddings")
+    response = httpx.Response(429, headers=headers, request=request)
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+class RateLimitedFakeEmbeddings(DeterministicFakeEmbedding):
+    requests: list[list[str]] = []
+    failures: int = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.requests.append(texts)
+        if self.failures > 0:
+            self.failures -= 1
+            raise rate_limit_error({"retry-after-ms": "10"})
+        return super().embed_documents(texts)
+
+
+def test_retry_after_header() -> None:
+    assert get_retry_after(rate_limit_error({"retry-after": "3"})) == 3
+    assert get_retry_after(rate_limit_error({"retry-after-ms": "1500"})) == 1.5
+    assert get_retry_after(ValueError()) is None
+
+
+def test_errors_of_other_clients_are_recognized() -> None:
+    request = httpx.Request("POST", "https://example.com/api/embed")
+    response = httpx.Response(429, headers={"retry-after": "2"}, request=request)
+
+    assert get_retry_after(httpx.HTTPStatusError("rate limited", request=request, response=response)) == 2
+    assert is_transient(httpx.ConnectError("connection refused"))
+    assert is_transient(ollama.ResponseError("overloaded", status_code=503))
+    assert not is_transient(ollama.ResponseError("model not found", status_code=404))
+    assert not is_transient(ValueError())
+
+
+def test_requests_wait_for_the_bucket() -> None:
+    limiter = RateLimiter(None, "model", rpm=60, tpm=None, max_batch_size=10)
+
+    assert limiter.try_acquire({"requests": 60, "tokens": 0}) == 0
+    # one request per second is refilled
+    assert 0 < limiter.try_acquire({"requests": 1, "tokens": 0}) <= 1
+
+
+def test_limiter_is_shared_by_file(tmp_path: str) -> None:
+    path = f"{tmp_path}/limiter.sqlite"
+    first = RateLimiter(path, "model", rpm=None, tpm=1000, max_batch_size=10)
+    second = RateLimiter(path, "model", rpm=None, tpm=1000, max_batch_size=10)
+
+    assert first.try_acquire({"requests": 1, "tokens": 1000}) == 0
+    assert second.try_acquire({"requests": 1, "tokens": 500}) > 0
+
+    second.on_rate_limited(retry_after=60)
+    assert first.try_acquire({"requests": 1, "tokens": 0}) > 50
+
+
+def test_async_acquire_does_not_block_the_event_loop(tmp_path: str) -> None:
+    path = f"{tmp_path}/limiter.sqlite"
+    limiter = RateLimiter(path, "model", rpm=None, tpm=1000, max_batch_size=10)
+    # another process holds the write lock of the file for a while
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+
+    async def run() -> int:
+        acquire = asyncio.create_task(limiter.aacquire(["text"]))
+        ticks = 0
+        while ticks < 5:
+            await asyncio.sleep(0.01)
+            ticks += 1
+        assert not acquire.done()
+        other.execute("COMMIT")
+        await acquire
+        return ticks
+
+    try:
+        assert asyncio.run(run()) == 5
+    finally:
+        other.close()
+        limiter.close()
+
+
+def test_rate_limits_are_retried_with_smaller_batches() -> None:
+    inner = RateLimitedFakeEmbeddings(size=4, requests=[], failures=2)
+    limiter = RateLimiter(None, "model", rpm=None, tpm=100_000, max_batch_size=8)
+    embeddings = RateLimitedEmbeddings(inner, limiter, max_retries=5)
+
+    texts = [f"text {i}" for i in range(8)]
+    assert embeddings.embed_documents(texts) == DeterministicFakeEmbedding(size=4).embed_documents(texts)
+    assert [len(request) for request in inner.requests[:3]] == [8, 4, 2]
+    assert limiter.limits["tokens"] * 0.49 < limiter.connection.execute("SELECT rate FROM buckets").fetchone()[0]
+
+
+def test_rate_limits_fail_after_max_retries() -> None:
+    inner = RateLimitedFakeEmbeddings(size=4, requests=[], failures=3)
+    embeddings = RateLimitedEmbeddings(inner, RateLimiter(None, "model", None, None, max_batch_size=8), max_retries=2)
+
+    with pytest.raises(openai.RateLimitError):
+        embeddings.embed_documents(["text"])
+    assert len(inner.requests) == 3
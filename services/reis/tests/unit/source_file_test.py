@@ -0,0 +1,39 @@
+from pathlib import Path
+
+from rei_s.services.filestores.filesystem import FSFileStoreAdapter
+from rei_s.types.source_file import SourceFile
+
+
+def test_mapped_file(tmp_path: Path) -> None:
+    path = tmp_path / "text.txt"
+    path.write_text("Dagobert Düsentrieb")
+    file = SourceFile(path=path, mime_type="text/plain", file_name="text.txt")
+
+    with file.mapped() as view:
+        assert view[:8] == b"Dagobert"
+        assert len(view) == file.size
+    with file.open_stream() as stream:
+        assert stream.read(8) == b"Dagobert"
+    assert file.read_text() == "Dagobert Düsentrieb"
+
+
+def test_empty_file(tmp_path: Path) -> None:
+    path = tmp_path / "empty.txt"
+    path.touch()
+    file = SourceFile(path=path, mime_type="text/plain", file_name="empty.txt")
+
+    with file.mapped() as view:
+        assert len(view) == 0
+    assert file.read_text() == ""
+
+
+def test_file_store_copies_file(tmp_path: Path) -> None:
+    source = tmp_path / "source"
+    source.write_bytes(b"content")
+    (tmp_path / "store").mkdir()
+    file_store = FSFileStoreAdapter()
+    file_store.path = tmp_path / "store"
+
+    file_store.add_document(SourceFile(id="doc", path=source, mime_type="text/plain", file_name="doc.txt"))
+
+    assert file_store.get_document("doc").read_text() == "content"
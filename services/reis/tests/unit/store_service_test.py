@@ -0,0 +1,225 @@
+from pathlib import Path
+from threading import Event
+from typing import Generator
+
+from langchain_core.documents import Document
+import pypdf
+import pytest
+from pytest_mock import MockerFixture
+
+from rei_s.services.formats.pdf_provider import PdfProvider
+from rei_s.services.process_pool import ProcessPool
+from rei_s.services import admission
+from rei_s.services.filestores.filesystem import FSFileStoreAdapter
+from rei_s.services.store_service import add_batches, add_file, iter_file_chunks, process_pages_in_parallel
+from rei_s.services.vectorstores.devnull_store import DevNullVectorStoreAdapter
+from rei_s.types.source_file import SourceFile
+from tests.conftest import get_test_config
+
+
+class RecordingVectorStoreAdapter(DevNullVectorStoreAdapter):
+    def __init__(self) -> None:
+        self.added: list[tuple[list[Document], list[list[float]] | None]] = []
+
+    def embed_documents(self, documents: list[Document]) -> list[list[float]]:
+        return [[float(len(doc.page_content))] for doc in documents]
+
+    def add_documents(self, documents: list[Document], embeddings: list[list[float]] | None = None) -> None:
+        self.added.append((documents, embeddings))
+
+
+def make_batches(n: int) -> Generator[tuple[list[Document], int, int], None, None]:
+    for i in range(n):
+        yield [Document("x" * i), Document("y" * (i + 1))], i, n
+
+
+def test_add_batches_keeps_order() -> None:
+    store = RecordingVectorStoreAdapter()
+
+    add_batches(store, make_batches(10), "doc", concurrency=3)
+
+    assert len(store.added) == 10
+    for i, (documents, embeddings) in enumerate(store.added):
+        assert documents[0].page_content == "x" * i
+        assert embeddings == [[float(i)], [float(i + 1)]]
+
+
+def test_add_batches_embeds_ahead() -> None:
+    # the second batch needs to be embedded before the first one is inserted
+    second_embedded = Event()
+
+    class OverlappingVectorStoreAdapter(RecordingVectorStoreAdapter):
+        def embed_documents(self, documents: list[Document]) -> list[list[float]]:
+            if documents[0].page_content == "x":
+                second_embedded.set()
+            return super().embed_documents(documents)
+
+        def add_documents(self, documents: list[Document], embeddings: list[list[float]] | None = None) -> None:
+            assert second_embedded.wait(timeout=5)
+            super().add_documents(documents, embeddings)
+
+    store = OverlappingVectorStoreAdapter()
+    add_batches(store, make_batches(2), "doc", concurrency=2)
+
+    assert len(store.added) == 2
+
+
+def test_add_batches_raises_embedding_errors() -> None:
+    class FailingVectorStoreAdapter(RecordingVectorStoreAdapter):
+        def embed_documents(self, documents: list[Document]) -> list[list[float]]:
+            raise ValueError("embedding failed")
+
+    store = FailingVectorStoreAdapter()
+    with pytest.raises(ValueError, match="embedding failed"):
+        add_batches(store, make_batches(5), "doc", concurrency=2)
+
+    assert store.added == []
+
+
+def test_pages_are_processed_in_parallel_in_order(tmp_path: Path) -> None:
+    writer = pypdf.PdfWriter()
+    for _ in range(5):
+        writer.append("tests/data/birthdays.pdf")
+    writer.write(tmp_path / "long.pdf")
+    file = SourceFile(path=tmp_path / "long.pdf", mime_type="application/pdf", file_name="long.pdf")
+    pdf = PdfProvider()
+
+    pool = ProcessPool(size=2, max_tasks=100, max_rss=1024**4)
+    pool.start()
+    try:
+        pages = pdf.count_pages(file)
+        assert pages == 10
+        chunks = list(process_pages_in_parallel(pool, pdf, file, pages, None, pages_per_task=3))
+    finally:
+        pool.shutdown()
+
+    expected = pdf.process_file(file)
+    assert [c.page_content for c in chunks] == [c.page_content for c in expected]
+    assert [c.metadata for c in chunks] == [c.metadata for c in expected]
+    assert [c.metadata["page"] for c in chunks] == list(range(1, 11))
+
+
+def converted_pdf(tmp_path: Path) -> SourceFile:
+    # stands in for the conversion with LibreOffice, which is not available in the unit tests
+    path = tmp_path / "converted.pdf"
+    path.write_bytes(Path("tests/data/birthdays.pdf").read_bytes())
+    return SourceFile(id="doc", path=path, mime_type="application/pdf", file_name="birthdays.pdf")
+
+
+def test_office_files_are_chunked_without_their_pdf(mocker: MockerFixture, tmp_path: Path) -> None:
+    (tmp_path / "store").mkdir()
+    file_store = FSFileStoreAdapter()
+    file_store.path = tmp_path / "store"
+    vector_store = RecordingVectorStoreAdapter()
+    mocker.patch("rei_s.services.store_service.get_file_store", return_value=file_store)
+    mocker.patch("rei_s.services.store_service.get_vector_store", return_value=vector_store)
+    mocker.patch("rei_s.services.store_service.convert_file_to_pdf", return_value=converted_pdf(tmp_path))
+    file = SourceFile(path="tests/data/birthdays.docx", mime_type="", file_name="birthdays.docx")
+
+    add_file(get_test_config(), file, "bucket", "doc")
+
+    # the pdf is only stored, the chunks are extracted from the docx
+    assert file_store.exists("doc")
+    chunks = [chunk for documents, _embeddings in vector_store.added for chunk in documents]
+    assert chunks
+    assert all("section" in chunk.metadata and "page" not in chunk.metadata for chunk in chunks)
+
+
+def test_spreadsheet_rows_are_chunked_with_a_file_store(mocker: MockerFixture, tmp_path: Path) -> None:
+    (tmp_path / "store").mkdir()
+    file_store = FSFileStoreAdapter()
+    file_store.path = tmp_path / "store"
+    vector_store = RecordingVectorStoreAdapter()
+    mocker.patch("rei_s.services.store_service.get_file_store", return_value=file_store)
+    mocker.patch("rei_s.services.store_service.get_vector_store", return_value=vector_store)
+    mocker.patch("rei_s.services.store_service.convert_file_to_pdf", return_value=converted_pdf(tmp_path))
+    file = SourceFile(path="tests/data/birthdays.xlsx", mime_type="", file_name="birthdays.xlsx")
+
+    add_file(get_test_config(), file, "bucket", "doc")
+
+    chunks = [chunk for documents, _embeddings in vector_store.added for chunk in documents]
+    # the rows are chunked with the header of their sheet, not split by the layout of the pdf
+    assert [chunk.metadata["sheet"] for chunk in chunks] == ["BirthdaySheet", "AnniversarySheet"]
+    assert chunks[0].page_content.startswith("| Name | Birthday |")
+    assert chunks[0].metadata["format"] == "ms_excel"
+
+
+def test_pdf_is_removed_if_chunks_can_not_be_added(mocker: MockerFixture, tmp_path: Path) -> None:
+    class FailingVectorStoreAdapter(RecordingVectorStoreAdapter):
+        def add_documents(self, documents: list[Document], embeddings: list[list[float]] | None = None) -> None:
+            raise ValueError("insert failed")
+
+    file_store = FSFileStoreAdapter()
+    file_store.path = tmp_path
+    mocker.patch("rei_s.services.store_service.get_file_store", return_value=file_store)
+    mocker.patch("rei_s.services.store_service.get_vector_store", return_value=FailingVectorStoreAdapter())
+    file = SourceFile(path="tests/data/birthdays.pdf", mime_type="application/pdf", file_name="birthdays.pdf")
+
+    with pytest.raises(ValueError, match="insert failed"):
+        add_file(get_test_config(), file, "bucket", "doc")
+
+    assert not file_store.exists("doc")
+
+
+def test_no_chunks_are_added_if_pdf_can_not_be_saved(mocker: MockerFixture, tmp_path: Path) -> None:
+    class FailingFileStoreAdapter(FSFileStoreAdapter):
+        def add_document(self, document: SourceFile) -> None:
+            raise OSError("disk full")
+
+    file_store = FailingFileStoreAdapter()
+    file_store.path = tmp_path
+    vector_store = RecordingVectorStoreAdapter()
+    mocker.patch("rei_s.services.store_service.get_file_store", return_value=file_store)
+    mocker.patch("rei_s.services.store_service.get_vector_store", return_value=vector_store)
+    file = SourceFile(path="tests/data/birthdays.pdf", mime_type="application/pdf", file_name="birthdays.pdf")
+
+    with pytest.raises(OSError, match="disk full"):
+        add_file(get_test_config(), file, "bucket", "doc")
+
+    assert vector_store.added == []
+
+
+def blocking_chunks(proceed: Event) -> Generator[Document, None, None]:
+    # produces a chunk, then waits until it may produce the next one
+    yield Document(page_content="first")
+    proceed.wait(timeout=5)
+    yield Document(page_content="second")
+
+
+def test_family_slot_is_held_until_the_file_is_processed(mocker: MockerFixture) -> None:
+    config = get_test_config({"format_concurrency_pdf": 1})
+    file = SourceFile(path="tests/data/birthdays.pdf", mime_type="application/pdf", file_name="birthdays.pdf")
+    proceed = Event()
+    mocker.patch("rei_s.services.store_service.process_file_lazily", return_value=blocking_chunks(proceed))
+
+    try:
+        chunks = iter_file_chunks(config, file, PdfProvider())
+        assert next(chunks).page_content == "first"
+        # the file is still processed, even though the consumer does not ask for the next chunk
+        semaphore = admission.family_semaphores[("pdf", 1)]
+        assert not semaphore.acquire(blocking=False)
+
+        proceed.set()
+        # the remaining chunk is buffered, such that the slot is freed before the consumer is done
+        assert semaphore.acquire(timeout=5)
+        semaphore.release()
+        assert [chunk.page_content for chunk in chunks] == ["second"]
+    finally:
+        admission.family_semaphores.pop(("pdf", 1), None)
+
+
+def test_family_slot_is_freed_if_the_consumer_stops_early(mocker: MockerFixture) -> None:
+    config = get_test_config({"format_concurrency_pdf": 1})
+    file = SourceFile(path="tests/data/birthdays.pdf", mime_type="application/pdf", file_name="birthdays.pdf")
+    proceed = Event()
+    mocker.patch("rei_s.services.store_service.process_file_lazily", return_value=blocking_chunks(proceed))
+
+    try:
+        chunks = iter_file_chunks(config, file, PdfProvider())
+        next(chunks)
+        proceed.set()
+        chunks.close()
+
+        assert admission.family_semaphores[("pdf", 1)].acquire(blocking=False)
+    finally:
+        admission.family_semaphores.pop(("pdf", 1), None)
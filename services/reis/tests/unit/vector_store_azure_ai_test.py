@@ -1,8 +1,13 @@
+import asyncio
 from io import BytesIO
+from typing import Any
+
 from faker import Faker
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
 from langchain_community.embeddings import FakeEmbeddings
+from langchain_community.vectorstores.azuresearch import AzureSearch
+from langchain_core.documents import Document
 import pytest
 
 from pytest_mock import MockerFixture
@@ -39,6 +44,12 @@ def client(mocker: MockerFixture, app: FastAPI) -> TestClient:
     # mock embeddings to avoid calls to azure
     mocker.patch("rei_s.services.store_service.get_embeddings", return_value=FakeEmbeddings(size=1352))
 
+    # `responses` only intercepts the sync client, so the async search is routed through it
+    async def asimilarity_search(self: AzureSearch, *args: Any, **kwargs: Any) -> list[Document]:
+        return await asyncio.to_thread(self.similarity_search, *args, **kwargs)
+
+    mocker.patch.object(AzureSearch, "asimilarity_search", asimilarity_search)
+
     client = TestClient(app)
 
     return client
@@ -0,0 +1,42 @@
+from rei_s.services.vectorstore_adapter import VectorStoreAdapter
+from rei_s.services.vectorstore_provider import VectorStoreRegistry
+from rei_s.services.vectorstores.devnull_store import DevNullVectorStoreAdapter
+from tests.conftest import get_test_config
+
+
+def test_registry_reuses_adapters() -> None:
+    registry = VectorStoreRegistry()
+    config = get_test_config()
+    created: list[VectorStoreAdapter] = []
+
+    def factory() -> VectorStoreAdapter:
+        created.append(DevNullVectorStoreAdapter())
+        return created[-1]
+
+    first = registry.get(config, "a", factory)
+    assert registry.get(config, "a", factory) is first
+    assert registry.get(get_test_config(), "a", factory) is first
+    assert registry.get(config, "b", factory) is not first
+    assert len(created) == 2
+
+
+def test_registry_evicts_least_recently_used() -> None:
+    registry = VectorStoreRegistry()
+    config = get_test_config({"store_adapter_cache_size": 2})
+
+    a = registry.get(config, "a", DevNullVectorStoreAdapter)
+    b = registry.get(config, "b", DevNullVectorStoreAdapter)
+    assert registry.get(config, "a", DevNullVectorStoreAdapter) is a
+    registry.get(config, "c", DevNullVectorStoreAdapter)
+
+    assert registry.get(config, "a", DevNullVectorStoreAdapter) is a
+    assert registry.get(config, "b", DevNullVectorStoreAdapter) is not b
+
+
+def test_registry_can_be_disabled() -> None:
+    registry = VectorStoreRegistry()
+    config = get_test_config({"store_adapter_cache_size": 0})
+
+    assert registry.get(config, "a", DevNullVectorStoreAdapter) is not registry.get(
+        config, "a", DevNullVectorStoreAdapter
+    )